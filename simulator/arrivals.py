@@ -0,0 +1,154 @@
+"""
+Record and replay of the arrivals of the streamers.
+
+`ArrivalRecorder` writes the frames generated during a run (arrival order,
+streamer, I frame flag, timestamp and the sizes of every layer) to a binary
+file: a header (magic, length of the JSON description, JSON description of
+the streamers) followed by fixed-size packed records sorted by timestamp.
+`ArrivalReplay` feeds exactly the same frames to any scheduler, so that
+schedulers are compared on the same input (common random numbers) and the
+arrivals are only generated once.
+
+    scheduler.recorder = ArrivalRecorder("alice_bob.arrivals", streamers)
+    ... run ...
+    scheduler.recorder.close()
+
+    other.source = ArrivalReplay("alice_bob.arrivals")
+
+Trace-driven streamers are not recorded: they replay their frame trace.
+The bitrates of the replayed frames are the arrival rates of the layers.
+"""
+import json
+import os
+import struct
+import numpy as np
+from stream import Streamer
+
+MAGIC = b"ARRIVALS"
+LENGTH = struct.Struct("<I")
+
+
+def record_dtype(layers):
+    "Packed record of a frame with `layers` sizes (0 for the missing layers)"
+    return np.dtype([("order", "<i8"), ("origin", "<u2"), ("Iframe", "?"),
+                     ("timestamp", "<f8"), ("sizes", "<f8", (layers,))])
+
+
+def read_arrivals(path):
+    """Description and records (memory-mapped, read-only) of a recorded file"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an arrival record".format(path))
+        length, = LENGTH.unpack(f.read(LENGTH.size))
+        header = json.loads(f.read(length))
+    offset = len(MAGIC) + LENGTH.size + length
+    dtype = record_dtype(header["layers"])
+    if os.path.getsize(path) == offset:
+        return header, np.empty(0, dtype)
+    return header, np.memmap(path, dtype, "r", offset)
+
+
+class ArrivalRecorder:
+    """Write the arrivals of the streamers to `path` (c.f. `Scheduler.recorder`).
+    The records are buffered and written by `buffer` frames"""
+
+    def __init__(self, path, streamers, buffer=4096):
+        self.path = path
+        self.names = [s.streamer for s in streamers]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.layers = max(len(s.queues) for s in streamers)
+        self.dtype = record_dtype(self.layers)
+        self.buffer = buffer
+        self.pending = []
+        self.buffered = 0
+        self.recorded = 0
+        header = json.dumps({"streamers": self.names, "layers": self.layers}).encode()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+    def record(self, streamers, frames):
+        """Record the new frames of the last layers (as returned by
+        `Scheduler.update`). The sizes of the other layers are the ones of the
+        last frames of their queues."""
+        by_origin = {}
+        for f in frames:
+            by_origin.setdefault(f.origin, []).append(f)
+        chunks = []
+        for origin, new in by_origin.items():
+            i = self.index[origin]
+            streamer = streamers[i]
+            if streamer.traces:
+                continue
+            records = np.zeros(len(new), self.dtype)
+            records["order"] = [f.order for f in new]
+            records["origin"] = i
+            records["Iframe"] = [f.Iframe for f in new]
+            records["timestamp"] = [f.timestamp for f in new]
+            for layer, q in enumerate(streamer.queues):
+                records["sizes"][:, layer] = q.tail("size", len(new))
+            chunks.append(records)
+        if not chunks:
+            return
+        records = np.concatenate(chunks)
+        self.pending.append(records[np.lexsort((records["order"], records["timestamp"]))])
+        self.buffered += len(records)
+        if self.buffered >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            np.concatenate(self.pending).tofile(self.file)
+            self.file.flush()
+            self.recorded += self.buffered
+        self.pending = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArrivalReplay:
+    """Source replaying a recorded file (c.f. `Scheduler.source`). The frames
+    are given to the streamers of the same name, with their recorded orders."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header, self.records = read_arrivals(path)
+        self.next = 0
+        self.positions = None
+
+    @property
+    def finished(self):
+        return self.next >= len(self.records)
+
+    def replay(self, streamers, tstart, tstop):
+        """Add the recorded frames arrived before tstop to the streamers.
+        Return the new frames of the last layers"""
+        timestamps = self.records["timestamp"][self.next:]
+        end = self.next + int(np.searchsorted(timestamps, tstop, side="left"))
+        records = np.array(self.records[self.next:end])
+        self.next = end
+        if len(records) == 0:
+            return []
+        if self.positions is None:
+            names = {s.streamer: i for i, s in enumerate(streamers)}
+            self.positions = [names.get(name) for name in self.header["streamers"]]
+
+        updated_frames = []
+        for origin in np.unique(records["origin"]).tolist():
+            if self.positions[origin] is None:
+                continue
+            streamer = streamers[self.positions[origin]]
+            new = records[records["origin"] == origin]
+            sizes = new["sizes"][:, :len(streamer.queues)].T.tolist()
+            updated_frames.extend(streamer.update_batch(
+                new["order"].tolist(), new["timestamp"].tolist(), new["Iframe"].tolist(), sizes))
+        Streamer.Frame_Arrival = max(Streamer.Frame_Arrival, int(records["order"].max()) + 1)
+        return updated_frames
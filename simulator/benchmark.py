@@ -0,0 +1,453 @@
+#! python3
+"""
+Benchmarks of the simulator hot paths.
+
+Usage: python benchmark.py [-s STREAMERS] [-l LAYERS] [-d DURATION]
+                           [--json FILE] [--baseline FILE] [name ...]
+Without name, run all the benchmarks. The number of streamers, layers and
+the simulated duration are given to the benchmarks taking them.
+--json writes the results, --baseline compares them to a previous --json
+file and exits with 1 if a result is slower than the tolerance.
+"""
+import sys
+import json
+import inspect
+import argparse
+import platform
+import random
+import numpy as np
+from time import perf_counter
+import tracemalloc
+import tempfile
+from stream import Streamer, Queue, ColumnarQueue, Frame
+from receiver import Receiver
+from scheduler import RandomScheduler, FIFOScheduler
+from channel import StableChannelNoWindow, NetworkTracesChannel, NetworkTracesChannels
+from multicast import MulticastGroup
+from engine import EventEngine, Simulation
+from sweep import DEFAULT_SCENARIO
+from eventlog import EventLog
+
+TRACE = DEFAULT_SCENARIO["trace"]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    "Register a benchmark function under `name`"
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+
+def make_streamers(nb_streamers=4, nb_layers=2, arrival_rate=1500):
+    "Synthetic streamers similar to the ones of simulation.py"
+    mean_frames = [5 + i for i in range(nb_layers)]
+    return [Streamer(streamer="S{}".format(i),
+                     qnames=["L{}".format(l) for l in range(nb_layers)],
+                     priority=2, arrival_rate=arrival_rate,
+                     I_P_arrival_ratio=0.2, I_P_size_ratio=5,
+                     mean_frames=mean_frames, var_frames=[0.5] * nb_layers)
+            for i in range(nb_streamers)]
+
+
+def arrival_stamps(streamer, duration, rng):
+    "(order, timestamp) of the Poisson arrivals of a streamer, as given to Streamer.update"
+    n = rng.poisson(streamer.arrival_rate * duration / sum(streamer.mean_frames))
+    return list(enumerate(np.sort(rng.random(n) * duration).tolist()))
+
+
+def clear(streamers):
+    for s in streamers:
+        for q in s.queues:
+            q.dequeue(q.length)
+
+
+@benchmark("arrivals")
+def bench_arrivals(nb_streamers=4, nb_layers=2, duration=60, interval=0.1):
+    """Frames per second generated by `Scheduler.update` with the scalar
+    path (global random state) and the batch path (numpy Generator).
+    `interval` is the time between two updates"""
+    results = {"interval": interval}
+    for path in ["scalar", "batch"]:
+        random.seed(0)
+        np.random.seed(0)
+        streamers = make_streamers(nb_streamers, nb_layers)
+        rng = np.random.default_rng(0) if path == "batch" else None
+        scheduler = FIFOScheduler(streames=streamers, rng=rng)
+
+        frames = 0
+        elapsed = 0
+        for k in range(int(duration / interval)):
+            tstart = perf_counter()
+            frames += len(scheduler.update(k * interval, (k + 1) * interval))
+            elapsed += perf_counter() - tstart
+            clear(streamers)
+        results[path] = {"frames": frames * nb_layers, "seconds": elapsed,
+                         "frames_per_second": frames * nb_layers / elapsed}
+    results["speedup"] = (results["batch"]["frames_per_second"] /
+                          results["scalar"]["frames_per_second"])
+    return results
+
+
+@benchmark("streamer")
+def bench_streamer(nb_streamers=4, nb_layers=2, duration=60):
+    """Frames per second generated by `Streamer.update` (one Frame per layer
+    and per arrival) for `duration` seconds of arrivals of every streamer"""
+    random.seed(0)
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    streamers = make_streamers(nb_streamers, nb_layers)
+    stamps = [arrival_stamps(s, duration, rng) for s in streamers]
+
+    tstart = perf_counter()
+    for s, stamp in zip(streamers, stamps):
+        s.update(stamp)
+    elapsed = perf_counter() - tstart
+    frames = sum(len(stamp) for stamp in stamps) * nb_layers
+    return {"frames": frames, "seconds": elapsed, "frames_per_second": frames / elapsed}
+
+
+@benchmark("queue")
+def bench_queue(nb_frames=200_000, nb_layers=2, batch=1):
+    """Memory per frame and dequeue throughput of the deque of Frames (Queue)
+    against the numpy ring buffers (ColumnarQueue). Every layer holds its
+    own copy of the frames, as in Streamer.update_batch."""
+    rng = np.random.default_rng(0)
+    sizes = np.round(rng.normal(6, 0.5, nb_frames), 2).tolist()
+    orders = list(range(nb_frames))
+    IFrames = (rng.random(nb_frames) < 0.2).tolist()
+    timestamps = np.sort(rng.random(nb_frames)).tolist()
+
+    results = {"frames": nb_frames, "layers": nb_layers, "dequeue_batch": batch}
+    for queue_type in [Queue, ColumnarQueue]:
+        tracemalloc.start()
+        queues = [queue_type("L{}".format(l)) for l in range(nb_layers)]
+        for q in queues:
+            q.add_batch(sizes, orders, IFrames, "S0", 1500, timestamps)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tstart = perf_counter()
+        for _ in range(nb_frames // batch):
+            for q in queues:
+                q.dequeue(batch)
+        elapsed = perf_counter() - tstart
+        results[queue_type.__name__] = {
+            "bytes_per_frame": memory / (nb_frames * nb_layers),
+            "dequeued_frames_per_second": nb_frames * nb_layers / elapsed}
+    return results
+
+
+@benchmark("queue_ops")
+def bench_queue_ops(nb_streamers=4, nb_layers=2, duration=60, fps=30):
+    """Operations per second of `add`, `getFrames` and `dequeue` on the
+    `nb_streamers * nb_layers` queues of `duration` seconds of frames"""
+    frames = [Frame(5.0, i, i % 10 == 0, "S0", bitrate=1000, timestamp=i / fps)
+              for i in range(duration * fps)]
+    results = {"frames": len(frames) * nb_streamers * nb_layers}
+    for queue_type in [Queue, ColumnarQueue]:
+        queues = [queue_type("L{}".format(l)) for l in range(nb_streamers * nb_layers)]
+        timings = {}
+
+        tstart = perf_counter()
+        for q in queues:
+            for f in frames:
+                q.add(f)
+        timings["add"] = perf_counter() - tstart
+
+        tstart = perf_counter()
+        for q in queues:
+            for _ in range(len(frames)):
+                q.getFrames(1)
+        timings["getFrames"] = perf_counter() - tstart
+
+        tstart = perf_counter()
+        for q in queues:
+            for _ in range(len(frames)):
+                q.dequeue(1)
+        timings["dequeue"] = perf_counter() - tstart
+
+        results[queue_type.__name__] = {"{}_per_second".format(op): results["frames"] / t
+                                        for op, t in timings.items()}
+    return results
+
+
+@benchmark("channel")
+def bench_channel(nb_streamers=4, nb_layers=2, duration=60, decision_interval=0.001):
+    """Frames per second sent by `NetworkTracesChannel.send_frames` (one frame
+    per decision of every streamer)"""
+    engine = EventEngine(seed=0)
+    channel = NetworkTracesChannel(TRACE, DEFAULT_SCENARIO["traces_intertime"], clock=engine)
+    frames = [[Frame(5.0 * nb_layers, i, False, "S{}".format(s)) for s in range(nb_streamers)]
+              for i in range(int(duration / decision_interval))]
+
+    tstart = perf_counter()
+    for sent in frames:
+        engine.now += decision_interval
+        channel.send_frames(sent, decision_interval)
+    elapsed = perf_counter() - tstart
+
+    nb_frames = len(frames) * nb_streamers
+    return {"frames": nb_frames, "seconds": elapsed,
+            "frames_per_second": nb_frames / elapsed}
+
+
+@benchmark("playback")
+def bench_playback(nb_streamers=4, duration=3600, fps=30):
+    """End-of-run `Receiver.playback` of `duration` seconds of frames with the
+    frame by frame loop and the vectorized mode"""
+    rng = np.random.default_rng(0)
+    names = ["S{}".format(i) for i in range(nb_streamers)]
+    nb_frames = duration * fps
+    results = {"frames": nb_frames * nb_streamers}
+    for mode, queue_type in [("loop", Queue), ("vectorized", Queue),
+                             ("vectorized_columnar", ColumnarQueue)]:
+        receiver = Receiver(queues=[queue_type(n) for n in names], fps=fps)
+        for name in names:
+            timestamps = np.sort(rng.random(nb_frames) * duration)
+            availability = timestamps + rng.exponential(0.1, nb_frames)
+            receiver.receive([Frame(5, i, False, name, bitrate=1000, timestamp=t, availability=a)
+                              for i, (t, a) in enumerate(zip(timestamps.tolist(), availability.tolist()))])
+        tstart = perf_counter()
+        receiver.playback(vectorized=mode != "loop")
+        results[mode] = {"seconds": perf_counter() - tstart}
+    return results
+
+
+@benchmark("fifo")
+def bench_fifo(streamer_counts=(2, 10, 100, 1000), nb_frames=100_000, maxf=1000):
+    """Frames per second decided by `FIFOScheduler.decide` with `maxf` frames
+    per decision, for a growing number of streamers sharing `nb_frames`
+    arrivals"""
+    results = {"frames": nb_frames, "maxf": maxf}
+    for nb_streamers in streamer_counts:
+        random.seed(0)
+        streamers = make_streamers(nb_streamers, 2, arrival_rate=1500)
+        scheduler = FIFOScheduler(streames=streamers, rng=np.random.default_rng(0))
+        # Fill the queues with about nb_frames frames
+        scheduler.update(0, nb_frames * 6 / (1500 * nb_streamers))
+
+        decided = 0
+        tstart = perf_counter()
+        while True:
+            frames = scheduler.decide(maxf=maxf)
+            if not frames:
+                break
+            decided += len(frames)
+        elapsed = perf_counter() - tstart
+        results["{} streamers".format(nb_streamers)] = {
+            "frames": decided, "frames_per_second": decided / elapsed}
+    return results
+
+
+@benchmark("active")
+def bench_active(streamer_counts=(10, 100, 1000, 10_000), nb_active=5, nb_decisions=20_000):
+    """Decisions per second of one frame by `RandomScheduler` and
+    `FIFOScheduler` in rooms of a growing number of streamers of which only
+    `nb_active` have frames: flat if a decision does not depend on the
+    room size"""
+    results = {"active": nb_active, "decisions": nb_decisions}
+    per_streamer = nb_decisions // nb_active + 1
+    for scheduler_type in [RandomScheduler, FIFOScheduler]:
+        results[scheduler_type.__name__] = {}
+        for nb_streamers in streamer_counts:
+            random.seed(0)
+            streamers = make_streamers(nb_streamers, 2)
+            scheduler = scheduler_type(streamers)
+            for i in range(nb_active):
+                scheduler.ingest(i, [0.0] * per_streamer, [False] * per_streamer,
+                                 [[5.0] * per_streamer, [6.0] * per_streamer])
+
+            tstart = perf_counter()
+            for _ in range(nb_decisions):
+                scheduler.decide(maxf=1)
+            elapsed = perf_counter() - tstart
+            results[scheduler_type.__name__]["{} streamers".format(nb_streamers)] = {
+                "decisions_per_second": nb_decisions / elapsed}
+    return results
+
+
+def end_to_end_simulation(nb_streamers=4, nb_layers=2):
+    "FIFOScheduler on the network trace"
+    engine = EventEngine(seed=0)
+    streamers = make_streamers(nb_streamers, nb_layers, arrival_rate=1500 / nb_streamers)
+    return Simulation(FIFOScheduler(streames=streamers, rng=engine.rng),
+                      NetworkTracesChannel(TRACE, DEFAULT_SCENARIO["traces_intertime"], clock=engine),
+                      Receiver(queues=[Queue(s.streamer) for s in streamers], fps=30, clock=engine),
+                      engine)
+
+
+@benchmark("end_to_end")
+def bench_end_to_end(nb_streamers=4, nb_layers=2, duration=60):
+    """Full simulation (FIFOScheduler on the network trace) of `duration`
+    simulated seconds: simulated seconds and events per wall clock second"""
+    simulation = end_to_end_simulation(nb_streamers, nb_layers)
+    engine = simulation.engine
+    tstart = perf_counter()
+    simulation.run(duration)
+    elapsed = perf_counter() - tstart
+    return {"frames": simulation.total_sent, "seconds": elapsed,
+            "simulated_seconds_per_second": duration / elapsed,
+            "events_per_second": engine.processed / elapsed}
+
+
+@benchmark("eventlog")
+def bench_eventlog(nb_streamers=4, nb_layers=2, duration=60):
+    """Full simulation of bench_end_to_end with and without the per-frame
+    event log (eventlog.EventLog written to a temporary directory)"""
+    results = {}
+    for mode in ["off", "on"]:
+        simulation = end_to_end_simulation(nb_streamers, nb_layers)
+        with tempfile.TemporaryDirectory() as path:
+            log = EventLog(simulation, path) if mode == "on" else None
+            tstart = perf_counter()
+            simulation.run(duration)
+            if log:
+                log.close()
+            elapsed = perf_counter() - tstart
+        results[mode] = {"frames": simulation.total_sent, "seconds": elapsed}
+    results["overhead"] = results["on"]["seconds"] / results["off"]["seconds"] - 1
+    return results
+
+
+@benchmark("batch")
+def bench_batch(nb_streamers=4, nb_layers=2, duration=60, arrival_rate=20_000):
+    """Full simulation at a high arrival rate (KBps per streamer) on a fast
+    stable channel with a decision per frame (maxf=1) against batch decisions
+    sized to the capacity of the channel every 10 ms"""
+    results = {}
+    for mode, kwargs in [("per_frame", {}), ("batch", {"batch": True, "decision_interval": 0.01})]:
+        engine = EventEngine(seed=0)
+        streamers = make_streamers(nb_streamers, nb_layers, arrival_rate=arrival_rate)
+        simulation = Simulation(FIFOScheduler(streames=streamers, rng=engine.rng),
+                                StableChannelNoWindow(bandwidth=10 * arrival_rate * nb_streamers, clock=engine),
+                                Receiver(queues=[Queue(s.streamer) for s in streamers], fps=30, clock=engine),
+                                engine, **kwargs)
+        tstart = perf_counter()
+        simulation.run(duration)
+        elapsed = perf_counter() - tstart
+        results[mode] = {"frames": simulation.total_sent, "seconds": elapsed,
+                         "events_per_simulated_second": engine.processed / duration,
+                         "frames_per_second": simulation.total_sent / elapsed}
+    return results
+
+
+@benchmark("multicast")
+def bench_multicast(nb_streamers=4, nb_layers=2, duration=60, receiver_counts=(1, 10, 100, 300)):
+    """Full simulation fanned out to a growing number of receivers on the
+    network trace (MulticastGroup), with the memory of the delivery times"""
+    results = {}
+    for nb_receivers in receiver_counts:
+        engine = EventEngine(seed=0)
+        streamers = make_streamers(nb_streamers, nb_layers, arrival_rate=1500 / nb_streamers)
+        offsets = [10 * r for r in range(nb_receivers)]
+        group = MulticastGroup([NetworkTracesChannels(TRACE, DEFAULT_SCENARIO["traces_intertime"],
+                                                      offsets, clock=engine)],
+                               [s.streamer for s in streamers], fps=30, clock=engine)
+        simulation = Simulation(FIFOScheduler(streames=streamers, rng=engine.rng), group, group, engine)
+        tstart = perf_counter()
+        simulation.run(duration)
+        elapsed = perf_counter() - tstart
+        results["{} receivers".format(nb_receivers)] = {
+            "frames": simulation.total_sent, "seconds": elapsed,
+            "simulated_seconds_per_second": duration / elapsed,
+            "bytes": group.nbytes}
+    return results
+
+
+def print_results(name, results, indent=0):
+    print(" " * indent + name, ":")
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print_results(key, value, indent + 2)
+        elif isinstance(value, float):
+            print(" " * (indent + 2) + "{} : {:.4f}".format(key, value))
+        else:
+            print(" " * (indent + 2) + "{} : {}".format(key, value))
+
+
+def run(names, **params):
+    """Run the benchmarks `names` with the parameters (e.g. nb_streamers)
+    they take. Return the results by name"""
+    results = {}
+    for name in names:
+        f = BENCHMARKS[name]
+        accepted = inspect.signature(f).parameters
+        results[name] = f(**{k: v for k, v in params.items() if k in accepted and v is not None})
+    return results
+
+
+def flatten(results, prefix=""):
+    "{'a': {'b': 1}} -> {'a/b': 1}"
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "/"))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare the timings of `results` to the ones of `baseline` (both as
+    returned by `run`). Throughputs (*_per_second) are better when higher,
+    durations (seconds) and memory (bytes_*) when lower.
+
+    Return a list of (key, baseline, result, speedup, regression) where
+    regression is True if the result is more than `tolerance` worse
+    """
+    results, baseline = flatten(results), flatten(baseline)
+    comparison = []
+    for key, value in results.items():
+        metric = key.rsplit("/", 1)[-1]
+        if key not in baseline or not baseline[key] or not value:
+            continue
+        if metric.endswith("per_second"):
+            speedup = value / baseline[key]
+        elif metric == "seconds" or metric.startswith("bytes"):
+            speedup = baseline[key] / value
+        else:
+            continue
+        comparison.append((key, baseline[key], value, speedup, speedup < 1 - tolerance))
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulator hot paths")
+    parser.add_argument("names", nargs="*", help=", ".join(BENCHMARKS))
+    parser.add_argument("-s", "--streamers", type=int, dest="nb_streamers")
+    parser.add_argument("-l", "--layers", type=int, dest="nb_layers")
+    parser.add_argument("-d", "--duration", type=int)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare to the results of a previous --json")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(sorted(unknown))))
+
+    params = {"nb_streamers": args.nb_streamers, "nb_layers": args.nb_layers,
+              "duration": args.duration}
+    results = run(args.names or list(BENCHMARKS), **params)
+    for name, result in results.items():
+        print_results(name, result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__,
+                       "params": params, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print("Warning: baseline parameters {} differ".format(baseline["params"]))
+        comparison = compare(results, baseline["results"], args.tolerance)
+        print("\nComparison to", args.baseline)
+        for key, old, new, speedup, regression in comparison:
+            print("{:60} {:>14.4f} {:>14.4f} {:>7.2f}x{}".format(
+                key, old, new, speedup, "  REGRESSION" if regression else ""))
+        if any(c[-1] for c in comparison):
+            sys.exit(1)
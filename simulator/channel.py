@@ -4,130 +4,224 @@ Modeling of the Channel.
 This include a the sending delay, and transmission delay
 """
 from abc import ABC, abstractmethod
-from utils import read_network_trace, get_scaled_time
+from math import inf
+import numpy as np
+from utils import load_network_trace, get_scaled_time
 
 
 class Channel(ABC):
-    def __init__(self, scale_time=1):
-        self.get_time = get_scaled_time(scale_time)
+    """serialize: the frames share the link and are sent back-to-back: a frame
+    is delivered once the frames sent before it (in the same call or in the
+    previous ones) are. By default every frame has the link to itself."""
+
+    def __init__(self, scale_time=1, clock=None, serialize=False):
+        "clock: object with a `get_time()` method (e.g. EventEngine). Default: wall clock"
+        self.get_time = clock.get_time if clock else get_scaled_time(scale_time)
+        self.serialize = serialize
 
     @abstractmethod
-    def send_frames(self, frames):
+    def send_frames(self, frames, elapsed=0):
         """Sends data to the channel.
         update availability field of Frames
         """
 
+    @abstractmethod
+    def delivery_times(self, sizes, elapsed=0):
+        """Availability of frames of `sizes` KB sent now, as an array. Unlike
+        `send_frames`, the frames are not modified."""
+
+    @abstractmethod
+    def capacity(self, interval, elapsed=0):
+        """KB the channel can deliver during the next `interval` seconds,
+        starting `elapsed` seconds after the last sending"""
+
 
 class StableChannelNoWindow(Channel):
     "Very Simple channel modulation where tansport layer is not modeled"
-    def __init__(self, bandwidth, sending_delay=0, scale_time=1):
-        super().__init__(scale_time)
+    def __init__(self, bandwidth, sending_delay=0, scale_time=1, clock=None, serialize=False):
+        super().__init__(scale_time, clock, serialize)
         self.bandwidth = bandwidth
         self.sending_delay = sending_delay
+        self.free_at = 0  # end of the transmission of the last frame (serialize)
 
-    def send_frames(self, frames):
+    def send_frames(self, frames, elapsed=0):
         """update availability field of Frames
         Return list of time that
         """
-        for f in frames:
-            f.availability = self.get_time() + f.size / self.bandwidth + self.sending_delay
+        availability = self.delivery_times([f.size for f in frames], elapsed).tolist()
+        for f, a in zip(frames, availability):
+            f.availability = a
+
+    def delivery_times(self, sizes, elapsed=0):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if not self.serialize:
+            return self.get_time() + sizes / self.bandwidth + self.sending_delay
+        start = max(self.get_time(), self.free_at)
+        transmitted = start + np.cumsum(sizes) / self.bandwidth
+        if len(transmitted):
+            self.free_at = float(transmitted[-1])
+        return transmitted + self.sending_delay
+
+    def capacity(self, interval, elapsed=0):
+        return self.bandwidth * interval
 
     def changeBandwith(self, bandwidth):
         self.bandwidth = bandwidth
 
 
+class CapacityTrace:
+    """Cumulative capacity of a bandwidth trace sampled every `intertime`
+    seconds. The trace repeats itself after its last sample.
+
+    cumul[i] is the number of kb the channel delivers between 0 and
+    i * intertime, so the time at which some kb sent at t are delivered is
+    found with one binary search, whatever the number of samples (and outages)
+    crossed.
+    """
+
+    def __init__(self, bandwidths, intertime):
+        self.bandwidths = np.asarray(bandwidths, dtype=np.float64)
+        self.intertime = intertime
+        self.cumul = np.concatenate([[0], np.cumsum(self.bandwidths * intertime)])
+        self.period = len(self.bandwidths) * intertime
+        self.total = self.cumul[-1]  # capacity of one period
+
+    def index(self, t):
+        "Index of the sample in use at time t"
+        return int(t % self.period // self.intertime) % len(self.bandwidths)
+
+    def bandwidth_at(self, t):
+        return self.bandwidths[self.index(t)]
+
+    def capacity(self, t):
+        "kb delivered between 0 and t (t can be an array)"
+        periods, r = np.divmod(t, self.period)
+        i = (r // self.intertime).astype(np.int64) % len(self.bandwidths)
+        return periods * self.total + self.cumul[i] + (r - i * self.intertime) * self.bandwidths[i]
+
+    def delivery_time(self, t, kb):
+        """Time at which `kb` sent from t are delivered (inf if the trace has
+        no capacity). t and kb can be arrays (broadcast together)."""
+        kb = np.asarray(kb, dtype=np.float64)
+        if self.total == 0:
+            return np.where(kb > 0, inf, t)[()]
+        periods, r = np.divmod(self.capacity(t) + kb, self.total)
+        # Exact end of a period: deliver at the end of its last sample
+        end = r == 0
+        periods = np.where(end, periods - 1, periods)
+        r = np.where(end, self.total, r)
+        # Sample i is the first one with cumul[i + 1] >= r, so its bandwidth is > 0
+        i = np.searchsorted(self.cumul, r, side="left") - 1
+        delivery = periods * self.period + i * self.intertime + (r - self.cumul[i]) / self.bandwidths[i]
+        return np.where(kb > 0, delivery, t)[()]
+
+
 class NetworkTracesChannel(Channel):
-    "Very Simple channel modulation where tansport layer is not modeled"
-    def __init__(self, path, traces_intertime, scale_time=1, iprint=False):
-        super().__init__(scale_time)
-        self.trace_generator = read_network_trace(path)()
+    """Very Simple channel modulation where tansport layer is not modeled
+
+    The delivery time of a frame is computed exactly when it is sent, from the
+    cumulative capacity of the trace (c.f. CapacityTrace): it does not depend on
+    later bandwidth steps, and outages (bandwidth 0) only delay the frames, so
+    the frames in flight never have to be re-timed.
+
+    offset: time of the trace at which the channel starts, e.g. to give
+            different conditions to several receivers with the same trace.
+    """
+    def __init__(self, path, traces_intertime, scale_time=1, iprint=False, clock=None, offset=0,
+                 serialize=False):
+        super().__init__(scale_time, clock, serialize)
+        self.trace = CapacityTrace(load_network_trace(path), traces_intertime)
         self.path = path
         self.traces_intertime = traces_intertime
-        self.current_time = 0
-        self.current_bandwidth = next(self.trace_generator)
-        self.queue = []
-        self.trace_update = 0
+        self.current_time = offset
+        self.current_bandwidth = self.trace.bandwidth_at(offset)
+        self.trace_update = offset
         self.iprint = iprint
+        self.free_at = offset  # on the trace clock (serialize)
 
     def get_next_bandwidth(self, elapsed):
-        t_left = self.traces_intertime - self.current_time % self.traces_intertime
         self.current_time += elapsed
-        if self.current_time > self.trace_update:
+        if self.iprint and self.current_time > self.trace_update:
             print("Cumulated current time: {:.2f}".format(self.current_time))
             self.trace_update += 5
-        if elapsed < t_left:
-            return self.current_bandwidth
-
-        to_fwd = int((elapsed - t_left) // self.traces_intertime) + 1
-        for _ in range(to_fwd):
-            try:
-                bandwidth = next(self.trace_generator)
-            except StopIteration:
-                # Reset the iterator
-                self.trace_generator = read_network_trace(self.path)()
-                bandwidth = next(self.trace_generator)
-
-        self.current_bandwidth = bandwidth
+        self.current_bandwidth = self.trace.bandwidth_at(self.current_time)
         return self.current_bandwidth
 
+    def capacity(self, interval, elapsed=0):
+        start = self.current_time + elapsed
+        return float(self.trace.capacity(start + interval) - self.trace.capacity(start))
 
-    def update_availability_frame_sent(self, old_bandwidth):
-
-        new_queue = []
-        if self.iprint:
+    def delivery_times(self, sizes, elapsed=0):
+        old_bandwidth = self.current_bandwidth
+        self.current_bandwidth = self.get_next_bandwidth(elapsed)
+        if self.iprint and old_bandwidth != self.current_bandwidth:
             print("Bandwidth is being updated: {} old -> {}".format(old_bandwidth,
                                                                 self.current_bandwidth))
-        if self.current_bandwidth == 0:
-            for f, _ in self.queue:
-                t = self.get_time()
-                if f.availability >= t:
-                    f.availability = None
-                    # updated_kb_sent = elapsed * old_bandwidth + kb_sent
-
-
 
-        for frame, kb_sent in self.queue:
-            t = self.get_time()
-
-            # The frame is already available in
-            if frame.availability is not None and frame.availability < t:
-                continue
-
-            updated_kb_sent = kb_sent
-            # compute the new availability here
-            if self.current_bandwidth == 0:
-                # Introduce some bias since it does not consider the kb that has been sent before switching to 0
-                frame.availability = None
-
-            elif frame.availability is None:
-                frame.availability = t + (frame.size - kb_sent) / self.current_bandwidth
-                frame.sent = t
-
-            else:
-                elapsed = t - frame.sent
-                frame.availability = t + max((frame.size - kb_sent)/ self.current_bandwidth, 0)
-                updated_kb_sent = elapsed * old_bandwidth + kb_sent
-
-            new_queue.append((frame, updated_kb_sent))
-
-        self.queue = new_queue
+        t = self.get_time()
+        # Delivery time on the trace clock, shifted to the simulation clock
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if not self.serialize:
+            return t + self.trace.delivery_time(self.current_time, sizes) - self.current_time
+        delivery = self.trace.delivery_time(max(self.current_time, self.free_at), np.cumsum(sizes))
+        if len(delivery):
+            self.free_at = float(delivery[-1])
+        return t + delivery - self.current_time
 
     def send_frames(self, frames, elapsed):
         """update availability field of Frames
         Return list of time that
         """
-        old_bandwidth = self.current_bandwidth
-        self.current_bandwidth = self.get_next_bandwidth(elapsed)
-        if old_bandwidth != self.current_bandwidth:
-            self.update_availability_frame_sent(old_bandwidth)
-
-        for f in frames:
-            if self.current_bandwidth > 0:
-                f.sent = self.get_time()
-                #print(f.describe(), " => sent at ", f.sent)
-                f.availability = f.sent + f.size / self.current_bandwidth
+        availability = self.delivery_times([f.size for f in frames], elapsed).tolist()
+        t = self.get_time()
+        for f, a in zip(frames, availability):
+            f.sent = t
+            f.availability = a
+            #print(f.describe(), " => sent at ", f.sent)
+
+
+class NetworkTracesChannels(Channel):
+    """Channels of several receivers on the same network trace, starting at
+    different `offsets` of the trace (c.f. NetworkTracesChannel). The delivery
+    times of all the receivers are computed at once, one row per receiver
+    (c.f. `multicast.MulticastGroup`)."""
+
+    def __init__(self, path, traces_intertime, offsets, scale_time=1, clock=None, serialize=False):
+        super().__init__(scale_time, clock, serialize)
+        self.trace = CapacityTrace(load_network_trace(path), traces_intertime)
+        self.path = path
+        self.traces_intertime = traces_intertime
+        self.current_time = np.array(offsets, dtype=np.float64)
+        self.receivers = len(self.current_time)
+        self.free_at = np.array(self.current_time)  # on the trace clock (serialize)
 
-            self.queue.append((f, 0))
+    def delivery_times(self, sizes, elapsed=0):
+        self.current_time += elapsed
+        t = self.get_time()
+        current = self.current_time[:, None]
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if not self.serialize:
+            return t + self.trace.delivery_time(current, sizes) - current
+        start = np.maximum(self.current_time, self.free_at)[:, None]
+        delivery = self.trace.delivery_time(start, np.cumsum(sizes))
+        if sizes.size:
+            self.free_at = delivery[:, -1]
+        return t + delivery - current
+
+    def capacity(self, interval, elapsed=0):
+        "Capacity of the slowest receiver"
+        start = self.current_time + elapsed
+        return float(np.min(self.trace.capacity(start + interval) - self.trace.capacity(start)))
+
+    def send_frames(self, frames, elapsed=0):
+        """update the sent and availability fields of Frames. A Frame has one
+        availability: the time it is delivered to every receiver (use
+        `delivery_times` for the delivery to each receiver)"""
+        availability = self.delivery_times([f.size for f in frames], elapsed)
+        t = self.get_time()
+        for f, a in zip(frames, availability.max(axis=0).tolist()):
+            f.sent = t
+            f.availability = a
 
 
 # Simple test
@@ -147,6 +241,6 @@ if __name__ == "__main__":
         cum_elapsed += elapsed
         to_pick = int(cum_elapsed //0.5)
         #  get_next_bandwidth error
-        assert sc.get_next_bandwidth(elapsed), first_20_traces[to_pick]
+        assert sc.get_next_bandwidth(elapsed) == first_20_traces[to_pick]
 
 # Maybe to simulate the window consider the length of frames
@@ -0,0 +1,218 @@
+"""
+Discrete-event engine running the simulation on a virtual clock.
+
+Instead of reading the wall clock, every module asks the engine for the
+current simulated time (`get_time`). Events are kept in a heap and processed
+in time order so a run goes as fast as the CPU allows and is reproducible
+for a given seed.
+"""
+import heapq
+import random
+import numpy as np
+from stream import Streamer
+
+# Event kinds. At equal time, events are processed in this order.
+ARRIVAL = 0
+DECISION = 1
+TRANSMISSION = 2
+PLAYBACK = 3
+
+
+class EventEngine:
+    """Simulated clock and event heap.
+
+    seed: if given, seeds the global `random` and `numpy.random` states so that
+          two runs with the same seed give identical results.
+    rng: numpy.random.Generator of the simulation (seeded with `seed`), to be
+         given to the scheduler for batch arrivals.
+    """
+
+    def __init__(self, start=0, seed=None):
+        self.now = start
+        self.heap = []
+        self.seq = 0  # tie breaker: keeps insertion order for equal events
+        self.processed = 0
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+
+    def get_time(self):
+        "Current simulated time"
+        return self.now
+
+    def schedule(self, t, kind, callback, *args):
+        "Schedule `callback(*args)` at the simulated time t"
+        if t < self.now:
+            raise ValueError("Cannot schedule an event in the past: {} < {}".format(t, self.now))
+        heapq.heappush(self.heap, (t, kind, self.seq, callback, args))
+        self.seq += 1
+
+    def schedule_in(self, delay, kind, callback, *args):
+        "Schedule `callback(*args)` `delay` seconds from now"
+        self.schedule(self.now + delay, kind, callback, *args)
+
+    def step(self):
+        "Process the next event. Return False if there is no event left"
+        if not self.heap:
+            return False
+        t, _, _, callback, args = heapq.heappop(self.heap)
+        self.now = t
+        self.processed += 1
+        callback(*args)
+        return True
+
+    def cancel(self, kind):
+        "Remove the events of `kind` from the heap. Return them in time order"
+        events = sorted([e for e in self.heap if e[1] == kind], key=lambda e: e[:3])
+        self.heap = [e for e in self.heap if e[1] != kind]
+        heapq.heapify(self.heap)
+        return [(t, callback, args) for t, _, _, callback, args in events]
+
+    def run(self, until=None):
+        """Process the events in time order until the heap is empty or the
+        next event happens after `until`. The clock ends at `until`."""
+        while self.heap and (until is None or self.heap[0][0] <= until):
+            self.step()
+        if until is not None and until > self.now:
+            self.now = until
+
+
+class Simulation:
+    """Plug the scheduler, the channel and the receiver into an EventEngine.
+
+    Events:
+     ARRIVAL every `arrival_interval`: new frames enter the streamer queues
+     DECISION every `decision_interval` while frames are waiting: the
+        scheduler decides, the channel sends and the receiver receives.
+        The scheduler goes idle when the queues are empty and is woken up by
+        the next arrival.
+        With `batch=True`, the scheduler decides all the frames that fit in
+        the capacity of the channel for the next decision interval (plus the
+        KB left over from the previous decisions, at most one interval of
+        capacity more than the frame that did not fit) instead of at most maxf.
+    If `drop_delay` is given, the P-frames waiting for more than drop_delay
+        are dropped before each decision (c.f. `Scheduler.drop_expired`) and
+        the metrics report them per streamer (expired_frames, expired_kb).
+    TRANSMISSION at the availability of each frame sent to a bounded
+        receiver: the frame reaches the receiver, after the frames of the same
+        stream sent before it (in order delivery). An unbounded receiver gets
+        the frames when they are sent, since it only plays them after the run
+        from their availability.
+    PLAYBACK every `playback_interval` if the receiver is bounded: the
+        receiver plays the frames (`Receiver.play_until`) and
+        `monitor(now, receiver.running_metrics())` is called if given.
+
+    The channel and the receiver must have been created with `clock=engine`.
+    """
+
+    def __init__(self, scheduler, channel, receiver, engine,
+                 decision_interval=0.001, arrival_interval=0.01, maxf=1,
+                 playback_interval=1, monitor=None, drop_delay=None, batch=False):
+        self.scheduler = scheduler
+        self.channel = channel
+        self.receiver = receiver
+        self.engine = engine
+        self.decision_interval = decision_interval
+        self.arrival_interval = arrival_interval
+        self.maxf = maxf
+        self.playback_interval = playback_interval
+        self.monitor = monitor
+        self.drop_delay = drop_delay
+        self.batch = batch
+        self.credit = 0  # KB of the budget not used by the last decision (batch)
+        self.idle = True
+        self.started = False
+        self.last_send = engine.now
+        self.total_sent = 0
+        self.last_delivery = {}  # origin: time of the last frame delivered (bounded receiver)
+        # Arrival orders are global to the process: each simulation restarts them
+        Streamer.Frame_Arrival = 0
+
+    def start(self, waiting=0):
+        "Start the receiver and schedule the first events"
+        self.started = True
+        self.receiver.start(waiting=waiting)
+        self.last_send = self.engine.now
+        self.engine.schedule_in(self.arrival_interval, ARRIVAL, self.on_arrival)
+        if self.receiver.bounded and self.playback_interval:
+            self.engine.schedule_in(self.playback_interval, PLAYBACK, self.on_playback)
+
+    def on_arrival(self):
+        now = self.engine.now
+        new_frames = self.scheduler.update(now - self.arrival_interval, now)
+        if new_frames and self.idle:
+            self.idle = False
+            self.engine.schedule(now, DECISION, self.on_decision)
+        self.engine.schedule_in(self.arrival_interval, ARRIVAL, self.on_arrival)
+
+    def on_decision(self):
+        if self.drop_delay is not None:
+            self.scheduler.drop_expired(self.engine.now, self.drop_delay)
+        now = self.engine.now
+        if self.batch:
+            capacity = self.channel.capacity(self.decision_interval, now - self.last_send)
+            budget = self.credit + capacity
+            frames = self.scheduler.decide(budget=budget)
+        else:
+            frames = self.scheduler.decide(maxf=self.maxf)
+        if frames is False or not (frames or self.batch):
+            self.idle = True
+            self.credit = 0
+            return
+        if frames:
+            self.send(frames, now)
+        if self.batch:
+            # Frames waiting: keep what is left of the budget, up to the
+            # capacity of one interval on top of the frame that did not fit
+            self.credit = min(budget - sum([f.size for f in frames]),
+                              capacity + self.scheduler.blocked)
+        self.engine.schedule_in(self.decision_interval, DECISION, self.on_decision)
+
+    def on_playback(self):
+        now = self.engine.now
+        self.receiver.play_until(now)
+        if self.monitor:
+            self.monitor(now, self.receiver.running_metrics())
+        self.engine.schedule_in(self.playback_interval, PLAYBACK, self.on_playback)
+
+    def send(self, frames, now):
+        self.total_sent += len(frames)
+        self.channel.send_frames(frames, now - self.last_send)
+        self.last_send = now
+        if not self.receiver.bounded:
+            # Played after the run from their availability
+            self.receiver.receive(frames)
+            return
+        for frame in frames:
+            t = frame.availability
+            # NaN or None: availability unknown, delivered at once
+            t = t if t is not None and t >= now else now
+            # The frames of a stream are delivered in the order they were sent
+            t = self.last_delivery[frame.origin] = max(t, self.last_delivery.get(frame.origin, t))
+            self.engine.schedule(t, TRANSMISSION, self.receiver.receive, [frame])
+
+    def deliver_in_flight(self):
+        """Bounded receiver: deliver the frames still in flight, each one after
+        playing the frames starting before its availability (end of a run)"""
+        for t, receive, args in self.engine.cancel(TRANSMISSION):
+            self.receiver.play_until(t)
+            receive(*args)
+
+    def run(self, duration, waiting=0):
+        """Run the simulation for `duration` simulated seconds (started
+        if it was not, e.g. after a warm-up c.f. `snapshot.warm_up`).
+        Return the QoE metrics of `Receiver.playback()`"""
+        if not self.started:
+            self.start(waiting)
+        self.engine.run(until=self.engine.now + duration)
+        if self.receiver.bounded:
+            self.deliver_in_flight()
+        metrics = self.receiver.playback()
+        if self.drop_delay is not None:
+            for s in self.scheduler.streamers:
+                if metrics.get(s.streamer):
+                    metrics[s.streamer].update(expired_frames=s.dropped_frames,
+                                               expired_kb=round(s.dropped_kb, 6))
+        return metrics
@@ -0,0 +1,228 @@
+"""
+Gym-style environments to train learning-based schedulers.
+
+`SchedulingEnv` runs one simulation (c.f. sweep.DEFAULT_SCENARIO) and lets
+the agent take the decisions: each step sends the frames of the action and
+advances the simulated clock by `decision_interval`.
+
+ action: (streamer, layer, nframes). nframes frames of the layer are sent
+         from the head of the streamer queues (nframes = 0: send nothing,
+         layer -1: last layer)
+ observation: {"queues": (streamers, 3) array of the number of frames
+               waiting, their load (KB, last layer) and the age of the head
+               of line frame (s), "bandwidth": KBps of the channel for the
+               next step}
+ reward: QoE delta of the frames played during the step (c.f. `reward`)
+
+`VectorEnv` steps K instances in lockstep with stacked arrays, in process or
+sharded across worker processes. An instance reaching the end of its
+`duration` is reset: its observation is the first one of the new episode and
+its last metrics are in infos[k]["final_metrics"].
+
+    envs = VectorEnv(scenario, 64, workers=4)
+    obs = envs.reset(seed=0)
+    obs, rewards, terminated, truncated, infos = envs.step(actions)  # actions: (64, 3)
+"""
+import multiprocessing
+import sys
+import time
+import numpy as np
+from sweep import DEFAULT_SCENARIO, build_simulation
+
+# Weights of the QoE delta: bitrate of the frames played (per MBps), time
+# spent rebuffering and delay of the frames played (per s)
+REWARD_WEIGHTS = {"bitrate": 1.0, "rebuffering": 10.0, "delay": 1.0}
+
+
+def reward(before, after, weights=REWARD_WEIGHTS):
+    """QoE delta between two running metrics (c.f. `Receiver.played`) of a
+    streamer: bitrate of the frames played minus rebuffering and delay"""
+    return (weights["bitrate"] * (after["average_rate"] - before["average_rate"]) / 1000
+            - weights["rebuffering"] * (after["total_rebuffering_time"] - before["total_rebuffering_time"])
+            - weights["delay"] * (after["total_delay"] - before["total_delay"]))
+
+
+class SchedulingEnv:
+    """One simulation driven by the actions of the agent.
+
+    scenario: c.f. sweep.DEFAULT_SCENARIO (the receiver is bounded so that
+              the frames are played as the clock advances)
+    weights: c.f. REWARD_WEIGHTS
+    """
+
+    def __init__(self, scenario=None, weights=None):
+        self.scenario = dict(scenario or DEFAULT_SCENARIO, bounded=True, playback_interval=0)
+        self.weights = weights or REWARD_WEIGHTS
+        self.simulation = None
+        self.end = 0
+
+    def reset(self, seed=None):
+        "Start a new episode. Return the first observation"
+        scenario = self.scenario if seed is None else dict(self.scenario, seed=seed)
+        self.simulation = build_simulation(scenario)
+        self.streamers = self.simulation.scheduler.streamers
+        self.simulation.start()
+        # The agent decides: the simulation never schedules decisions
+        self.simulation.idle = False
+        self.end = self.simulation.engine.now + scenario["duration"]
+        self.played = [dict(p) for p in self.simulation.receiver.played]
+        return self.observation()
+
+    def observation(self):
+        simulation = self.simulation
+        now = simulation.engine.now
+        queues = np.zeros((len(self.streamers), 3))
+        for i, s in enumerate(self.streamers):
+            q = s.queues[-1]
+            if q.length:
+                queues[i] = q.length, q.load, now - q.peek("timestamp")
+        interval = simulation.decision_interval
+        bandwidth = simulation.channel.capacity(interval, now - simulation.last_send) / interval
+        return {"queues": queues, "bandwidth": bandwidth}
+
+    def step(self, action):
+        """Send the frames of the action (streamer, layer, nframes) and advance
+        the clock by one decision interval.
+        Return observation, reward, terminated, truncated, info"""
+        simulation = self.simulation
+        streamer, layer, nframes = (int(a) for a in action)
+        s = self.streamers[streamer]
+        layer %= len(s.queues)
+        nframes = min(nframes, s.queues[layer].length)
+        if nframes > 0:
+            simulation.send(s.dequeue(layer, nframes), simulation.engine.now)
+
+        now = min(simulation.engine.now + simulation.decision_interval, self.end)
+        simulation.engine.run(until=now)
+        receiver = simulation.receiver
+        receiver.play_until(now)
+        rewards = [reward(before, after, self.weights)
+                   for before, after in zip(self.played, receiver.played)]
+        self.played = [dict(p) for p in receiver.played]
+
+        truncated = now >= self.end
+        info = {"sent": nframes, "rewards": rewards}
+        if truncated:
+            simulation.deliver_in_flight()
+            info["final_metrics"] = receiver.playback()
+        return self.observation(), sum(rewards), False, truncated, info
+
+
+def stack(observations):
+    return {key: np.stack([o[key] for o in observations]) for key in observations[0]}
+
+
+class _Shard:
+    "Environments of one process"
+
+    def __init__(self, scenarios, weights):
+        self.envs = [SchedulingEnv(s, weights) for s in scenarios]
+
+    def reset(self, seeds):
+        return [env.reset(seed) for env, seed in zip(self.envs, seeds)]
+
+    def step(self, actions):
+        results = []
+        for env, action in zip(self.envs, actions):
+            obs, reward, terminated, truncated, info = env.step(action)
+            if terminated or truncated:
+                obs = env.reset(env.simulation.engine.seed + 1)
+            results.append((obs, reward, terminated, truncated, info))
+        return results
+
+
+def _worker(connection, scenarios, weights):
+    shard = _Shard(scenarios, weights)
+    while True:
+        command, args = connection.recv()
+        if command == "close":
+            break
+        connection.send(getattr(shard, command)(args))
+    connection.close()
+
+
+class VectorEnv:
+    """K instances of SchedulingEnv stepped in lockstep.
+
+    scenarios: one scenario for all instances or a list of K scenarios
+    workers: number of worker processes (0: in process). The instances are
+             split into contiguous shards, one per worker.
+    """
+
+    def __init__(self, scenarios=None, num_envs=None, workers=0, weights=None):
+        if scenarios is None or isinstance(scenarios, dict):
+            scenarios = [scenarios or DEFAULT_SCENARIO] * (num_envs or 1)
+        self.num_envs = len(scenarios)
+        self.workers = workers
+        if workers:
+            bounds = np.linspace(0, self.num_envs, workers + 1).astype(int)
+            self.shards = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+            self.connections = []
+            self.processes = []
+            for shard in self.shards:
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_worker,
+                                                  args=(child, scenarios[shard], weights),
+                                                  daemon=True)
+                process.start()
+                self.connections.append(parent)
+                self.processes.append(process)
+        else:
+            self.shards = [slice(0, self.num_envs)]
+            self.local = _Shard(scenarios, weights)
+
+    def _call(self, command, args):
+        "Run the command on every shard with its part of args"
+        if not self.workers:
+            return getattr(self.local, command)(args)
+        for connection, shard in zip(self.connections, self.shards):
+            connection.send((command, args[shard]))
+        return [r for connection in self.connections for r in connection.recv()]
+
+    def reset(self, seed=0):
+        """Reset all the instances, each with a seed spawned from `seed`.
+        Return the stacked observations"""
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(self.num_envs)]
+        return stack(self._call("reset", seeds))
+
+    def step(self, actions):
+        """actions: (K, 3) array of (streamer, layer, nframes)
+        Return the stacked observations, the rewards, terminated and truncated
+        flags (K arrays) and the infos"""
+        results = self._call("step", np.asarray(actions))
+        observations, rewards, terminated, truncated, infos = zip(*results)
+        return (stack(observations), np.array(rewards), np.array(terminated),
+                np.array(truncated), list(infos))
+
+    def close(self):
+        if self.workers:
+            for connection in self.connections:
+                connection.send(("close", None))
+            for process in self.processes:
+                process.join()
+            self.workers = 0
+
+
+def greedy_actions(observations):
+    "Oldest head of line frame first, highest layer, one frame"
+    queues = observations["queues"]
+    streamer = np.argmax(queues[:, :, 2], axis=1)
+    nframes = (queues[np.arange(len(queues)), streamer, 0] > 0).astype(int)
+    return np.stack([streamer, np.full_like(streamer, -1), nframes], axis=1)
+
+
+if __name__ == "__main__":
+    num_envs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    envs = VectorEnv(dict(DEFAULT_SCENARIO, duration=5), num_envs, workers)
+    obs = envs.reset()
+    steps = 0
+    total = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < 5:
+        obs, rewards, _, _, _ = envs.step(greedy_actions(obs))
+        steps += num_envs
+        total += rewards.sum()
+    elapsed = time.perf_counter() - start
+    envs.close()
+    print("{} environment steps/s, mean reward {:.3f}".format(int(steps / elapsed), total / steps))
@@ -0,0 +1,256 @@
+#! python3
+"""
+Per-frame event log of a simulation, streamed to disk in columnar chunks.
+
+`EventLog(simulation, path)` records the life of the frames in four tables,
+joined on the arrival order of the frames:
+ decided: order, origin, layer, timestamp (arrival), time (decision), size
+ sent: order, origin, sent, availability
+ played: order, origin, start (start of play on the receiver)
+ dropped: order, origin, timestamp, time, size and reason: EXPIRED for the
+          P-frames dropped by the server (c.f. `Scheduler.drop_expired`),
+          BUFFER for the frames dropped by a full receiver buffer
+origin is the index of the streamer in the scheduler.
+
+The rows are buffered in typed arrays of `chunk` rows. A full chunk is
+appended to one flat binary file per column (<path>/<table>.<column>.bin),
+so the memory does not grow with the run. `close()` writes
+<path>/schema.json (streamers, dtypes and number of rows) and `load(path)`
+memory-maps the columns.
+
+Like `instrument.Instrumentation`, the log wraps the methods of the
+simulation (Streamer.dequeue and drop_expired, Channel.send_frames) with
+instance attributes and the receiver calls it through `Receiver.events`.
+
+    with EventLog(simulation, "run.log"):
+        simulation.run(600)
+    frames = lifecycle(load("run.log"))
+"""
+import json
+import os
+import sys
+from array import array
+from itertools import repeat
+import numpy as np
+from stream import FrameBatch
+
+TABLES = {
+    "decided": [("order", "<i8"), ("origin", "<i4"), ("layer", "<i2"), ("timestamp", "<f8"),
+                ("time", "<f8"), ("size", "<f8")],
+    "sent": [("order", "<i8"), ("origin", "<i4"), ("sent", "<f8"), ("availability", "<f8")],
+    "played": [("order", "<i8"), ("origin", "<i4"), ("start", "<f8")],
+    "dropped": [("order", "<i8"), ("origin", "<i4"), ("timestamp", "<f8"), ("time", "<f8"),
+                ("size", "<f8"), ("reason", "<i1")],
+}
+EXPIRED = 0
+BUFFER = 1
+TYPECODES = {"<i8": "q", "<i4": "i", "<i2": "h", "<i1": "b", "<f8": "d"}
+
+
+def column(frames, name):
+    "Values of the attribute `name` of a list of frames or a FrameBatch"
+    if isinstance(frames, FrameBatch):
+        return frames.column(name).tolist()
+    return [getattr(f, name) for f in frames]
+
+
+class ChunkedTable:
+    """Table written `chunk` rows at a time, one binary file per column.
+    The rows are buffered in typed arrays (array.array)"""
+
+    def __init__(self, path, name, columns, chunk):
+        self.name = name
+        self.columns = columns
+        self.chunk = chunk
+        self.buffers = {c: array(TYPECODES[dtype]) for c, dtype in columns}
+        self.files = {c: open(os.path.join(path, "{}.{}.bin".format(name, c)), "wb")
+                      for c, _ in columns}
+        self.size = 0  # rows in the buffers
+        self.rows = 0  # rows written
+
+    def append(self, n, **values):
+        """Append n rows. values: for each column, a list (or array) of n
+        values or one value for all the rows"""
+        for c, buffer in self.buffers.items():
+            value = values[c]
+            if isinstance(value, list):
+                buffer.extend(value)
+            elif isinstance(value, np.ndarray):
+                buffer.extend(value.tolist())
+            else:
+                buffer.extend(repeat(value, n))
+        self.size += n
+        while self.size >= self.chunk:
+            self.flush(self.chunk)
+
+    def flush(self, rows=None):
+        "Write `rows` rows (all by default)"
+        rows = self.size if rows is None else rows
+        if rows == 0:
+            return
+        for c, buffer in self.buffers.items():
+            written = buffer[:rows]
+            if sys.byteorder == "big":
+                written.byteswap()
+            written.tofile(self.files[c])
+            del buffer[:rows]
+        self.rows += rows
+        self.size -= rows
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+class EventLog:
+    """Log of the frames of `simulation` in the directory `path`.
+
+    The channel must set the availability of the frames it sends (i.e. not a
+    MulticastGroup).
+    """
+
+    def __init__(self, simulation, path, chunk=65536):
+        self.simulation = simulation
+        self.path = path
+        self.chunk = chunk
+        os.makedirs(path, exist_ok=True)
+        self.tables = {name: ChunkedTable(path, name, columns, chunk)
+                       for name, columns in TABLES.items()}
+        streamers = simulation.scheduler.streamers
+        self.names = [s.streamer for s in streamers]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.get_time = simulation.engine.get_time
+        self.wrapped = []
+
+        for i, streamer in enumerate(streamers):
+            self.wrap(streamer, "dequeue", self.logged_dequeue(streamer, i))
+            self.wrap(streamer, "drop_expired", self.logged_drop_expired(streamer, i))
+        self.wrap(simulation.channel, "send_frames", self.logged_send_frames(simulation.channel))
+        simulation.receiver.events = self
+
+    def wrap(self, obj, method, wrapper):
+        setattr(obj, method, wrapper)
+        self.wrapped.append((obj, method))
+
+    def logged_dequeue(self, streamer, i):
+        original = streamer.dequeue
+
+        def dequeue(queue_num, n=1):
+            frames = original(queue_num, n)
+            if len(frames):
+                self.tables["decided"].append(
+                    len(frames), order=column(frames, "order"), origin=i, layer=queue_num,
+                    timestamp=column(frames, "timestamp"), time=self.get_time(),
+                    size=column(frames, "size"))
+            return frames
+        return dequeue
+
+    def logged_drop_expired(self, streamer, i):
+        original = streamer.drop_expired
+
+        def drop_expired(cutoff):
+            # The P-frames among the first expired ones are dropped
+            q = streamer.queues[-1]
+            n = q.expired(cutoff)
+            if n:
+                dropped = ~q.column("Iframe", n).astype(bool)
+                self.tables["dropped"].append(
+                    int(dropped.sum()), order=q.column("order", n)[dropped], origin=i,
+                    timestamp=q.column("timestamp", n)[dropped], time=self.get_time(),
+                    size=q.column("size", n)[dropped], reason=EXPIRED)
+            return original(cutoff)
+        return drop_expired
+
+    def logged_send_frames(self, channel):
+        original = channel.send_frames
+
+        def send_frames(frames, elapsed=0):
+            result = original(frames, elapsed)
+            if len(frames):
+                self.tables["sent"].append(
+                    len(frames), order=column(frames, "order"),
+                    origin=[self.index[f.origin] for f in frames],
+                    sent=column(frames, "sent"), availability=column(frames, "availability"))
+            return result
+        return send_frames
+
+    def played(self, origin, orders, starts):
+        "Called by the receiver with the frames of `origin` starting to play at `starts`"
+        self.tables["played"].append(len(orders), order=orders, origin=self.index[origin],
+                                     start=starts)
+
+    def buffer_drop(self, frame):
+        "Called by the receiver when its buffer is full"
+        self.tables["dropped"].append(1, order=frame.order, origin=self.index[frame.origin],
+                                      timestamp=frame.timestamp, time=self.get_time(),
+                                      size=frame.size, reason=BUFFER)
+
+    def close(self):
+        "Write the chunks left and the schema, and restore the simulation"
+        for table in self.tables.values():
+            table.close()
+        schema = {"streamers": self.names, "chunk": self.chunk,
+                  "tables": {name: {"rows": table.rows, "columns": dict(table.columns)}
+                             for name, table in self.tables.items()}}
+        with open(os.path.join(self.path, "schema.json"), "w") as f:
+            json.dump(schema, f, indent=1)
+        for obj, method in self.wrapped:
+            delattr(obj, method)
+        self.wrapped = []
+        self.simulation.receiver.events = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load(path):
+    """Tables of a log: {table: {column: read-only memory-mapped array}} and
+    the streamers under the key "streamers\""""
+    with open(os.path.join(path, "schema.json")) as f:
+        schema = json.load(f)
+    tables = {"streamers": schema["streamers"]}
+    for name, table in schema["tables"].items():
+        tables[name] = {}
+        for c, dtype in table["columns"].items():
+            if table["rows"] == 0:
+                tables[name][c] = np.empty(0, dtype)
+            else:
+                tables[name][c] = np.memmap(os.path.join(path, "{}.{}.bin".format(name, c)),
+                                            dtype, "r", shape=(table["rows"],))
+    return tables
+
+
+def lifecycle(tables):
+    """One row per frame decided: the columns of `decided` with the sent,
+    availability and start times (NaN if unknown) and a `dropped` flag
+    (dropped by the receiver)"""
+    decided = tables["decided"]
+    frames = {c: np.asarray(values) for c, values in decided.items()}
+    orders = frames["order"]
+    for name, columns in [("sent", ["sent", "availability"]), ("played", ["start"])]:
+        table = tables[name]
+        sorter = np.argsort(table["order"], kind="stable")
+        position = np.searchsorted(table["order"], orders, sorter=sorter)
+        found = position < len(sorter)
+        found[found] = table["order"][sorter[position[found]]] == orders[found]
+        for c in columns:
+            values = np.full(len(orders), np.nan)
+            values[found] = table[c][sorter[position[found]]]
+            frames[c] = values
+    dropped = tables["dropped"]
+    frames["dropped"] = np.isin(orders, dropped["order"][dropped["reason"] == BUFFER])
+    return frames
+
+
+if __name__ == "__main__":
+    tables = load(sys.argv[1])
+    print("Streamers: {}".format(", ".join(tables["streamers"])))
+    for name in TABLES:
+        print("{}: {} rows".format(name, len(tables[name]["order"])))
+    frames = lifecycle(tables)
+    if len(frames["order"]):
+        print("Mean delay to play: {:.3f} s".format(np.nanmean(frames["start"] - frames["timestamp"])))
@@ -0,0 +1,171 @@
+#! python3
+"""
+Per-phase instrumentation of a Simulation.
+
+`Instrumentation(simulation)` wraps the methods of the scheduler, channel
+and receiver of the simulation so that every call records its wall clock
+duration and the number of frames it handled:
+ update: Scheduler.update (arrivals)
+ decide: Scheduler.decide
+ send: Channel.send_frames
+ receive: Receiver.receive
+ play: Receiver.play_until (bounded receiver)
+ playback: Receiver.playback
+
+The wrappers are instance attributes: `detach()` removes them, and a
+simulation that is not instrumented runs the original methods directly.
+
+`profile(simulation, duration)` runs a simulation under cProfile and/or
+tracemalloc.
+"""
+import sys
+import cProfile
+import pstats
+import tracemalloc
+from time import perf_counter
+
+# Phase: (component attribute of Simulation, method)
+PHASES = {
+    "update": ("scheduler", "update"),
+    "decide": ("scheduler", "decide"),
+    "send": ("channel", "send_frames"),
+    "receive": ("receiver", "receive"),
+    "play": ("receiver", "play_until"),
+    "playback": ("receiver", "playback"),
+}
+
+NB_BUCKETS = 32  # bucket i: durations in [2^(i-1), 2^i[ microseconds
+
+
+class PhaseTimer:
+    """Number of calls, frames and duration of a phase, with a histogram of
+    the durations in power of two buckets of microseconds"""
+    __slots__ = ("name", "calls", "frames", "total", "max", "buckets")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.frames = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * NB_BUCKETS
+
+    def add(self, elapsed, frames=0):
+        self.calls += 1
+        self.frames += frames
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.buckets[min(int(elapsed * 1e6).bit_length(), NB_BUCKETS - 1)] += 1
+
+    def quantile(self, q):
+        "Upper bound (in seconds) of the bucket holding the quantile q"
+        rank = q * self.calls
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+    def describe(self):
+        mean = self.total / self.calls if self.calls else 0
+        return "{:10} {:>10} {:>12} {:>10.4f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            self.name, self.calls, self.frames, self.total, mean * 1e6,
+            self.quantile(0.5) * 1e6, self.quantile(0.99) * 1e6, self.max * 1e6)
+
+
+class Instrumentation:
+    """Time the phases of `simulation` (c.f. PHASES) until `detach()`.
+    The phases whose method the component does not have (e.g. play for a
+    MulticastGroup) are skipped.
+
+    phases: PhaseTimer by phase name
+    """
+
+    def __init__(self, simulation, phases=PHASES):
+        self.simulation = simulation
+        self.phases = {}
+        self.wrapped = []
+        for phase in phases:
+            self.attach(phase, *PHASES[phase])
+
+    def attach(self, phase, component, method):
+        obj = getattr(self.simulation, component)
+        original = getattr(obj, method, None)
+        if original is None:
+            return
+        timer = self.phases[phase] = PhaseTimer(phase)
+        # send and receive are given the frames, update and decide return them
+        frames_arg = phase in ("send", "receive")
+        frames_result = phase in ("update", "decide")
+
+        def timed(*args, **kwargs):
+            tstart = perf_counter()
+            result = original(*args, **kwargs)
+            elapsed = perf_counter() - tstart
+            if frames_arg:
+                timer.add(elapsed, len(args[0]))
+            else:
+                timer.add(elapsed, len(result) if frames_result and result else 0)
+            return result
+
+        setattr(obj, method, timed)
+        self.wrapped.append((obj, method))
+
+    def detach(self):
+        "Restore the original methods"
+        for obj, method in self.wrapped:
+            delattr(obj, method)
+        self.wrapped = []
+
+    def total(self):
+        return sum(t.total for t in self.phases.values())
+
+    def summary(self):
+        "Return a table of the phases (durations in microseconds)"
+        lines = ["{:10} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "phase", "calls", "frames", "total(s)", "mean(us)", "p50(us)", "p99(us)", "max(us)")]
+        lines += [t.describe() for t in self.phases.values()]
+        lines.append("events processed: {}".format(self.simulation.engine.processed))
+        return "\n".join(lines)
+
+
+def profile(simulation, duration, cprofile=True, memory=False, top=20, out=sys.stdout):
+    """Run `simulation` for `duration` simulated seconds with its phases
+    instrumented, under cProfile and/or tracemalloc. Print the summaries to
+    `out` and return the metrics of the run"""
+    instrumentation = Instrumentation(simulation)
+    profiler = cProfile.Profile() if cprofile else None
+    if memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        metrics = simulation.run(duration)
+    finally:
+        if profiler:
+            profiler.disable()
+        instrumentation.detach()
+
+    print(instrumentation.summary(), file=out)
+    if profiler:
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+    if memory:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("memory: current {:.1f} MB, peak {:.1f} MB".format(current / 2**20, peak / 2**20), file=out)
+        for stat in snapshot.statistics("lineno")[:top]:
+            print(stat, file=out)
+    return metrics
+
+
+if __name__ == "__main__":
+    # Usage: python instrument.py [duration] [--cprofile] [--tracemalloc]
+    from sweep import DEFAULT_SCENARIO, build_simulation
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    duration = float(args[0]) if args else DEFAULT_SCENARIO["duration"]
+    profile(build_simulation(DEFAULT_SCENARIO), duration,
+            cprofile="--cprofile" in sys.argv, memory="--tracemalloc" in sys.argv)
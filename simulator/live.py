@@ -0,0 +1,378 @@
+"""
+Live mode: the streams go through real localhost sockets in real time.
+
+- every streamer is an ingest coroutine that draws (or replays) its frames as
+  the wall clock passes and uploads them, payload included, to the server
+- the server adds them to the queues of the scheduler (`Scheduler.ingest`)
+  and decides the frames to send every `decision_interval`
+- each receiver is a client process. The frames decided are sent to every
+  receiver through a token bucket filled at the bandwidth of the network
+  trace (or a stable bandwidth), so that the delivery times are the real
+  arrival times of the payloads on the client.
+- at the end, each client plays its frames with `Receiver.playback` and
+  returns the same metrics as the simulation.
+
+Sizes are in KB (1000 bytes) as in the simulator.
+
+    results, stats = run_live(scheduler, duration=10, receivers=2, trace="traces/...")
+"""
+import asyncio
+import multiprocessing
+import socket
+import struct
+import sys
+import time
+import numpy as np
+from channel import CapacityTrace
+from receiver import Receiver
+from stream import Frame, Queue
+from utils import load_network_trace
+
+HOST = "127.0.0.1"
+# Arrivals uploaded by a streamer: streamer index, number of frames, number of
+# layers. Followed by the timestamps (f8), the I frame flags (u1), the sizes
+# and the bitrates of every layer (f8) and the payload of all the layers.
+INGEST = struct.Struct("!HIB")
+# Frame sent to a receiver: origin index, order, size (KB), timestamp,
+# bitrate, I frame flag, payload length. Followed by the payload.
+FRAME = struct.Struct("!Hqddd?I")
+# First message to a receiver: epoch of the start of the stream
+HELLO = struct.Struct("!d")
+END = 0xFFFF  # origin of the last message
+PAYLOAD = bytes(1 << 20)
+
+
+def payload_length(kb):
+    return int(round(kb * 1000))
+
+
+def write_payload(writer, length):
+    "Write `length` bytes of payload (zeros)"
+    view = memoryview(PAYLOAD)
+    while length > 0:
+        writer.write(view[:min(length, len(view))])
+        length -= len(view)
+
+
+class WallClock:
+    """Seconds since `start` (epoch). Shared by the server and the client
+    processes, which run on the same host."""
+
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+
+    def get_time(self):
+        return time.time() - self.start
+
+
+class TokenBucket:
+    """Shape a link to the capacity of a `CapacityTrace`.
+
+    Tokens (KB) are added at the bandwidth of the trace, up to `burst` KB.
+    `consume(kb)` waits until the tokens cover kb (a frame larger than the
+    burst leaves the bucket in debt).
+    offset: time of the trace at which the link starts
+    """
+
+    def __init__(self, trace, clock, burst=100, offset=0):
+        self.trace = trace
+        self.clock = clock
+        self.burst = burst
+        self.offset = offset
+        self.tokens = burst
+        self.last = clock.get_time()
+
+    def refill(self, now):
+        start = self.last + self.offset
+        self.tokens = min(self.burst, self.tokens + float(
+            self.trace.capacity(now + self.offset) - self.trace.capacity(start)))
+        self.last = now
+
+    async def consume(self, kb):
+        now = self.clock.get_time()
+        self.refill(now)
+        if self.tokens >= kb:
+            self.tokens -= kb
+            return
+        ready = float(self.trace.delivery_time(now + self.offset, kb - self.tokens)) - self.offset
+        await asyncio.sleep(ready - now)
+        self.tokens = 0
+        self.last = ready
+
+
+class Connection:
+    "Link from the server to one receiver"
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.outbox = asyncio.Queue()
+        self.closed = asyncio.Event()
+        self.bucket = None
+        self.frames = 0
+        self.kb = 0
+
+
+class LiveServer:
+    """Server of the live mode.
+
+    scheduler: any `Scheduler`. Its streamers are the ingest coroutines.
+    trace, traces_intertime: network trace shaping the link to each receiver,
+                             or a stable `bandwidth` (KBps)
+    offsets: time of the trace at which the link of each receiver starts
+    burst: size of the token buckets (KB)
+    batch: decide the frames fitting in the capacity of the next decision
+           interval (c.f. `Simulation(batch=True)`) instead of maxf frames
+    seed: seed of the arrivals of the synthetic streamers
+
+    The clock (`server.clock`) starts when all the receivers are connected:
+    give it to the schedulers that read the time (e.g.
+    `PriorityBasedScheduler(clock=server.clock)`).
+    """
+
+    def __init__(self, scheduler, trace=None, traces_intertime=0.5, bandwidth=1000,
+                 decision_interval=0.001, arrival_interval=0.01, maxf=10, batch=False,
+                 burst=100, offsets=None, seed=0):
+        self.scheduler = scheduler
+        if trace:
+            self.trace = CapacityTrace(load_network_trace(trace), traces_intertime)
+        else:
+            self.trace = CapacityTrace([bandwidth], 1)
+        self.decision_interval = decision_interval
+        self.arrival_interval = arrival_interval
+        self.maxf = maxf
+        self.batch = batch
+        self.burst = burst
+        self.offsets = offsets
+        self.rngs = [np.random.default_rng(s) for s in
+                     np.random.SeedSequence(seed).spawn(len(scheduler.streamers))]
+        self.clock = WallClock()
+        self.origins = {s.streamer: i for i, s in enumerate(scheduler.streamers)}
+        self.connections = []
+        self.connected = asyncio.Event()
+        self.receivers = 0
+        self.ingested = 0
+        self.ingested_kb = 0
+        self.decided = 0
+        self.decisions = 0
+
+    async def handle_receiver(self, reader, writer):
+        connection = Connection(reader, writer)
+        self.connections.append(connection)
+        if len(self.connections) == self.receivers:
+            self.connected.set()
+        await connection.closed.wait()
+
+    async def handle_ingest(self, reader, writer):
+        "Add the frames uploaded by a streamer to the scheduler"
+        while True:
+            try:
+                i, n, layers = INGEST.unpack(await reader.readexactly(INGEST.size))
+            except asyncio.IncompleteReadError:
+                break
+            body = await reader.readexactly(n * 9 + 2 * layers * n * 8)
+            timestamps = np.frombuffer(body, ">f8", n)
+            IFrames = np.frombuffer(body, np.bool_, n, n * 8)
+            columns = np.frombuffer(body, ">f8", 2 * layers * n, n * 9).reshape(2, layers, n)
+            sizes, bitrates = columns[0], columns[1]
+            await reader.readexactly(payload_length(sizes.sum()))
+            self.scheduler.ingest(i, timestamps.tolist(), IFrames.tolist(),
+                                  sizes.tolist(), bitrates.tolist())
+            self.ingested += n
+            self.ingested_kb += float(sizes[-1].sum())
+        writer.close()
+
+    async def publish(self, i, port, duration):
+        "Ingest coroutine of the streamer i: upload its frames as they arrive"
+        streamer = self.scheduler.streamers[i]
+        _, writer = await asyncio.open_connection(HOST, port)
+        t = self.clock.get_time()
+        while t < duration:
+            await asyncio.sleep(self.arrival_interval)
+            now = min(self.clock.get_time(), duration)
+            if streamer.traces:
+                timestamps, IFrames, sizes, bitrates = streamer.pull(t, now)
+            else:
+                timestamps, IFrames, sizes, bitrates = streamer.draw(self.rngs[i], t, now)
+            t = now
+            n = len(timestamps)
+            if n == 0:
+                continue
+            sizes = np.asarray(sizes, ">f8")
+            writer.write(INGEST.pack(i, n, len(sizes)))
+            writer.write(np.asarray(timestamps, ">f8").tobytes())
+            writer.write(np.asarray(IFrames, np.bool_).tobytes())
+            writer.write(sizes.tobytes())
+            writer.write(np.broadcast_to(np.asarray(bitrates, ">f8"), sizes.shape).tobytes())
+            write_payload(writer, payload_length(sizes.sum()))
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def send(self, connection):
+        "Send the frames decided to one receiver through its token bucket"
+        writer = connection.writer
+        while True:
+            frames = await connection.outbox.get()
+            if frames is None:
+                break
+            for f in frames:
+                await connection.bucket.consume(f.size)
+                length = payload_length(f.size)
+                writer.write(FRAME.pack(self.origins[f.origin], f.order, f.size, f.timestamp,
+                                        f.bitrate, f.Iframe, length))
+                write_payload(writer, length)
+                connection.frames += 1
+                connection.kb += f.size
+            await writer.drain()
+        writer.write(FRAME.pack(END, 0, 0, 0, 0, False, 0))
+        await writer.drain()
+        # Wait for the receiver to close the connection
+        await connection.reader.read()
+        writer.close()
+        connection.closed.set()
+
+    async def decide(self, duration):
+        "Decision loop of the scheduler"
+        credit = 0
+        last = self.clock.get_time()
+        while last < duration:
+            if self.batch:
+                now = self.clock.get_time()
+                budget = credit + float(self.trace.capacity(now) - self.trace.capacity(last))
+                frames = self.scheduler.decide(budget=min(budget, self.burst))
+                credit = budget - sum(f.size for f in frames) if frames else budget
+                credit = min(credit, self.burst)
+                last = now
+            else:
+                frames = self.scheduler.decide(maxf=self.maxf)
+                last = self.clock.get_time()
+            self.decisions += 1
+            if frames:
+                self.decided += len(frames)
+                for connection in self.connections:
+                    connection.outbox.put_nowait(frames)
+            await asyncio.sleep(self.decision_interval)
+
+    async def serve(self, duration, receivers, ingest_socket, receiver_socket):
+        """Wait for the receivers, stream for `duration` seconds, then send
+        the frames decided left and close the connections"""
+        self.receivers = receivers
+        ingest = await asyncio.start_server(self.handle_ingest, sock=ingest_socket)
+        downlink = await asyncio.start_server(self.handle_receiver, sock=receiver_socket)
+        await self.connected.wait()
+
+        self.clock.start = time.time()
+        for r, connection in enumerate(self.connections):
+            offset = self.offsets[r] if self.offsets else 0
+            connection.bucket = TokenBucket(self.trace, self.clock, self.burst, offset)
+            connection.writer.write(HELLO.pack(self.clock.start))
+        senders = [asyncio.create_task(self.send(c)) for c in self.connections]
+        port = ingest_socket.getsockname()[1]
+        publishers = [asyncio.create_task(self.publish(i, port, duration))
+                      for i in range(len(self.scheduler.streamers))]
+
+        await self.decide(duration)
+        await asyncio.gather(*publishers)
+        for connection in self.connections:
+            connection.outbox.put_nowait(None)
+        await asyncio.gather(*senders)
+        ingest.close()
+        downlink.close()
+        await ingest.wait_closed()
+        await downlink.wait_closed()
+
+    def stats(self):
+        return {"ingested_frames": self.ingested,
+                "ingested_kb": round(self.ingested_kb, 2),
+                "decided_frames": self.decided,
+                "decisions": self.decisions,
+                "sent_frames": [c.frames for c in self.connections],
+                "sent_kb": [round(c.kb, 2) for c in self.connections],
+                "duration": round(self.clock.get_time(), 3)}
+
+
+async def receive(port, origins, fps, waiting=0, **receiver_args):
+    """Client: receive the frames until the end of the stream and play them.
+    Return the metrics of `Receiver.playback`"""
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+            break
+        except ConnectionRefusedError:
+            await asyncio.sleep(0.05)
+    else:
+        raise ConnectionRefusedError("no server listening on port %d" % port)
+    start, = HELLO.unpack(await reader.readexactly(HELLO.size))
+    clock = WallClock(start)
+    receiver = Receiver([Queue(o) for o in origins], fps, clock=clock, **receiver_args)
+    receiver.start(waiting)
+    while True:
+        origin, order, size, timestamp, bitrate, Iframe, length = FRAME.unpack(
+            await reader.readexactly(FRAME.size))
+        if origin == END:
+            break
+        await reader.readexactly(length)
+        receiver.receive([Frame(size, order, Iframe, origins[origin], bitrate, timestamp,
+                                clock.get_time())])
+    writer.close()
+    await writer.wait_closed()
+    if receiver.bounded:
+        receiver.play_until(clock.get_time())
+    return receiver.playback(vectorized=True)
+
+
+def receiver_process(port, origins, fps, waiting, results, r, receiver_args):
+    results.put((r, asyncio.run(receive(port, origins, fps, waiting, **receiver_args))))
+
+
+def listening_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, 0))
+    sock.listen()
+    return sock
+
+
+def run_live(scheduler, duration, receivers=1, fps=30, waiting=0, receiver_args=None,
+             server=None, **server_args):
+    """Stream for `duration` seconds to `receivers` client processes.
+
+    server: a `LiveServer` of the scheduler (default: created with server_args)
+    receiver_args: keyword arguments of the `Receiver` of the clients
+
+    Return the metrics of each receiver (c.f. `Receiver.playback`) and the
+    statistics of the server
+    """
+    server = server or LiveServer(scheduler, **server_args)
+    ingest_socket, receiver_socket = listening_socket(), listening_socket()
+    origins = [s.streamer for s in scheduler.streamers]
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(
+        target=receiver_process,
+        args=(receiver_socket.getsockname()[1], origins, fps, waiting, results, r,
+              receiver_args or {}))
+        for r in range(receivers)]
+    for client in clients:
+        client.start()
+    asyncio.run(server.serve(duration, receivers, ingest_socket, receiver_socket))
+    metrics = dict(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+    return [metrics[r] for r in range(receivers)], server.stats()
+
+
+if __name__ == "__main__":
+    from scheduler import FIFOScheduler
+    from stream import Streamer
+    from sweep import DEFAULT_SCENARIO
+    from utils import print_metrics
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    streamers = [Streamer(**kwargs) for kwargs in DEFAULT_SCENARIO["streamers"]]
+    results, stats = run_live(FIFOScheduler(streamers), duration, receivers=2,
+                              trace=DEFAULT_SCENARIO["trace"], maxf=10)
+    for r, metrics in enumerate(results):
+        print("Receiver {}".format(r))
+        print_metrics(metrics)
+    print(stats)
@@ -0,0 +1,182 @@
+"""
+Online QoE metrics in constant memory per streamer.
+
+`LogHistogram` counts values in fixed log-spaced buckets: quantiles are
+known within the relative width of a bucket (about 12% with 20 buckets per
+decade) and two histograms with the same buckets are merged by adding their
+counts, e.g. to combine the results of parallel simulations.
+
+`QoEAccumulator` holds the histograms of one streamer, fed by the receiver
+as the frames are played (c.f. `Receiver(qoe=True)`).
+"""
+import numpy as np
+
+
+class LogHistogram:
+    """Histogram of positive values with `buckets_per_decade` buckets per
+    decade between `low` and `high`. Bucket 0 counts the values <= low
+    (including 0), the last bucket the values > high."""
+
+    def __init__(self, low=1e-4, high=1e4, buckets_per_decade=20):
+        self.low = low
+        self.high = high
+        self.buckets_per_decade = buckets_per_decade
+        self.nb_buckets = int(round(np.log10(high / low) * buckets_per_decade))
+        self.counts = np.zeros(self.nb_buckets + 2, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def bucket(self, values):
+        "Bucket index of each value"
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            index = np.floor(np.log10(values / self.low) * self.buckets_per_decade) + 1
+        index[~(values > self.low)] = 0
+        return np.minimum(index, self.nb_buckets + 1).astype(np.int64)
+
+    def add(self, values):
+        "Add a value or an array of values"
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(self.bucket(values), minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def edges(self, i):
+        "Lower and upper bound of the bucket i (1 <= i <= nb_buckets)"
+        return (self.low * 10 ** ((i - 1) / self.buckets_per_decade),
+                self.low * 10 ** (i / self.buckets_per_decade))
+
+    def quantile(self, q):
+        """Estimate of the quantile q (0 <= q <= 1): geometric middle of the
+        bucket holding it, within the observed min and max. NaN if empty"""
+        if self.count == 0:
+            return np.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = max(q * self.count, 1)
+        i = int(np.searchsorted(np.cumsum(self.counts), rank))
+        if i == 0:
+            value = min(self.max, self.low)
+        elif i > self.nb_buckets:
+            value = self.max
+        else:
+            lower, upper = self.edges(i)
+            value = np.sqrt(lower * upper)
+        return float(min(max(value, self.min), self.max))
+
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    def compatible(self, other):
+        return (self.low, self.high, self.buckets_per_decade) == \
+               (other.low, other.high, other.buckets_per_decade)
+
+    def merge(self, other):
+        "Add the counts of `other` (same buckets) to this histogram. Return self"
+        if not self.compatible(other):
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts += other.counts
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+
+class QoEAccumulator:
+    """QoE distributions of the frames played by one streamer.
+
+    delay: histogram of the delay of the frames (start of play - timestamp)
+    rebuffering: histogram of the duration of the rebuffering events
+    bitrate: histogram of the average bitrate of the frames played in each
+             window of `window` seconds (windows without frame are skipped)
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.delay = LogHistogram(1e-4, 1e5)
+        self.rebuffering = LogHistogram(1e-4, 1e4)
+        self.bitrate = LogHistogram(1e-1, 1e6)
+        # Window being played: index, sum of the bitrates, number of frames
+        self.current = (None, 0.0, 0)
+
+    def add(self, start, timestamps, bitrates, rebuffering):
+        """Add frames played in order.
+        start, timestamps, bitrates: arrays with one value per frame
+        rebuffering: duration of the rebuffering events"""
+        self.delay.add(start - timestamps)
+        self.rebuffering.add(rebuffering)
+        if len(start) == 0:
+            return
+
+        windows = np.floor(start / self.window).astype(np.int64)
+        ids, first = np.unique(windows, return_index=True)
+        sums = np.add.reduceat(bitrates, first)
+        counts = np.diff(np.append(first, len(windows)))
+
+        current, current_sum, current_count = self.current
+        if current == ids[0]:
+            sums[0] += current_sum
+            counts[0] += current_count
+        elif current is not None:
+            self.bitrate.add(current_sum / current_count)
+        # All the windows but the last one are complete
+        self.bitrate.add(sums[:-1] / counts[:-1])
+        self.current = (int(ids[-1]), float(sums[-1]), int(counts[-1]))
+
+    def flush(self):
+        "Close the window being played"
+        current, current_sum, current_count = self.current
+        if current is not None:
+            self.bitrate.add(current_sum / current_count)
+        self.current = (None, 0.0, 0)
+
+    def merge(self, other):
+        "Add the distributions of `other` to this accumulator. Return self"
+        if self.window != other.window:
+            raise ValueError("Cannot merge accumulators with different windows")
+        self.flush()
+        self.delay.merge(other.delay)
+        self.rebuffering.merge(other.rebuffering)
+        self.bitrate.merge(other.bitrate)
+        # The window being played by `other` is closed here, not in `other`
+        current, current_sum, current_count = other.current
+        if current is not None:
+            self.bitrate.add(current_sum / current_count)
+        return self
+
+    def summary(self):
+        "Percentiles of the distributions (the current window counts as complete)"
+        bitrate = LogHistogram(self.bitrate.low, self.bitrate.high).merge(self.bitrate)
+        current, current_sum, current_count = self.current
+        if current is not None:
+            bitrate.add(current_sum / current_count)
+        return {"frames": self.delay.count,
+                "delay_p50": self.delay.quantile(0.5),
+                "delay_p95": self.delay.quantile(0.95),
+                "delay_p99": self.delay.quantile(0.99),
+                "delay_max": self.delay.max if self.delay.count else np.nan,
+                "rebuffering_events": self.rebuffering.count,
+                "rebuffering_p50": self.rebuffering.quantile(0.5),
+                "rebuffering_p95": self.rebuffering.quantile(0.95),
+                "rebuffering_max": self.rebuffering.max if self.rebuffering.count else np.nan,
+                "window_bitrate_p5": bitrate.quantile(0.05),
+                "window_bitrate_p50": bitrate.quantile(0.5),
+                "window_bitrate_mean": bitrate.mean()}
+
+
+def merge(accumulators):
+    "Merge accumulators (e.g. of the same streamer in several runs) into a new one"
+    accumulators = list(accumulators)
+    merged = QoEAccumulator(accumulators[0].window)
+    for accumulator in accumulators:
+        merged.merge(accumulator)
+    return merged
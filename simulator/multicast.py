@@ -0,0 +1,122 @@
+"""
+Multicast fan-out of the streams to many receivers.
+
+The frames decided by the scheduler are stored once (size, timestamp,
+bitrate and origin in growable numpy columns) and each receiver only has its
+own delivery times: one row per receiver of a (receivers, frames) float64
+array, computed by its channel with `Channel.delivery_times`. The Frame
+objects are not modified nor kept, so the memory is about
+frames * 26 + receivers * frames * 8 bytes.
+"""
+import numpy as np
+from receiver import play_frames
+
+
+class MulticastGroup:
+    """Receivers of the same streams, each behind its own channel.
+
+    channels: one channel per receiver (created with `clock=engine`), or
+              channels of several receivers (e.g. NetworkTracesChannels)
+    origins: names of the streamers played by the receivers
+    names: names of the receivers (default: their index)
+    allocated: number of frames the columns are first allocated for
+
+    The group takes the place of both the channel and the receiver of a
+    `Simulation`: `send_frames` records the frames and their delivery to
+    every receiver, `playback` plays the streams of each receiver.
+    """
+
+    bounded = False
+
+    def __init__(self, channels, origins, fps, names=None, clock=None, allocated=1024):
+        self.channels = channels
+        # Rows of the receivers of each channel
+        counts = [getattr(c, "receivers", 1) for c in channels]
+        ends = np.cumsum(counts).tolist()
+        self.rows = [slice(end - n, end) if hasattr(c, "receivers") else end - 1
+                     for c, n, end in zip(channels, counts, ends)]
+        nb_receivers = ends[-1]
+        self.origins = list(origins)
+        self.origin_index = {o: i for i, o in enumerate(self.origins)}
+        self.fps = fps
+        self.names = list(names) if names is not None else list(range(nb_receivers))
+        self.get_time = clock.get_time if clock else channels[0].get_time
+        self.length = 0
+        self.allocated = allocated
+        self.size = np.empty(allocated)
+        self.timestamp = np.empty(allocated)
+        self.bitrate = np.empty(allocated)
+        self.origin = np.empty(allocated, dtype=np.int16)
+        self.availability = np.empty((nb_receivers, allocated))
+        self.lastPlay = np.zeros((nb_receivers, len(self.origins)))
+        self.startPlay = -1
+
+    @property
+    def nbytes(self):
+        "Memory used by the frames and the delivery times"
+        return (self.size.nbytes + self.timestamp.nbytes + self.bitrate.nbytes +
+                self.origin.nbytes + self.availability.nbytes)
+
+    def _grow(self, needed):
+        "Double the allocated frames until `needed` frames fit"
+        allocated = self.allocated
+        while allocated < needed:
+            allocated *= 2
+        for name in ["size", "timestamp", "bitrate", "origin"]:
+            column = getattr(self, name)
+            grown = np.empty(allocated, column.dtype)
+            grown[:self.length] = column[:self.length]
+            setattr(self, name, grown)
+        availability = np.empty((len(self.availability), allocated))
+        availability[:, :self.length] = self.availability[:, :self.length]
+        self.availability = availability
+        self.allocated = allocated
+
+    def send_frames(self, frames, elapsed=0):
+        """Record the frames sent and their delivery time to every receiver.
+        The frames of unknown origins are ignored"""
+        frames = [f for f in frames if f.origin in self.origin_index]
+        n = len(frames)
+        if n == 0:
+            return
+        if self.length + n > self.allocated:
+            self._grow(self.length + n)
+        new = slice(self.length, self.length + n)
+        self.size[new] = [f.size for f in frames]
+        self.timestamp[new] = [f.timestamp for f in frames]
+        self.bitrate[new] = [f.bitrate for f in frames]
+        self.origin[new] = [self.origin_index[f.origin] for f in frames]
+        for rows, channel in zip(self.rows, self.channels):
+            self.availability[rows, new] = channel.delivery_times(self.size[new], elapsed)
+        self.length += n
+
+    def capacity(self, interval, elapsed=0):
+        "KB all the receivers can receive during the next interval"
+        return min(c.capacity(interval, elapsed) for c in self.channels)
+
+    def receive(self, frames):
+        "The frames are recorded when sent (c.f. `send_frames`)"
+
+    def start(self, waiting=0):
+        """Inititate the playing process of every receiver"""
+        self.startPlay = self.get_time() + waiting
+        self.lastPlay[:] = self.startPlay
+
+    def playback(self):
+        """Play the frames sent so far on every receiver (c.f.
+        `Receiver.playback`) and forget them.
+
+        Return {receiver name: {origin: metrics}}
+        """
+        frame_slot = 1 / self.fps
+        n = self.length
+        by_origin = [np.flatnonzero(self.origin[:n] == o) for o in range(len(self.origins))]
+        results = {}
+        for r, name in enumerate(self.names):
+            results[name] = {}
+            for o, rows in enumerate(by_origin):
+                results[name][self.origins[o]], self.lastPlay[r, o] = play_frames(
+                    self.availability[r, rows], self.timestamp[rows], self.bitrate[rows],
+                    self.lastPlay[r, o], frame_slot)
+        self.length = 0
+        return results
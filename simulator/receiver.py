@@ -2,15 +2,74 @@
 Emulation of the receiver that will consume de stream.
 Contains:
 """
+from math import inf
+import numpy as np
 from utils import get_scaled_time
+from metrics import QoEAccumulator
+
+METRICS = ["total_rebuffering_event", "total_rebuffering_time", "total_delay",
+           "average_rate", "total_frame"]
+
+
+def play_times(availability, lastPlay, frame_slot):
+    """Time at which each frame starts to be played, the frames being played
+    one after the other from lastPlay (c.f. `play_frames`)"""
+    slots = np.arange(len(availability)) * frame_slot
+    return np.maximum(np.maximum.accumulate(availability - slots), lastPlay) + slots
+
+
+def play_frames(availability, timestamps, bitrates, lastPlay, frame_slot, qoe=None):
+    """Vectorized playback of frames played one after the other.
+
+    The loop of `Receiver.playback` computes for each frame k:
+        start_k = max(end_{k-1}, availability_k),  end_k = start_k + frame_slot
+    with end_{-1} = lastPlay, i.e.
+        start_k = k * frame_slot + max(lastPlay, cummax_j<=k(availability_j - j * frame_slot))
+
+    qoe: QoEAccumulator fed with the frames played
+
+    Return the metrics of the queue (c.f. `Receiver.playback`) and the
+    updated lastPlay
+    """
+    n = len(availability)
+    if n == 0:
+        return 0, lastPlay
+    start = play_times(availability, lastPlay, frame_slot)
+    previous_end = np.empty(n)
+    previous_end[0] = lastPlay
+    previous_end[1:] = start[:-1] + frame_slot
+    rebuffering = availability - previous_end
+    rebuffering = rebuffering[rebuffering > 0]
+    if qoe is not None:
+        qoe.add(start, timestamps, bitrates, rebuffering)
+
+    metrics = {"total_rebuffering_event": len(rebuffering),
+               "total_rebuffering_time": round(float(rebuffering.sum()), 6),
+               "total_delay": round(float((start - timestamps).sum()), 6),
+               "average_rate": float(bitrates.sum()) / n,
+               "total_frame": n}
+    return metrics, float(start[-1]) + frame_slot
 
 
 class Receiver:
-    """Represents the receiver. """
+    """Represents the receiver.
+
+    bounded: incremental mode. `play_until(t)` plays the frames starting
+             before t and removes them from the queues, so that only the
+             frames waiting to be played are kept. A frame received while its
+             queue holds more than `max_buffer` KB is dropped.
+             `running_metrics()` gives the metrics of the frames played so
+             far with the buffer occupancy and the drops.
+    qoe: keep the distributions of the delay, rebuffering and bitrate per
+         window of `qoe_window` seconds of each queue (c.f.
+         `metrics.QoEAccumulator`, `qoe_summary()`). Playback is then
+         vectorized.
+    """
 
     MAX_BUFFER = 1_000_000  # Buffer size in KB
 
-    def __init__(self, queues, fps, scaled_time=1):
+    def __init__(self, queues, fps, scaled_time=1, clock=None, bounded=False, max_buffer=None,
+                 qoe=False, qoe_window=10):
         self.queues = queues
         self.fps = fps
         self.lastPlay = [0] * len(queues)  # time of the begining of the last frame played
@@ -19,17 +78,36 @@ class Receiver:
         self.started = False
         self.startPlay = -1
         self.scaled_time = scaled_time
-        self.get_time = get_scaled_time(scaled_time)
+        # clock: object with a `get_time()` method (e.g. EventEngine)
+        self.get_time = clock.get_time if clock else get_scaled_time(scaled_time)
 
-    def playback(self, info=False, N=0):
+        # Incremental mode
+        self.bounded = bounded
+        self.max_buffer = self.MAX_BUFFER if max_buffer is None else max_buffer
+        self.played = [dict.fromkeys(METRICS, 0) for _ in queues]  # sums over the frames played
+        self.dropped = [0] * len(queues)
+        self.dropped_kb = [0] * len(queues)
+        self.buffer_max = [0] * len(queues)
+        self.buffer_area = [0] * len(queues)  # integral of the buffer load (KB.s)
+        self.last_sample = 0
+        self.qoe = [QoEAccumulator(qoe_window) for _ in queues] if qoe else None
+        # Event log told of the frames played and dropped (c.f. eventlog.py)
+        self.events = None
+
+    def playback(self, info=False, N=0, vectorized=False):
         """Play the frames in the queues independently overtime.
         i.e. at the end of the simulation
 
         if info=True, only gives the QoE but does not play the frames.
+        if N > 0, only play the N first frames of each queue.
+        if vectorized=True, compute the playback of each queue with numpy
+        (same results within float precision, c.f. `play_frames`)
 
         pros: no time consumption during simulation
         cons: Rewards only come at the end (of the playing)
 
+        In bounded mode, play all the frames left and return `running_metrics()`
+
         Return:
         dictionary-like results
 
@@ -42,6 +120,14 @@ class Receiver:
 
         """
 
+        if self.bounded:
+            # Play everything left: the frames played before are in the running metrics
+            self.play_until(inf)
+            return self.running_metrics()
+
+        if vectorized or self.qoe:
+            return self.playback_vectorized(info, N)
+
         results = {}
         frame_slot = 1 / self.fps
 
@@ -56,6 +142,7 @@ class Receiver:
 
             # State of the queue
             lastPlay = self.lastPlay[self.originQueueDict[q.name]]
+            starts = [] if self.events is not None and not info else None
             for f in q.queue:
 
                 rebuffering_time = f.availability - lastPlay
@@ -66,6 +153,8 @@ class Receiver:
                     lastPlay = f.availability
                     total_rebuffering_time += rebuffering_time
                     total_rebuffering_event += 1
+                if starts is not None:
+                    starts.append(lastPlay)
                 total_delay += lastPlay - f.timestamp
                 average_rate += f.bitrate
                 total_frame += 1
@@ -92,6 +181,8 @@ class Receiver:
 
             # update the player state
             self.lastPlay[self.originQueueDict[q.name]] = lastPlay
+            if starts is not None:
+                self.events.played(q.name, q.column("order", i), starts)
 
             if bool(N):
                 q.dequeue(i)
@@ -100,16 +191,117 @@ class Receiver:
 
         return results
 
+    def playback_vectorized(self, info=False, N=0):
+        "Same as `playback` computed with array operations per queue"
+        results = {}
+        frame_slot = 1 / self.fps
+
+        for q in self.queues:
+            n = min(N, q.length) if N else q.length
+            queue_nb = self.originQueueDict[q.name]
+            if self.events is not None and not info and n:
+                self.events.played(q.name, q.column("order", n), play_times(
+                    q.column("availability", n).astype(float), self.lastPlay[queue_nb], frame_slot))
+            results[q.name], lastPlay = play_frames(
+                q.column("availability", n).astype(float), q.column("timestamp", n).astype(float),
+                q.column("bitrate", n).astype(float), self.lastPlay[queue_nb], frame_slot,
+                qoe=None if info else self.accumulator(queue_nb))
+
+            # We do not update the receiver server state
+            if info or n == 0:
+                continue
+
+            # update the player state
+            self.lastPlay[queue_nb] = lastPlay
+
+            if bool(N):
+                q.dequeue(n)
+            else:
+                q.flush()
+
+        return results
+
+    def play_until(self, t):
+        """Bounded mode: play the frames of each queue starting before t,
+        add their metrics to the running metrics and remove them.
+        The buffer load is sampled before playing."""
+        frame_slot = 1 / self.fps
+        for queue_nb, q in enumerate(self.queues):
+            if t < inf:
+                self.buffer_max[queue_nb] = max(self.buffer_max[queue_nb], q.load)
+                self.buffer_area[queue_nb] += q.load * max(t - self.last_sample, 0)
+            if q.empty:
+                continue
+            lastPlay = self.lastPlay[queue_nb]
+            availability = q.column("availability").astype(float)
+            start = play_times(availability, lastPlay, frame_slot)
+            n = int(np.searchsorted(start, t, side="right"))
+            if n == 0:
+                continue
+            if self.events is not None:
+                self.events.played(q.name, q.column("order", n), start[:n])
+            metrics, self.lastPlay[queue_nb] = play_frames(
+                availability[:n], q.column("timestamp", n).astype(float),
+                q.column("bitrate", n).astype(float), lastPlay, frame_slot,
+                qoe=self.accumulator(queue_nb))
+            played = self.played[queue_nb]
+            for m in METRICS:
+                played[m] += metrics[m] * n if m == "average_rate" else metrics[m]
+            q.dequeue(n)
+        if t < inf:
+            self.last_sample = max(t, self.last_sample)
+
+    def running_metrics(self):
+        """Metrics of the frames played so far (c.f. `playback`) with
+        buffer_kb: current load of the queue
+        max_buffer_kb, mean_buffer_kb: maximum and time average of the load
+        dropped_frames, dropped_kb: frames dropped on a full buffer"""
+        results = {}
+        duration = self.last_sample - self.startPlay
+        for queue_nb, q in enumerate(self.queues):
+            played = self.played[queue_nb]
+            metrics = dict(played)
+            metrics["total_rebuffering_time"] = round(played["total_rebuffering_time"], 6)
+            metrics["total_delay"] = round(played["total_delay"], 6)
+            metrics["average_rate"] = played["average_rate"] / played["total_frame"] if played["total_frame"] else 0
+            metrics.update({"buffer_kb": q.load, "max_buffer_kb": self.buffer_max[queue_nb],
+                            "mean_buffer_kb": self.buffer_area[queue_nb] / duration if duration > 0 else 0,
+                            "dropped_frames": self.dropped[queue_nb],
+                            "dropped_kb": self.dropped_kb[queue_nb]})
+            results[q.name] = metrics
+        return results
+
+    def accumulator(self, queue_nb):
+        return self.qoe[queue_nb] if self.qoe else None
+
+    def qoe_summary(self):
+        "Percentiles of the QoE distributions of each queue (qoe mode)"
+        return {q.name: acc.summary() for q, acc in zip(self.queues, self.qoe)}
+
     def start(self, waiting=0):
         """Inititate the playing process"""
         self.lastPlay = [self.get_time() + waiting * self.scaled_time] * len(self.queues)
         self.startPlay = self.lastPlay[-1]
+        self.last_sample = self.get_time()
 
     def receive(self, frames):
+        """Add the frames delivered to their queues. In bounded mode, the
+        frames must be received when they are delivered (c.f.
+        `engine.Simulation.send`): a frame that does not fit in the buffer,
+        once the frames started before now are played, is dropped"""
         for frame in frames:
             queue_nb = self.originQueueDict.get(frame.origin)
             if type(queue_nb) is int:
-                self.queues[queue_nb].add(frame)
+                q = self.queues[queue_nb]
+                if self.bounded and q.load + frame.size > self.max_buffer:
+                    self.play_until(self.get_time())
+                if self.bounded and q.load + frame.size > self.max_buffer:
+                    self.dropped[queue_nb] += 1
+                    self.dropped_kb[queue_nb] += frame.size
+                    if self.events is not None:
+                        self.events.buffer_drop(frame)
+                    continue
+                q.add(frame)
 
     def describe(self, full=False):
         s = "Receiver: \nfps = {}, slot = {:.3f}, start_time = {:.3f}\nQueues:".format(self.fps, 1 / self.fps, self.startPlay)
@@ -4,15 +4,18 @@ Emulate a simulator for flow scheduling in multiparty live streaming
 """
 from abc import ABC, abstractmethod
 from stream import Streamer
+from utils import IndexedHeap, IndexedSet
 import numpy as np
 import random
+from math import inf
+import heapq
 
 
 class Scheduler(ABC):
     """The scheduler possesses all the queues and has to make a decision: which
     queue he has to pick at which quality"""
 
-    def __init__(self, streamers, dprint=True, speed=1):
+    def __init__(self, streamers, dprint=True, speed=1, rng=None):
 
         for streamer in streamers:
             assert(isinstance(streamer, Streamer))
@@ -20,6 +23,29 @@ class Scheduler(ABC):
         self.streamers = streamers
         self.dprint = dprint
         self.speed = speed  # Need to handle speed
+        # numpy.random.Generator of the simulation. If given, arrivals are
+        # generated in batch with `update_batch`
+        self.rng = rng
+        self.trace_streamers = [s for s in streamers if s.traces]
+        self.index = {s.streamer: i for i, s in enumerate(self.streamers)}
+        # Non-empty streamers and frames (KB) waiting in the last layers, kept
+        # up to date by the streamers (c.f. `Streamer.queue_changed`)
+        self.active = IndexedSet()
+        self.pending_frames = 0
+        self.pending_kb = 0
+        for i, s in enumerate(streamers):
+            s.listener = self
+            s.position = i
+            if not s.isEmpty():
+                self.active.add(i)
+            self.pending_frames += s.queues[-1].length
+            self.pending_kb += s.queues[-1].load
+        # Recorded arrivals replayed instead of the random ones, and recorder
+        # of the arrivals (c.f. arrivals.py)
+        self.source = None
+        self.recorder = None
+        # Size (KB) of the frame that did not fit in the last budget (c.f. decide)
+        self.blocked = 0
 
     def __get_poisson_expected_number_of_occurrences(self, streamer, time_elapsed):
         """compute the poisson arrival rate according to the arrival rate in KBps of the source,
@@ -34,6 +60,22 @@ class Scheduler(ABC):
         self.update()
 
     def update(self, tstart, tstop):
+        """Add the frames arrived between tstart and tstop to the queues:
+        replayed from `source` if set, generated otherwise (c.f. `generate`).
+        They are written to `recorder` if set.
+
+        Return the new frames of the last layers
+        """
+        if self.source is not None:
+            replayed = self.replay_traces(tstart, tstop) if self.trace_streamers else []
+            updated_frames = replayed + self.source.replay(self.streamers, tstart, tstop)
+        else:
+            updated_frames = self.generate(tstart, tstop)
+        if self.recorder is not None:
+            self.recorder.record(self.streamers, updated_frames)
+        return updated_frames
+
+    def generate(self, tstart, tstop):
         """Update all queue with there respective poisson arrival rate.
         If total_bandwith is not 0, adapt the total bandwith used for dynamic
         adaptive bandwith.
@@ -41,10 +83,15 @@ class Scheduler(ABC):
         If only total upload bandwith is 0,
         total_upload_bandwith in kbps
         elapsed in sec
+
+        Trace-driven streamers replay their recorded frames (c.f. `replay_traces`)
         """
+        replayed = self.replay_traces(tstart, tstop) if self.trace_streamers else []
+        if self.rng is not None:
+            return replayed + self.update_batch(tstart, tstop)
         elapsed = tstop - tstart
         if elapsed < 0:
-            return []
+            return replayed
         # Compute each time the total incoming flow in case we want to simulate
         # arrival rate change overtime
         lambdas = [self.__get_poisson_expected_number_of_occurrences(s, elapsed)
@@ -68,8 +115,129 @@ class Scheduler(ABC):
             updated_frames.extend(new_frames)
             tmp += arrival
         Streamer.Frame_Arrival += sum(arrivals)
+        return replayed + updated_frames
+
+    def replay_traces(self, tstart, tstop):
+        """Add the recorded frames of the trace-driven streamers arrived before
+        tstop. Their arrival orders follow the recorded timestamps, before the
+        synthetic arrivals of the same interval.
+
+        Return the new frames of the last layers
+        """
+        pulled = [s.pull(tstart, tstop) for s in self.trace_streamers]
+        timestamps = [t for p in pulled for t in p[0]]
+        if not timestamps:
+            return []
+        ranks = np.empty(len(timestamps), dtype=np.int64)
+        ranks[np.argsort(timestamps, kind="stable")] = np.arange(len(timestamps))
+        orders = (ranks + Streamer.Frame_Arrival).tolist()
+
+        tmp = 0
+        updated_frames = []
+        for streamer, (times, IFrames, sizes, bitrates) in zip(self.trace_streamers, pulled):
+            if not times:
+                continue
+            new_frames = streamer.update_batch(orders[tmp: tmp + len(times)], times,
+                                               IFrames, sizes, bitrates)
+            updated_frames.extend(new_frames)
+            tmp += len(times)
+        Streamer.Frame_Arrival += len(timestamps)
+        return updated_frames
+
+    def update_batch(self, tstart, tstop):
+        """Same as `update` but draws the Poisson counts, the timestamps, the
+        I/P flags and the sizes of all layers for the interval in a few numpy
+        calls with `self.rng`
+        """
+        elapsed = tstop - tstart
+        if elapsed < 0:
+            return []
+        lambdas = [self.__get_poisson_expected_number_of_occurrences(s, elapsed)
+                   for s in self.streamers]
+        arrivals = self.rng.poisson(lambdas)
+        total = int(arrivals.sum())
+        if total == 0:
+            return []
+
+        # Sorted timestamps define the arrival order. Spread them at random
+        # between the streamers.
+        timestamps = np.sort(tstart + self.rng.random(total) * elapsed)
+        owners = np.repeat(np.arange(len(self.streamers)), arrivals)
+        by_owner = np.argsort(self.rng.permutation(owners), kind="stable")
+
+        # Frame type and size of every layer, one row per frame
+        nb_layers = max([len(s.queues) for s in self.streamers])
+        params = np.array([[s.I_P_arrival_ratio, s.I_P_size_ratio] +
+                           list(s.P_means) + [0] * (nb_layers - len(s.queues)) +
+                           list(s.var_frames) + [0] * (nb_layers - len(s.queues))
+                           for s in self.streamers])[owners]
+        IFrames = self.rng.random(total) < params[:, 0]
+        mean = params[:, 2: 2 + nb_layers] * np.where(IFrames, params[:, 1], 1)[:, None]
+        sizes = np.round(self.rng.normal(mean, params[:, 2 + nb_layers:]), 2).T.tolist()
+
+        orders = (by_owner + Streamer.Frame_Arrival).tolist()
+        timestamps = timestamps[by_owner].tolist()
+        IFrames = IFrames.tolist()
+
+        tmp = 0
+        updated_frames = []
+        for streamer, arrival in zip(self.streamers, arrivals.tolist()):
+            if arrival == 0:
+                continue
+            sl = slice(tmp, tmp + arrival)
+            new_frames = streamer.update_batch(orders[sl], timestamps[sl], IFrames[sl],
+                                               [layer[sl] for layer in sizes])
+            updated_frames.extend(new_frames)
+            tmp += arrival
+        Streamer.Frame_Arrival += total
         return updated_frames
 
+    def drop_expired(self, now, max_delay):
+        """Drop the P-frames of all the layers that can no longer be played
+        before their deadline timestamp + max_delay. I-frames are kept.
+
+        Return the number of frames dropped
+        """
+        dropped = 0
+        for i, s in enumerate(self.streamers):
+            n = s.drop_expired(now - max_delay)
+            if n:
+                dropped += n
+                self.on_drop(i)
+        return dropped
+
+    def streamer_changed(self, i, active):
+        "Called when the streamer i becomes non-empty (active) or empty"
+        if active:
+            self.active.add(i)
+        else:
+            self.active.discard(i)
+
+    def pending_changed(self, frames, kb):
+        "Called when frames (kb KB) are added to (> 0) or removed from (< 0) a last layer"
+        self.pending_frames += frames
+        self.pending_kb += kb
+
+    def on_drop(self, i):
+        "Called when frames of the streamer i have been dropped"
+
+    def ingest(self, i, timestamps, IFrames, sizes, bitrates=None):
+        """Add frames of the streamer i drawn outside of the scheduler (e.g.
+        received by `live.LiveServer`). They take the next arrival orders.
+        sizes, bitrates: one list per layer (c.f. `Streamer.update_batch`)
+
+        Return the new frames of the last layer
+        """
+        n = len(timestamps)
+        orders = list(range(Streamer.Frame_Arrival, Streamer.Frame_Arrival + n))
+        Streamer.Frame_Arrival += n
+        frames = self.streamers[i].update_batch(orders, timestamps, IFrames, sizes, bitrates)
+        self.on_arrival(i)
+        return frames
+
+    def on_arrival(self, i):
+        "Called when frames of the streamer i have been ingested"
+
     def describe(self, full=False):
         s = "Scheduler Description:"
         for streamer in self.streamers:
@@ -80,7 +248,12 @@ class Scheduler(ABC):
     def decide(self):
         """Core implementation of the scheduler.
 
-        Return the decided frames
+        decide(dprint=False, maxf=1, budget=None): if budget (in KB) is
+        given, decide all the frames that fit in it instead of at most maxf,
+        and set `blocked` to the size of the frame that did not fit (0 if none).
+
+        Return the decided frames ([] if none fits the budget), False if
+        the queues are empty
         """
 
 
@@ -88,17 +261,18 @@ class RandomScheduler(Scheduler):
     """Scheduler that decides randomly which streamers to send the frame from, at
     which quality."""
 
-    def __init__(self, streames):
-        super().__init__(streames)
+    def __init__(self, streames, rng=None):
+        super().__init__(streames, rng=rng)
 
-    def decide(self, dprint=False, maxf=1):
-        non_empty_flow = [streamer for streamer in
-                          self.streamers if not streamer.isEmpty()]
+    def decide(self, dprint=False, maxf=1, budget=None):
         # No frames in queues
-        if len(non_empty_flow) == 0:
+        if not self.active:
             return False
 
-        dStreamer = random.sample(non_empty_flow, 1)[0]
+        if budget is not None:
+            return self.decide_budget(budget, dprint)
+
+        dStreamer = self.streamers[self.active.choice()]
         dQueue = random.randint(0, len(dStreamer.queues) - 1)
         dNbFrames = min(random.randint(1, dStreamer.queues[dQueue].length), maxf)
         decidedFrames = dStreamer.dequeue(dQueue, dNbFrames)
@@ -110,52 +284,114 @@ class RandomScheduler(Scheduler):
         return decidedFrames
 
 
+    def decide_budget(self, budget, dprint=False):
+        """Random decisions (streamer, quality, number of frames among the
+        ones that fit) until the chosen frame does not fit in the budget"""
+        decidedFrames = []
+        self.blocked = 0
+        while self.active:
+            dStreamer = self.streamers[self.active.choice()]
+            dQueue = random.randint(0, len(dStreamer.queues) - 1)
+            q = dStreamer.queues[dQueue]
+            # Sizes of the first k frames, k doubled until they exceed the budget
+            k = 16
+            sizes = np.cumsum(q.column("size", k))
+            while len(sizes) == k and sizes[-1] <= budget:
+                k *= 2
+                sizes = np.cumsum(q.column("size", k))
+            fit = int(np.searchsorted(sizes, budget, side="right"))
+            if fit == 0:
+                self.blocked = float(sizes[0]) if len(sizes) else 0
+                break
+            frames = dStreamer.dequeue(dQueue, random.randint(1, fit))
+            budget -= sum([f.size for f in frames])
+            decidedFrames.extend(frames)
+
+        if decidedFrames and dprint:
+            print("Scheduler decided:")
+            for f in decidedFrames:
+                print(f.describe(True))
+        return decidedFrames
+
+
 class FIFOScheduler(Scheduler):
     """Scheduler that decides frames according to the first-in-first-out principle.
     The quality level is decided randomly as well as how many frames to dequeue
+
+    The next frame is found with a k-way merge of the streamers: the heap
+    `heads` holds (order of the first frame, streamer index) for every
+    non-empty streamer, so a frame is decided in O(log streamers).
+    The entries whose first frame changed (e.g. dropped) are skipped when
+    they reach the top of the heap.
     """
 
-    def __init__(self, streames):
-        super().__init__(streames)
+    def __init__(self, streames, rng=None):
+        super().__init__(streames, rng=rng)
         self.to_be_decided = 0
-        self.visited = dict()
+        self.heads = []
+        self.in_heap = {}  # streamer index: order of its up to date entry
+        for i in range(len(self.streamers)):
+            self.push(i)
+
+    def push(self, i):
+        "Add the streamer i to the heap if it has frames and is not up to date"
+        order = self.streamers[i].queues[-1].peek("order")
+        if order is None:
+            self.in_heap.pop(i, None)
+        elif self.in_heap.get(i) != order:
+            heapq.heappush(self.heads, (order, i))
+            self.in_heap[i] = order
 
-    def decide(self, dprint=False, maxf=1):
-        """Decide the frame according to their arrivals"""
-        non_empty_flow = [streamer for streamer in
-                          self.streamers if not streamer.isEmpty()]
+    def update(self, tstart, tstop):
+        updated_frames = super().update(tstart, tstop)
+        for origin in {f.origin for f in updated_frames}:
+            i = self.index[origin]
+            if i not in self.in_heap:
+                self.push(i)
+        return updated_frames
+
+    def on_arrival(self, i):
+        if i not in self.in_heap:
+            self.push(i)
+
+    def on_drop(self, i):
+        # The first frame changed: the old entry is skipped by decide
+        self.push(i)
+
+    def decide(self, dprint=False, maxf=1, budget=None):
+        """Decide the frame according to their arrivals.
+        With a budget (KB), decide the frames in arrival order until the next
+        one does not fit"""
         # No frames in queues
-        if len(non_empty_flow) == 0:
+        if not self.heads or self.pending_frames == 0:
             return False
 
-        total_frames = sum([s.queues[-1].length for s in non_empty_flow])
-        dNbFrames = min(random.randint(1, total_frames), maxf)
-
-        # helper function
-        def recursiveSearch(nb, frames):
-            if nb == 0:
-                return frames
-
-            # is the frame as already been visited?
-            s = self.visited.get(self.to_be_decided)
-            if s:
-                frames.extend(s.dequeue(random.randint(0, len(s.queues) - 1)))
-                del self.visited[self.to_be_decided]
-                self.to_be_decided += 1
-                return recursiveSearch(nb - 1, frames)
-
-            for s in non_empty_flow:
-                f = s.queues[-1].getFrames(1)[0]
-                if f.order == self.to_be_decided:
-                    frames.extend(s.dequeue(random.randint(0, len(s.queues) - 1)))
-                    self.to_be_decided += 1
-                    return recursiveSearch(nb - 1, frames)
-                else:
-                    self.visited[f.order] = s
-            # not found yet: need to do more iteration
-            return recursiveSearch(nb, frames)
-
-        decidedFrames = recursiveSearch(dNbFrames, [])
+        if budget is None:
+            dNbFrames = min(random.randint(1, self.pending_frames), maxf)
+        else:
+            dNbFrames = inf
+            self.blocked = 0
+
+        decidedFrames = []
+        while len(decidedFrames) < dNbFrames and self.heads:
+            order, i = self.heads[0]
+            s = self.streamers[i]
+            if s.queues[-1].peek("order") != order:
+                # The first frame changed since it was pushed (e.g. dropped)
+                heapq.heappop(self.heads)
+                self.push(i)
+                continue
+            dQueue = random.randint(0, len(s.queues) - 1)
+            if budget is not None:
+                size = s.queues[dQueue].peek("size")
+                if size > budget:
+                    self.blocked = size
+                    break
+                budget -= size
+            heapq.heappop(self.heads)
+            decidedFrames.extend(s.dequeue(dQueue))
+            self.to_be_decided = order + 1
+            self.push(i)
 
         if decidedFrames and dprint:
             print("Scheduler decided:")
@@ -165,4 +401,91 @@ class FIFOScheduler(Scheduler):
 
 
 class PriorityBasedScheduler(Scheduler):
-    pass
+    """Earliest-deadline-first scheduler weighted by the streamer priority.
+
+    The playback deadline of a frame is timestamp + max_delay / (1 + priority):
+    the higher the priority, the tighter the deadline. The streamers are kept
+    in an indexed priority queue keyed by the deadline of their first frame,
+    so a decision costs O(log streamers).
+
+    Late frames, that missed their deadline on `clock` (if given), are not
+    worth sending: the late P-frames are dropped from all the layers (c.f.
+    `Streamer.drop_expired`) so that the streamer catches up with its
+    deadline, the late I-frames are sent at the base quality. The other
+    frames are sent at the highest quality.
+    """
+
+    def __init__(self, streames, max_delay=1, rng=None, clock=None):
+        super().__init__(streames, rng=rng)
+        self.max_delay = max_delay
+        self.get_time = clock.get_time if clock else None
+        self.deadlines = IndexedHeap()
+        for i in range(len(self.streamers)):
+            self.push(i)
+
+    def deadline(self, i):
+        "Deadline of the first frame of the streamer i, None if it is empty"
+        s = self.streamers[i]
+        timestamp = s.queues[-1].peek("timestamp")
+        if timestamp is None:
+            return None
+        return timestamp + self.max_delay / (1 + s.priority)
+
+    def push(self, i):
+        "(Re)index the streamer i according to its first frame"
+        deadline = self.deadline(i)
+        if deadline is not None:
+            self.deadlines.push(i, deadline)
+        elif i in self.deadlines:
+            self.deadlines.remove(i)
+
+    def update(self, tstart, tstop):
+        updated_frames = super().update(tstart, tstop)
+        for origin in {f.origin for f in updated_frames}:
+            i = self.index[origin]
+            if i not in self.deadlines:
+                self.push(i)
+        return updated_frames
+
+    def on_arrival(self, i):
+        if i not in self.deadlines:
+            self.push(i)
+
+    def on_drop(self, i):
+        # The first frame, hence the deadline, changed
+        self.push(i)
+
+    def decide(self, dprint=False, maxf=1, budget=None):
+        """Decide up to maxf frames by earliest weighted deadline. With a
+        budget (KB), decide them until the next one does not fit"""
+        # No frames in queues
+        if not self.deadlines:
+            return False
+
+        if budget is not None:
+            maxf = inf
+            self.blocked = 0
+        now = self.get_time() if self.get_time is not None else None
+        decidedFrames = []
+        while len(decidedFrames) < maxf and self.deadlines:
+            deadline, i = self.deadlines.peek()
+            s = self.streamers[i]
+            late = now is not None and now > deadline
+            if late and s.drop_expired(now - self.max_delay / (1 + s.priority)):
+                self.on_drop(i)
+                continue
+            dQueue = 0 if late else len(s.queues) - 1
+            if budget is not None:
+                size = s.queues[dQueue].peek("size")
+                if size > budget:
+                    self.blocked = size
+                    break
+                budget -= size
+            decidedFrames.extend(s.dequeue(dQueue))
+            self.push(i)
+
+        if decidedFrames and dprint:
+            print("Scheduler decided:")
+            for f in decidedFrames:
+                print(f.describe(True))
+        return decidedFrames
@@ -3,16 +3,20 @@
 """
 
 from scheduler import RandomScheduler, FIFOScheduler
-from stream import Streamer, Queue
-from time import time
+from stream import Streamer, Queue, FrameTrace
 from channel import StableChannelNoWindow, NetworkTracesChannel
 from receiver import Receiver
-from utils import print_metrics, read_network_trace, get_scaled_time
+from engine import EventEngine, Simulation
+from utils import print_metrics
 
 
 ### SIMULATION VARIABLE
-SPEED_FORWARD = 400  # gain compare to the real speed time
-MAX_INTERTIME_UPDATE_DURATION = 0.1  # maximum time spent between 2 updates
+SEED = 0
+DURATION = 4800  # simulated seconds
+DECISION_INTERVAL = 0.001  # simulated time taken by one decision
+ARRIVAL_INTERVAL = 0.01  # new frames are added to the queues at this period
+
+engine = EventEngine(seed=SEED)
 
 # ############ ENVIRONEMENT ####################
 
@@ -35,54 +39,36 @@ dave = Streamer(streamer="Dave", qnames=["Base", "Enhanced"], priority=2,
 
 streamers = [alice, bob]
 
+# Trace-driven streamers: replay recorded publishers in parallel
+# trace = FrameTrace("/traces/huabei/publishResult_2019-05-12.txt")
+# streamers = [Streamer(streamer=str(p), qnames=["Base", "Enhanced"], priority=2,
+#                       mean_frames=[5, 6], traces=replay)
+#              for p, replay in zip(trace.publishers[:4], trace.replays(range(4)))]
+
 # ----- Scheduler ------
-# rs = RandomScheduler(streames=streamers)
-rs = FIFOScheduler(streames=streamers)
+# rs = RandomScheduler(streames=streamers, rng=engine.rng)
+rs = FIFOScheduler(streames=streamers, rng=engine.rng)
 
 
 # ----- Channel ------
-# sc = StableChannelNoWindow(bandwidth=1000, scale_time=SPEED_FORWARD)
+# sc = StableChannelNoWindow(bandwidth=1000, clock=engine)
 
 # network traces
 path_huabei = "/traces/huabei/liveldResult_2019-05-12.txt"
-sc = NetworkTracesChannel(path_huabei, 0.5, scale_time=SPEED_FORWARD)
+sc = NetworkTracesChannel(path_huabei, 0.5, clock=engine)
 
 # ----- Receiver ------
 receiver_buffer_size = -1  # Not yet known
 receiver = Receiver(queues=[Queue(s.streamer) for s in streamers],
-                    fps=30, scaled_time=SPEED_FORWARD)
+                    fps=30, clock=engine)
 
 
 # ############ SIMULATION ####################
 
-get_time = get_scaled_time(scale=SPEED_FORWARD)
-N = 100
-total_received = 0
-receiver.start(waiting=0)
-
-# Follow network traces
-cumultime = 0
-loop = 0
-while cumultime < 4800:  # 1 hour simulation
-
-    tstart = get_time()
-
-    frames = rs.decide(dprint=False)
-
-    if frames:
-        total_received += len(frames)
-        sending_time = get_time() - tstart
-        sc.send_frames(frames, sending_time)
-        receiver.receive(frames)
-
-    tstop = get_time()
-    rs.update(tstart, tstop)
-    elapsed = tstop - tstart
-    if elapsed > MAX_INTERTIME_UPDATE_DURATION:  # 2920.00
-        print("Warning: Elapsed time between 2 updates is too large\nelased={} Max={}".format(elapsed, MAX_INTERTIME_UPDATE_DURATION))
-    cumultime += elapsed
-    loop += 1
-print("Cumul = ", cumultime)
+simulation = Simulation(rs, sc, receiver, engine,
+                        decision_interval=DECISION_INTERVAL,
+                        arrival_interval=ARRIVAL_INTERVAL)
+metrics = simulation.run(DURATION, waiting=0)  # 1 hour simulation
+print("Frames sent = {}, events = {}".format(simulation.total_sent, engine.processed))
 # print(receiver.describe(full=True))
-metrics = receiver.playback()
 print_metrics(metrics)
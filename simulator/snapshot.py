@@ -0,0 +1,93 @@
+"""
+Snapshots of a running simulation.
+
+A snapshot is the whole `Simulation` (event heap, streamer queues, scheduler
+state, channel position and frames in flight, receiver queues and lastPlay,
+numpy Generator of the engine) with the global `random` and `numpy.random`
+states and `Streamer.Frame_Arrival`, pickled and compressed with zlib.
+The columnar queues pickle the names of their origins (their ids are only
+valid in one process), so a snapshot can be restored in any process.
+
+Warm the system up once, then fork several schedulers from the snapshot: they
+all start from the same queues and get the same arrivals afterwards
+(paired comparison).
+
+    data = snapshot(warm_up(build_simulation(scenario), 30))
+    metrics = compare(data, ["FIFO", "Priority"], duration=60)
+"""
+import pickle
+import random
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from stream import Streamer
+from engine import DECISION
+from sweep import make_scheduler
+
+
+def warm_up(simulation, duration, waiting=0):
+    """Start the simulation and run it for `duration` simulated seconds
+    without playing the frames. Return the simulation"""
+    if not simulation.started:
+        simulation.start(waiting)
+    simulation.engine.run(until=simulation.engine.now + duration)
+    return simulation
+
+
+def snapshot(simulation, level=6):
+    """Compact binary snapshot of the simulation. Its monitor, if any, must
+    be picklable, and the logs attached to it (EventLog, ArrivalRecorder),
+    which hold open files, must be closed first"""
+    state = {"simulation": simulation,
+             "frame_arrival": Streamer.Frame_Arrival,
+             "random": random.getstate(),
+             "numpy_random": np.random.get_state()}
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), level)
+
+
+def restore(data):
+    """Simulation of the snapshot, ready to `run`. Restores the global random
+    states and arrival orders"""
+    state = pickle.loads(zlib.decompress(data))
+    Streamer.Frame_Arrival = state["frame_arrival"]
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy_random"])
+    return state["simulation"]
+
+
+def fork(data, scheduler=None, scheduler_args=None):
+    """Restore the snapshot with the scheduler `scheduler` (name in
+    sweep.SCHEDULERS) taking over the queues of the streamers.
+    Keep the scheduler of the snapshot if None"""
+    simulation = restore(data)
+    if scheduler is not None:
+        old = simulation.scheduler
+        simulation.scheduler = make_scheduler(scheduler, old.streamers, simulation.engine,
+                                              scheduler_args)
+        # Decisions are pending if frames are waiting
+        if simulation.idle and any(not s.isEmpty() for s in old.streamers):
+            simulation.idle = False
+            simulation.engine.schedule(simulation.engine.now, DECISION, simulation.on_decision)
+    return simulation
+
+
+def run_fork(data, scheduler, duration, scheduler_args=None):
+    "Fork the snapshot and run it for `duration`. Return the metrics"
+    return fork(data, scheduler, scheduler_args).run(duration)
+
+
+def compare(data, schedulers, duration, workers=None, scheduler_args=None):
+    """Run every scheduler of `schedulers` (names) from the same snapshot for
+    `duration` simulated seconds, on `workers` processes (in process if 0).
+
+    scheduler_args: {name: keyword arguments of the scheduler}
+    Return {name: metrics}
+    """
+    scheduler_args = scheduler_args or {}
+    args = [(data, name, duration, scheduler_args.get(name)) for name in schedulers]
+    if workers == 0:
+        results = [run_fork(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_fork, *zip(*args)))
+    return dict(zip(schedulers, results))
@@ -3,9 +3,13 @@ File containing all
 """
 
 
+from bisect import bisect_left
 from collections import deque
+from itertools import repeat, islice
+from operator import attrgetter
 import numpy as np
 import random
+from utils import load_frame_trace, read_frame_trace
 
 
 class Streamer(object):
@@ -17,7 +21,13 @@ class Streamer(object):
     qnames: Names of the queues that the streamer has.
     priority: queue priority. One streamer
               might have more importance than another streamer.
-    arrival_rate: Expected arrival_rate of the source in KBps
+    arrival_rate: Expected arrival_rate of the source in KBps. With 0 the
+                  streamer has no source: its frames are only the ones added
+                  with `update_batch` or `Scheduler.ingest`
+    traces: TraceReplay source. The frames are then replayed from a frame
+            trace instead of being generated. The recorded size is the one of
+            the last layer, the other layers are scaled by mean_frames (if given).
+    queue_type: class of the queues, `Queue` (default) or `ColumnarQueue`
 
     """
 
@@ -25,11 +35,15 @@ class Streamer(object):
 
     def __init__(self, streamer=0, qnames=0, priority=0, arrival_rate=0,
                  I_P_arrival_ratio=0, I_P_size_ratio=0, mean_frames=0,
-                 var_frames=0, traces=0):
-        self.deterministic = (streamer or qnames or priority or arrival_rate or
-                              I_P_arrival_ratio or I_P_size_ratio or mean_frames
-                              or var_frames)
-        assert self.deterministic != bool(traces), "The system is either deterministic or random"
+                 var_frames=0, traces=0, queue_type=None):
+        self.traces = traces
+        if traces:
+            assert not (arrival_rate or I_P_arrival_ratio or I_P_size_ratio or var_frames), \
+                "The system is either deterministic or random"
+            mean_frames = mean_frames or [1] * len(qnames)
+            var_frames = [0] * len(qnames)
+        elif not arrival_rate:
+            var_frames = var_frames or [0] * len(qnames)
         assert(len(mean_frames) == len(var_frames) == len(qnames))
         assert(0 <= I_P_arrival_ratio <= 1)
         self.streamer = streamer
@@ -43,8 +57,50 @@ class Streamer(object):
         self.arrival_rates = [i * self.arrival_rate / max(self.mean_frames)
                               for i in mean_frames]
 
+        # Mean size of the P frames of each layer (I frames are I_P_size_ratio larger)
+        self.P_means = [mf / (I_P_arrival_ratio * I_P_size_ratio + (1 - I_P_arrival_ratio))
+                        for mf in mean_frames]
+        assert all([m - 1.5 * v > 0 for m, v in zip(self.P_means, var_frames)]), \
+            "With these settings, it is likely to have negative frame size."
+
+        # Scheduler told when the streamer becomes empty or not and of the
+        # frames added to or removed from the last layer (c.f. `queue_changed`)
+        self.listener = None
+        self.position = None  # index of the streamer in the listener
+
         # Create the queues
-        self.queues = [Queue(qn) for qn in qnames]
+        self.queues = [(queue_type or Queue)(qn) for qn in qnames]
+
+        # Expired P-frames dropped from the queues (c.f. `drop_expired`)
+        self.dropped_frames = 0
+        self.dropped_kb = 0
+
+    @property
+    def queues(self):
+        return self._queues
+
+    @queues.setter
+    def queues(self, queues):
+        self._queues = queues
+        self.nonempty = 0  # number of non-empty queues
+        for q in queues:
+            q.listener = self
+            self.nonempty += not q.empty
+
+    def queue_changed(self, q, frames, kb):
+        """Called by the queues after `frames` frames (kb KB) have been added
+        (frames > 0) or removed (frames < 0)"""
+        before = q.length - frames
+        if before == 0 and q.length:
+            self.nonempty += 1
+            if self.nonempty == 1 and self.listener is not None:
+                self.listener.streamer_changed(self.position, True)
+        elif before and q.length == 0:
+            self.nonempty -= 1
+            if self.nonempty == 0 and self.listener is not None:
+                self.listener.streamer_changed(self.position, False)
+        if q is self._queues[-1] and self.listener is not None:
+            self.listener.pending_changed(frames, kb)
 
     def describe(self, full=False):
         """Describe the current queue"""
@@ -61,6 +117,29 @@ class Streamer(object):
         self.arrival_rates = [i * self.arrival_rate / max(self.mean_frames)
                               for i in self.mean_frames]
 
+    def pull(self, tstart, tstop):
+        """Trace-driven streamers: recorded frames arrived before tstop.
+        Return the timestamps, the I frame flags, and for each layer the
+        sizes and the bitrates of the frames."""
+        timestamps, sizes, IFrames, bitrates = self.traces.pull(tstart, tstop)
+        ratios = [mf / max(self.mean_frames) for mf in self.mean_frames]
+        return (timestamps, IFrames,
+                [[s * r for s in sizes] for r in ratios],
+                [[b * r for b in bitrates] for r in ratios])
+
+    def draw(self, rng, tstart, tstop):
+        """Synthetic streamers: draw the frames arrived between tstart and
+        tstop with the numpy Generator rng (same model as
+        `Scheduler.update_batch`). Same return as `pull`."""
+        elapsed = tstop - tstart
+        n = rng.poisson(self.arrival_rate * max(elapsed, 0) / self.mean_frames[-1])
+        timestamps = np.sort(tstart + rng.random(n) * elapsed)
+        IFrames = rng.random(n) < self.I_P_arrival_ratio
+        mean = np.array(self.P_means)[:, None] * np.where(IFrames, self.I_P_size_ratio, 1)
+        sizes = np.round(rng.normal(mean, np.array(self.var_frames)[:, None]), 2)
+        return (timestamps.tolist(), IFrames.tolist(), sizes.tolist(),
+                [[r] * n for r in self.arrival_rates])
+
     def update(self, arrival_stamp):
         """Generate incoming packet according to the arrival stamp
 
@@ -98,12 +177,41 @@ class Streamer(object):
 
         return new_arrival
 
+    def update_batch(self, orders, timestamps, IFrames, sizes, bitrates=None):
+        """Add already drawn frames to the queues (c.f. `Scheduler.update_batch`)
+        orders, timestamps, IFrames: one value per new frame
+        sizes: for each layer, the list of the sizes of the new frames
+        bitrates: for each layer, the bitrate of the frames (a value or a
+                  list). Default to the arrival rates of the layers.
+
+        Return the all the new updated frames of the last queue (last layer)
+        """
+        for q, layer_sizes, br in zip(self.queues, sizes, bitrates or self.arrival_rates):
+            frames = q.add_batch(layer_sizes, orders, IFrames, self.streamer,
+                                 br, timestamps)
+
+        # frames of the last layer
+        return frames
+
+    def drop_expired(self, cutoff):
+        """Drop the P-frames arrived before cutoff from all the layers. The
+        I-frames are kept. The queues hold the frames by increasing timestamp
+        so the expired ones are found by binary search.
+
+        Return the number of frames dropped
+        """
+        n = self.queues[0].expired(cutoff)
+        if n == 0:
+            return 0
+        for q in self.queues:
+            dropped, kb = q.drop(n)
+            self.dropped_kb += kb
+        self.dropped_frames += dropped
+        return dropped
+
     def isEmpty(self):
         "Return true if all Queue are empty in the streamer."
-        empty = True
-        for q in self.queues:
-            empty = empty and q.empty
-        return empty
+        return self.nonempty == 0
 
     def info(self):
         infos = []
@@ -126,6 +234,8 @@ class Streamer(object):
 
 class Queue(object):
 
+    listener = None  # e.g. the Streamer, c.f. `Streamer.queue_changed`
+
     def __init__(self, queue_name, default_load=[]):
         "arrival_rate: follow a lambda distribution of incomming packet"
         self.max_size = 500_000_000  # 500 MB Default value
@@ -160,13 +270,42 @@ class Queue(object):
         self.load -= total_size
         self.length -= nb_frames
         self.empty = True if 0 == self.length else False
+        if self.listener is not None:
+            self.listener.queue_changed(self, -nb_frames, -total_size)
 
         return frames
 
+    def expired(self, cutoff):
+        "Number of first frames with a timestamp before cutoff (binary search)"
+        return bisect_left(self.queue, cutoff, key=attrgetter("timestamp"))
+
+    def drop(self, n):
+        """Remove the P-frames among the n first frames, the I-frames stay at
+        the head of the queue.
+        Return the number and the total size of the dropped frames
+        """
+        head = [self.queue.popleft() for _ in range(n)]
+        kept = [f for f in head if f.Iframe]
+        self.queue.extendleft(reversed(kept))
+        dropped = n - len(kept)
+        kb = sum([f.size for f in head if not f.Iframe])
+        self.load -= kb
+        self.length -= dropped
+        self.empty = self.length == 0
+        if self.listener is not None:
+            self.listener.queue_changed(self, -dropped, -kb)
+        return dropped, kb
+
     def flush(self):
         "Flush the queue"
+        length, load = self.length, self.load
         del self.queue
         self.queue = deque()
+        self.load = 0
+        self.length = 0
+        self.empty = True
+        if self.listener is not None:
+            self.listener.queue_changed(self, -length, -load)
 
     def describe(self, full=False):
         "Return a string description of the queue"
@@ -190,12 +329,58 @@ class Queue(object):
                 break
         return frames
 
+    def peek(self, name):
+        "Attribute `name` of the first frame, None if the queue is empty"
+        return getattr(self.queue[0], name) if self.length else None
+
+    def tail(self, name, n):
+        "Array of the attribute `name` of the n last frames"
+        values = [getattr(f, name) for f in islice(reversed(self.queue), min(n, self.length))]
+        return np.array(values[::-1])
+
+    def column(self, name, n=0):
+        "Array of the attribute `name` of the n first frames (all if n=0)"
+        n = min(n, self.length) if n else self.length
+        values = map(attrgetter(name), islice(self.queue, n))
+        if name == "origin":
+            return np.array(list(values), dtype=object)
+        try:
+            return np.fromiter(values, dict(COLUMNS)[name], n)
+        except TypeError:
+            # Unknown values (None) become NaN
+            values = map(attrgetter(name), islice(self.queue, n))
+            return np.array(list(values), dtype=np.float64)
+
     def add(self, frame):
         if self.load + frame.size < self.max_size:
             self.queue.append(frame)
             self.length += 1
             self.load += frame.size
             self.empty = False
+            if self.listener is not None:
+                self.listener.queue_changed(self, 1, frame.size)
+        else:
+            raise OverflowError("Queue is full")
+
+    def add_batch(self, sizes, orders, IFrames, origin, bitrate, timestamps):
+        """Add one frame per element of sizes, orders, IFrames and timestamps.
+        Return the list of the new Frames"""
+        bitrates = bitrate if isinstance(bitrate, list) else repeat(bitrate)
+        frames = list(map(Frame, sizes, orders, IFrames, repeat(origin),
+                          bitrates, timestamps))
+        self.extend(frames)
+        return frames
+
+    def extend(self, frames):
+        "Add a list of frames at once"
+        load = sum([f.size for f in frames])
+        if self.load + load < self.max_size:
+            self.queue.extend(frames)
+            self.length += len(frames)
+            self.load += load
+            self.empty = self.length == 0
+            if self.listener is not None:
+                self.listener.queue_changed(self, len(frames), load)
         else:
             raise OverflowError("Queue is full")
 
@@ -232,3 +417,412 @@ class Frame:
                                                  available, self.bitrate)
 
         return s
+
+
+class FrameTrace:
+    """Frames recorded in a publishResult trace (c.f. `utils.load_frame_trace`).
+
+    The trace is made of recordings, one per `ID:` section of the file.
+    publishers: publisher id of each recording (-1 if anonymous)
+    sections: (first row, last row + 1) of each recording
+    """
+
+    def __init__(self, path):
+        self.path = path
+        records = load_frame_trace(path)
+        # The sections without frames are skipped
+        bounds = np.flatnonzero(np.diff(records[:, 5])) + 1
+        starts = [0] + bounds.tolist() if len(records) else []
+        stops = bounds.tolist() + [len(records)] if len(records) else []
+        self.sections = list(zip(starts, stops))
+        self.publishers = records[starts, 0].tolist()
+
+    def first_timestamp(self, i):
+        "Timestamp (ms) of the first frame of the recording i"
+        return int(load_frame_trace(self.path)[self.sections[i][0], 1])
+
+    def replay(self, i, start=0, reference=None):
+        """TraceReplay of the recording i starting at the simulated time `start`.
+        reference: recorded timestamp (ms) played at `start`. Default to the
+                   first frame of the recording."""
+        if reference is None:
+            reference = self.first_timestamp(i)
+        first, stop = self.sections[i]
+        return TraceReplay(self.path, first, stop, start, reference)
+
+    def replays(self, recordings=None, start=0):
+        """TraceReplays of several recordings played in parallel, i.e. keeping
+        their recorded time offsets. Default to all recordings"""
+        if recordings is None:
+            recordings = range(len(self.sections))
+        reference = min([self.first_timestamp(i) for i in recordings])
+        return [self.replay(i, start, reference) for i in recordings]
+
+
+class TraceReplay:
+    """Replay of the frames of rows first, ..., stop - 1 of a frame trace.
+    The rows are streamed from the memory-mapped trace: a recorded timestamp
+    `ts` (ms) is played at the simulated time start + (ts - reference) / 1000.
+    Sizes are converted to KB and bitrates to KBps.
+
+    A replay can be pickled (c.f. snapshot.py): it keeps the row of the next
+    record and the reader is rebuilt from it."""
+
+    def __init__(self, path, first, stop, start=0, reference=0):
+        self.path = path
+        self.stop = stop
+        self.start = start
+        self.reference = reference
+        self.row = first  # row of self.next
+        self.records = read_frame_trace(path, first, stop)()
+        self.next = next(self.records, None)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["records"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.records = read_frame_trace(self.path, self.row + 1, self.stop)()
+
+    def time(self, record):
+        return self.start + (record[1] - self.reference) / 1000
+
+    def pull(self, tstart, tstop):
+        """Frames arrived before tstop that were not pulled yet.
+        Return the lists of timestamps, sizes, I frame flags and bitrates
+        sorted by timestamp"""
+        records = []
+        while self.next is not None and self.time(self.next) < tstop:
+            records.append(self.next)
+            self.next = next(self.records, None)
+            self.row += 1
+        records.sort(key=lambda r: r[1])
+        return ([self.time(r) for r in records], [r[2] / 1000 for r in records],
+                [bool(r[3]) for r in records], [r[4] / 8 for r in records])
+
+    @property
+    def finished(self):
+        return self.next is None
+
+
+# Columnar frame store
+# Frames are kept as rows of typed numpy arrays instead of Frame objects.
+# Unknown `sent` and `availability` are stored as NaN.
+COLUMNS = [("size", np.float64), ("order", np.int64), ("Iframe", np.bool_),
+           ("origin", np.int32), ("bitrate", np.float64),
+           ("timestamp", np.float64), ("sent", np.float64),
+           ("availability", np.float64)]
+
+# origin names <-> origin ids of the columnar store
+ORIGINS = []
+ORIGIN_IDS = {}
+
+
+def origin_id(origin):
+    "Return the id of an origin name (registered on first use)"
+    i = ORIGIN_IDS.get(origin)
+    if i is None:
+        i = ORIGIN_IDS[origin] = len(ORIGINS)
+        ORIGINS.append(origin)
+    return i
+
+
+def origin_ids(origins):
+    """Ids in this process of the origin names `origins`, e.g. the ORIGINS of
+    the process that pickled a columnar store"""
+    return np.array([origin_id(o) for o in origins], dtype=np.int32)
+
+
+class _Column:
+    "Attribute of a FrameView read from / written to its batch column"
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        value = view.batch.columns[self.name][view.index].item()
+        if self.name == "origin":
+            return ORIGINS[value]
+        if value != value:  # NaN: not known yet
+            return None
+        return value
+
+    def __set__(self, view, value):
+        if self.name == "origin":
+            value = origin_id(value)
+        elif value is None:
+            value = np.nan
+        view.batch.columns[self.name][view.index] = value
+
+
+class FrameView:
+    """Lightweight Frame-like access to one row of a FrameBatch.
+    Has the same attributes and `describe` as Frame."""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    describe = Frame.describe
+
+
+for _name, _ in COLUMNS:
+    setattr(FrameView, _name, _Column(_name))
+
+
+class FrameBatch:
+    """Frames stored column-wise: `columns` maps each name of COLUMNS to an
+    array. Iterating or indexing gives FrameViews."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["size"])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("FrameBatch index out of range")
+        return FrameView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FrameView(self, i)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def __getstate__(self):
+        # The origin ids are only valid in this process: pickle the names
+        return {"columns": self.columns, "origins": list(ORIGINS)}
+
+    def __setstate__(self, state):
+        self.columns = dict(state["columns"])
+        self.columns["origin"] = origin_ids(state["origins"])[self.columns["origin"]]
+
+
+class ColumnarQueue(object):
+    """Queue storing the frames in growable numpy ring buffers (one per
+    attribute of COLUMNS) instead of a deque of Frame objects.
+
+    Same contract as Queue (`add`, `dequeue`, `getFrames`, `load`, `length`).
+    `dequeue` and `getFrames` return a FrameBatch, i.e. a copy of the rows
+    accessed through FrameViews.
+    """
+
+    listener = None  # e.g. the Streamer, c.f. `Streamer.queue_changed`
+
+    def __init__(self, queue_name, default_load=[], capacity=1024):
+        self.max_size = 500_000_000  # 500 MB Default value
+        self.load = 0
+        self.length = 0
+        self.empty = True
+        self.name = queue_name
+        self.head = 0
+        self.capacity = capacity
+        self.columns = {name: np.empty(capacity, dtype) for name, dtype in COLUMNS}
+
+        if len(default_load) != 0:
+            load = sum([f.size for f in default_load])
+            if load > self.max_size:
+                raise OverflowError("Initialization Overflow")
+            for f in default_load:
+                self.add(f)
+
+    def __getstate__(self):
+        # The origin ids are only valid in this process: pickle the names
+        state = dict(self.__dict__)
+        state["origins"] = list(ORIGINS)
+        return state
+
+    def __setstate__(self, state):
+        origins = state.pop("origins")
+        self.__dict__.update(state)
+        idx = self._index(0, self.length)
+        self.columns["origin"][idx] = origin_ids(origins)[self.columns["origin"][idx]]
+
+    def _grow(self, needed):
+        "Double the capacity until `needed` rows fit. Rows restart at 0"
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        idx = self._index(0, self.length)
+        for name, dtype in COLUMNS:
+            column = np.empty(capacity, dtype)
+            column[:self.length] = self.columns[name][idx]
+            self.columns[name] = column
+        self.head = 0
+        self.capacity = capacity
+
+    def _index(self, start, n):
+        "Physical positions of the rows start, ..., start + n - 1"
+        first = (self.head + start) % self.capacity
+        if first + n <= self.capacity:
+            return slice(first, first + n)
+        return (first + np.arange(n)) % self.capacity
+
+    def add(self, frame):
+        "Add a Frame (or any object with the attributes of COLUMNS)"
+        if self.load + frame.size >= self.max_size:
+            raise OverflowError("Queue is full")
+        if self.length == self.capacity:
+            self._grow(self.length + 1)
+        i = (self.head + self.length) % self.capacity
+        c = self.columns
+        c["size"][i] = frame.size
+        c["order"][i] = frame.order
+        c["Iframe"][i] = frame.Iframe
+        c["origin"][i] = origin_id(frame.origin)
+        c["bitrate"][i] = np.nan if frame.bitrate is None else frame.bitrate
+        c["timestamp"][i] = np.nan if frame.timestamp is None else frame.timestamp
+        c["sent"][i] = np.nan if frame.sent is None else frame.sent
+        c["availability"][i] = np.nan if frame.availability is None else frame.availability
+        self.length += 1
+        self.load += frame.size
+        self.empty = False
+        if self.listener is not None:
+            self.listener.queue_changed(self, 1, frame.size)
+
+    def extend(self, frames):
+        "Add a list of frames at once"
+        for f in frames:
+            self.add(f)
+
+    def add_batch(self, sizes, orders, IFrames, origin, bitrate, timestamps):
+        """Add one frame per element of sizes, orders, IFrames and timestamps
+        without creating Frame objects.
+        Return a FrameBatch of the new frames"""
+        n = len(sizes)
+        sizes = np.asarray(sizes, dtype=np.float64)
+        load = sizes.sum()
+        if self.load + load >= self.max_size:
+            raise OverflowError("Queue is full")
+        if self.length + n > self.capacity:
+            self._grow(self.length + n)
+        idx = self._index(self.length, n)
+        c = self.columns
+        c["size"][idx] = sizes
+        c["order"][idx] = orders
+        c["Iframe"][idx] = IFrames
+        c["origin"][idx] = origin_id(origin)
+        c["bitrate"][idx] = np.nan if bitrate is None else bitrate  # value or list
+        c["timestamp"][idx] = timestamps
+        c["sent"][idx] = np.nan
+        c["availability"][idx] = np.nan
+        self.length += n
+        self.load += load
+        self.empty = self.length == 0
+        if self.listener is not None:
+            self.listener.queue_changed(self, n, load)
+        # A slice is a view on the ring buffer: copy it (c.f. `getFrames`)
+        return FrameBatch({name: np.array(column[idx]) for name, column in c.items()})
+
+    def dequeue(self, nb_frames):
+        """Dequeue frames from the queue
+        Return a FrameBatch.
+        """
+        if nb_frames > self.length:
+            raise IndexError("dequeue from a queue with less frames")
+        batch = self.getFrames(nb_frames)
+        self.head = (self.head + nb_frames) % self.capacity
+        kb = batch.columns["size"].sum()
+        self.load -= kb
+        self.length -= nb_frames
+        self.empty = True if 0 == self.length else False
+        if self.empty:
+            self.load = 0  # no float residue
+        if self.listener is not None:
+            self.listener.queue_changed(self, -nb_frames, -kb)
+        return batch
+
+    def expired(self, cutoff):
+        "Number of first frames with a timestamp before cutoff (binary search)"
+        first = self.head
+        end = min(first + self.length, self.capacity)
+        timestamps = self.columns["timestamp"]
+        n = int(np.searchsorted(timestamps[first:end], cutoff))
+        if n == end - first and n < self.length:
+            # The rows wrap around the end of the ring buffer
+            n += int(np.searchsorted(timestamps[:self.length - n], cutoff))
+        return n
+
+    def drop(self, n):
+        """Remove the P-frames among the n first frames, the I-frames stay at
+        the head of the queue.
+        Return the number and the total size of the dropped frames
+        """
+        positions = (self.head + np.arange(n)) % self.capacity
+        iframes = self.columns["Iframe"][positions]
+        kept = positions[iframes]
+        dropped = n - len(kept)
+        kb = float(self.columns["size"][positions[~iframes]].sum())
+        if len(kept) and dropped:
+            # Move the I-frames just before the first frame not dropped
+            for column in self.columns.values():
+                column[positions[dropped:]] = column[kept]
+        self.head = (self.head + dropped) % self.capacity
+        self.load -= kb
+        self.length -= dropped
+        self.empty = self.length == 0
+        if self.empty:
+            self.load = 0
+        if self.listener is not None:
+            self.listener.queue_changed(self, -dropped, -kb)
+        return dropped, kb
+
+    def getFrames(self, n):
+        "Get the n first frames or m < n if the queue only contains m frames"
+        idx = self._index(0, min(n, self.length))
+        # Fancy indexing copies, a slice has to be copied explicitly
+        return FrameBatch({name: np.array(column[idx]) for name, column in self.columns.items()})
+
+    def peek(self, name):
+        "Attribute `name` of the first frame, None if the queue is empty"
+        if not self.length:
+            return None
+        # view on the ring buffer itself
+        return getattr(FrameView(FrameBatch(self.columns), self.head), name)
+
+    def column(self, name, n=0):
+        "Array of the attribute `name` of the n first frames (all if n=0)"
+        n = min(n, self.length) if n else self.length
+        return np.array(self.columns[name][self._index(0, n)])
+
+    def tail(self, name, n):
+        "Array of the attribute `name` of the n last frames"
+        n = min(n, self.length)
+        return np.array(self.columns[name][self._index(self.length - n, n)])
+
+    @property
+    def queue(self):
+        "All the frames of the queue"
+        return self.getFrames(self.length)
+
+    def flush(self):
+        "Flush the queue"
+        length, load = self.length, self.load
+        self.head = 0
+        self.load = 0
+        self.length = 0
+        self.empty = True
+        if self.listener is not None:
+            self.listener.queue_changed(self, -length, -load)
+
+    def describe(self, full=False):
+        "Return a string description of the queue"
+        s = "{} : ".format(self.name)
+        if full:
+            s += '\n'
+        if self.empty:
+            return s + "Empty  "
+        for f in self.queue:
+            s += f.describe(full)
+        return s[:-2]
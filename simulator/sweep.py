@@ -0,0 +1,192 @@
+#! python3
+"""
+Parameter sweep: run a grid of scenarios in parallel worker processes.
+
+A scenario is a plain dict (c.f. DEFAULT_SCENARIO):
+ streamers: list of keyword arguments of `Streamer`
+ arrival_scale: factor applied to the arrival rate of every streamer
+ scheduler: name in SCHEDULERS, scheduler_args: its extra keyword arguments
+ trace: network trace of a NetworkTracesChannel, None for a
+        StableChannelNoWindow of `bandwidth` KBps
+ serialize: frames sent back-to-back on the link (c.f. `channel.Channel`)
+ fps: frame rate of the receiver
+ bounded, max_buffer, playback_interval: incremental playback with a
+        bounded receiver buffer (c.f. `Receiver`)
+ batch: decide the frames fitting in the channel capacity of each
+        decision interval instead of at most maxf
+ drop_delay: drop the P-frames waiting for more than drop_delay seconds
+ qoe: add the delay, rebuffering and window bitrate percentiles to the
+        rows. The row key "qoe" then holds the `metrics.QoEAccumulator` of
+        the streamer, c.f. `merge_qoe`
+ duration, decision_interval, arrival_interval, maxf: c.f. `engine.Simulation`
+
+Each scenario gets its own seed, derived from the seed of the sweep.
+"""
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+from stream import Streamer, Queue
+from scheduler import RandomScheduler, FIFOScheduler, PriorityBasedScheduler
+from channel import StableChannelNoWindow, NetworkTracesChannel
+from receiver import Receiver
+from engine import EventEngine, Simulation
+from metrics import merge
+
+SCHEDULERS = {"Random": RandomScheduler, "FIFO": FIFOScheduler,
+              "Priority": PriorityBasedScheduler}
+
+# Environment of simulation.py
+DEFAULT_SCENARIO = {
+    "streamers": [
+        dict(streamer="Alice", qnames=["Base", "Enhanced"], priority=2,
+             arrival_rate=1500, I_P_arrival_ratio=0.2, I_P_size_ratio=5,
+             mean_frames=[8, 10], var_frames=[0, 0]),
+        dict(streamer="Bob", qnames=["Base", "Enhanced"], priority=2,
+             arrival_rate=1000, I_P_arrival_ratio=0.2, I_P_size_ratio=5,
+             mean_frames=[5, 6], var_frames=[0, 0])],
+    "arrival_scale": 1,
+    "scheduler": "FIFO",
+    "scheduler_args": {},
+    "trace": "/traces/huabei/liveldResult_2019-05-12.txt",
+    "traces_intertime": 0.5,
+    "bandwidth": 1000,
+    "serialize": False,
+    "fps": 30,
+    "bounded": False,
+    "max_buffer": None,
+    "playback_interval": 1,
+    "qoe": False,
+    "drop_delay": None,
+    "batch": False,
+    "duration": 60,
+    "decision_interval": 0.001,
+    "arrival_interval": 0.01,
+    "maxf": 1,
+    "seed": 0,
+}
+
+# Scenario keys reported in the result table
+KEYS = ["scheduler", "trace", "bandwidth", "fps", "arrival_scale", "seed"]
+METRICS = ["total_rebuffering_event", "total_rebuffering_time", "total_delay",
+           "average_rate", "total_frame"]
+
+
+def expand_grid(grid, base=None):
+    """Scenarios of the cartesian product of the values of `grid` (a dict of
+    lists), the other keys being taken from `base` (default DEFAULT_SCENARIO)"""
+    base = DEFAULT_SCENARIO if base is None else base
+    keys = list(grid)
+    return [dict(base, **dict(zip(keys, values)))
+            for values in product(*[grid[k] for k in keys])]
+
+
+def make_scheduler(name, streamers, engine, scheduler_args=None):
+    "Scheduler `name` (c.f. SCHEDULERS) of the streamers, on the clock and rng of the engine"
+    scheduler_type = SCHEDULERS[name]
+    scheduler_args = dict(scheduler_args or {})
+    if scheduler_type is PriorityBasedScheduler:
+        scheduler_args.setdefault("clock", engine)
+    return scheduler_type(streamers, rng=engine.rng, **scheduler_args)
+
+
+def build_simulation(scenario):
+    "Create the engine, streamers, scheduler, channel and receiver of a scenario"
+    engine = EventEngine(seed=scenario["seed"])
+
+    streamers = []
+    for kwargs in scenario["streamers"]:
+        kwargs = dict(kwargs)
+        kwargs["arrival_rate"] = kwargs.get("arrival_rate", 0) * scenario["arrival_scale"]
+        streamers.append(Streamer(**kwargs))
+
+    scheduler = make_scheduler(scenario["scheduler"], streamers, engine, scenario["scheduler_args"])
+
+    if scenario["trace"]:
+        channel = NetworkTracesChannel(scenario["trace"], scenario["traces_intertime"], clock=engine,
+                                       serialize=scenario["serialize"])
+    else:
+        channel = StableChannelNoWindow(bandwidth=scenario["bandwidth"], clock=engine,
+                                        serialize=scenario["serialize"])
+
+    receiver = Receiver(queues=[Queue(s.streamer) for s in streamers],
+                        fps=scenario["fps"], clock=engine,
+                        bounded=scenario["bounded"], max_buffer=scenario["max_buffer"],
+                        qoe=scenario["qoe"])
+
+    return Simulation(scheduler, channel, receiver, engine,
+                      decision_interval=scenario["decision_interval"],
+                      arrival_interval=scenario["arrival_interval"],
+                      maxf=scenario["maxf"],
+                      playback_interval=scenario["playback_interval"],
+                      drop_delay=scenario["drop_delay"],
+                      batch=scenario["batch"])
+
+
+def run_scenario(scenario):
+    """Run one scenario. Return one row per streamer: the scenario keys
+    (c.f. KEYS) and the metrics of `Receiver.playback`"""
+    simulation = build_simulation(scenario)
+    metrics = simulation.run(scenario["duration"])
+    receiver = simulation.receiver
+    rows = []
+    for i, (streamer, m) in enumerate(metrics.items()):
+        row = {k: scenario[k] for k in KEYS}
+        row["streamer"] = streamer
+        row.update(m if m else dict.fromkeys(METRICS, 0))
+        if receiver.qoe:
+            row.update(receiver.qoe[i].summary())
+            row["qoe"] = receiver.qoe[i]
+        rows.append(row)
+    return rows
+
+
+def run_sweep(scenarios, workers=None, seed=0):
+    """Run the scenarios on `workers` processes (default: all cores).
+    Each scenario gets an independent seed spawned from `seed`.
+
+    Return the rows of all scenarios (c.f. `run_scenario`), in order
+    """
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(scenarios))]
+    scenarios = [dict(scenario, seed=s) for scenario, s in zip(scenarios, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_scenario, scenarios))
+    return [row for rows in results for row in rows]
+
+
+def merge_qoe(rows, keys=("scheduler", "streamer")):
+    """Merge the QoE distributions of the rows (qoe scenarios) having the same
+    values for `keys`, e.g. the runs of a streamer with different seeds.
+    Return one row per group: the keys and the merged percentiles"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[k] for k in keys), []).append(row["qoe"])
+    merged = []
+    for values, accumulators in groups.items():
+        row = dict(zip(keys, values))
+        row["runs"] = len(accumulators)
+        row.update(merge(accumulators).summary())
+        merged.append(row)
+    return merged
+
+
+def format_table(rows, columns=None):
+    "Return the rows as a text table"
+    columns = columns or KEYS + ["streamer"] + METRICS
+
+    def fmt(v):
+        return "{:.4f}".format(v) if isinstance(v, float) else str(v)
+
+    cells = [[fmt(row.get(c, "")) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(r, widths)) for r in cells]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    grid = {"scheduler": ["Random", "FIFO", "Priority"],
+            "trace": [None, "/traces/huabei/liveldResult_2019-05-12.txt"],
+            "arrival_scale": [0.5, 1]}
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(format_table(run_sweep(expand_grid(grid), workers=workers)))
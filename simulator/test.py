@@ -1,10 +1,35 @@
 #! python3
 import unittest
-from stream import Frame, Queue, Streamer
-from scheduler import RandomScheduler
+import numpy as np
+from stream import Frame, Queue, Streamer, ColumnarQueue, FrameTrace
+from scheduler import RandomScheduler, FIFOScheduler, PriorityBasedScheduler
 from time import time
 from receiver import Receiver
-from utils import get_scaled_time
+from channel import StableChannelNoWindow, NetworkTracesChannel, NetworkTracesChannels, CapacityTrace
+from math import inf
+from engine import EventEngine, Simulation, ARRIVAL, DECISION, TRANSMISSION
+from multicast import MulticastGroup
+from sweep import expand_grid, run_sweep, format_table, merge_qoe
+from metrics import LogHistogram, QoEAccumulator
+import benchmark
+from instrument import Instrumentation, PhaseTimer, profile
+from arrivals import ArrivalRecorder, ArrivalReplay, read_arrivals
+from env import SchedulingEnv, VectorEnv, greedy_actions
+from eventlog import EventLog, load, lifecycle, EXPIRED, BUFFER
+from snapshot import warm_up, snapshot, restore, fork, compare
+from sweep import build_simulation, run_scenario, DEFAULT_SCENARIO
+from live import receive, run_live, TokenBucket, WallClock
+import asyncio
+import socket
+from unittest import mock
+import io
+from utils import get_scaled_time, cached_trace, parse_network_trace, parse_frame_trace, PATH, IndexedHeap, IndexedSet
+import pickle
+import random
+import subprocess
+import sys
+import os
+import tempfile
 
 class FrameTestCase(unittest.TestCase):
 
@@ -56,6 +81,71 @@ class QueueTestCase(unittest.TestCase):
         self.q_base1
 
 
+class ColumnarQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.q_base1 = ColumnarQueue(queue_name="Base", capacity=2)
+        self.q_base1.add(Frame(23, 1, True, "alice", timestamp=1.0))
+
+        self.q_base2 = ColumnarQueue(queue_name="Enhance", default_load=[Frame(91, 3, True), Frame(20, 4, False)])
+        self.q_base2.add(Frame(12, 5, False))
+
+    def test_add_and_load(self):
+        self.q_base1.add(Frame(22, 2, False))
+        self.q_base1.add(Frame(10, 3, False))
+        self.assertEqual(self.q_base1.load, 55)
+        self.assertEqual(self.q_base2.load, 123)
+        self.assertEqual(self.q_base1.length, 3)
+
+    def test_getFrames(self):
+        self.assertEqual(len(self.q_base2.getFrames(100)), 3)
+        self.assertEqual(len(self.q_base2.getFrames(2)), 2)
+        f = self.q_base1.getFrames(1)[0]
+        self.assertEqual(f.size, 23)
+        self.assertEqual(f.origin, "alice")
+        self.assertTrue(f.Iframe)
+        self.assertIsNone(f.availability)
+
+    def test_dequeue(self):
+        l1 = self.q_base1.dequeue(1)
+        self.assertTrue(self.q_base1.empty)
+        self.assertEqual(self.q_base1.load, 0)
+        with self.assertRaises(IndexError):
+            self.q_base1.dequeue(1)
+        self.assertEqual(l1[0].size, 23)
+
+        l2 = self.q_base2.dequeue(2)
+        self.assertEqual([f.order for f in l2], [3, 4])
+        self.assertEqual(self.q_base2.load, 12)
+
+    def test_ring_buffer(self):
+        # wrap around and grow while keeping the order
+        for i in range(2, 10):
+            self.q_base1.add(Frame(i, i, False))
+            self.q_base1.dequeue(1)
+        self.q_base1.add_batch([1, 2, 3], [10, 11, 12], [False, True, False], "bob", 500, [2, 3, 4])
+        self.assertEqual(list(self.q_base1.column("order")), [9, 10, 11, 12])
+        self.assertEqual(self.q_base1.load, 15)
+        self.assertEqual(self.q_base1.dequeue(4)[1].origin, "bob")
+
+    def test_add_batch_copy(self):
+        # The frames returned do not change when the ring buffer is reused
+        q = ColumnarQueue("Base", capacity=4)
+        added = q.add_batch([1, 2, 3], [1, 2, 3], [False] * 3, "x", 500, [1.0, 2.0, 3.0])
+        q.dequeue(3)
+        q.add_batch([6, 7, 8], [6, 7, 8], [False] * 3, "y", 500, [9.0, 9.0, 9.0])
+        self.assertEqual([(f.timestamp, f.order, f.origin) for f in added],
+                         [(1.0, 1, "x"), (2.0, 2, "x"), (3.0, 3, "x")])
+
+    def test_view(self):
+        f = self.q_base1.dequeue(1)[0]
+        f.availability = 2.5
+        self.assertEqual(f.availability, 2.5)
+        receiver_queue = ColumnarQueue("alice")
+        receiver_queue.add(f)
+        self.assertEqual(receiver_queue.getFrames(1)[0].availability, 2.5)
+        self.assertEqual(receiver_queue.getFrames(1)[0].timestamp, 1.0)
+
+
 class StreamerTestCase(unittest.TestCase):
     def setUp(self):
         pass
@@ -63,6 +153,35 @@ class StreamerTestCase(unittest.TestCase):
         #           I_P_arrival_ratio=0.2, quality_ratio=0.3,
         #           mean_frames=[3,4], var_frames=[1,1])
 
+    def test_drop_expired(self):
+        for queue_type in [Queue, ColumnarQueue]:
+            s = Streamer(streamer="Bob", qnames=["Base", "Enhanced"], priority=2,
+                         mean_frames=[1, 2], arrival_rate=0, queue_type=queue_type)
+            if queue_type is ColumnarQueue:
+                # Rows wrapping around the end of the ring buffers
+                s.queues = [ColumnarQueue(q.name, capacity=8) for q in s.queues]
+                s.update_batch([0] * 5, [0] * 5, [False] * 5, [[1] * 5, [2] * 5])
+                s.dequeue(0, 5)
+            IFrames = [False, True, False, False, True, False, False]
+            s.update_batch(list(range(7)), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7], IFrames,
+                           [[1, 5, 1, 1, 5, 1, 1], [2, 10, 2, 2, 10, 2, 2]])
+            self.assertEqual(s.queues[0].expired(0.45), 4)
+            self.assertEqual(s.queues[1].expired(10), 7)
+
+            self.assertEqual(s.drop_expired(0.45), 3)
+            self.assertEqual((s.dropped_frames, s.dropped_kb), (3, 9))
+            for q, load in zip(s.queues, [12, 24]):
+                self.assertEqual(q.length, 4)
+                self.assertEqual(q.load, load)
+                self.assertEqual(list(q.column("order")), [1, 4, 5, 6])
+                self.assertEqual(list(q.column("Iframe")), [True, True, False, False])
+
+            # The I-frame is kept
+            self.assertEqual(s.drop_expired(0.45), 0)
+            self.assertEqual(s.drop_expired(1), 2)
+            self.assertEqual([f.order for f in s.dequeue(1, 2)], [1, 4])
+            self.assertTrue(s.isEmpty())
+
 
 class SchedulerTestCase(unittest.TestCase):
     def setUp(self):
@@ -106,6 +225,105 @@ class SchedulerTestCase(unittest.TestCase):
 
         self.assertAlmostEqual(tkb/ttime, self.alice.arrival_rate + self.bob.arrival_rate, delta=delta)
 
+    def test_fifo_order(self):
+        fifo = FIFOScheduler(streames=[self.alice, self.bob], rng=np.random.default_rng(1))
+        orders = [f.order for f in fifo.update(0, 50)]
+        self.assertGreater(len(orders), 50)
+        decided = []
+        while True:
+            frames = fifo.decide(maxf=7)
+            if not frames:
+                break
+            self.assertLessEqual(len(frames), 7)
+            decided.extend(f.order for f in frames)
+        self.assertEqual(decided, sorted(orders))
+        self.assertEqual(fifo.to_be_decided, decided[-1] + 1)
+        self.assertTrue(self.alice.isEmpty() and self.bob.isEmpty())
+
+    def test_priority_order(self):
+        engine = EventEngine()
+        self.alice.priority, self.bob.priority = 4, 0
+        # Deadlines: Alice timestamp + 0.2, Bob timestamp + 1
+        for order, (s, t) in enumerate([(self.bob, 0.0), (self.alice, 0.5), (self.bob, 0.6), (self.alice, 1.0)]):
+            for size, q in zip([5, 10], s.queues):
+                q.add(Frame(size, order, order == 0, s.streamer, timestamp=t))
+        scheduler = PriorityBasedScheduler(streames=[self.alice, self.bob], max_delay=1, clock=engine)
+        self.assertEqual([f.order for f in scheduler.decide(maxf=1)], [1])
+        engine.run(until=1.3)
+        frames = scheduler.decide(maxf=10)
+        # Late I-frames are sent at the base quality, late P-frames dropped
+        self.assertEqual([f.order for f in frames], [0, 2])
+        self.assertEqual([f.size for f in frames], [5, 10])
+        self.assertEqual((self.alice.dropped_frames, self.alice.dropped_kb), (1, 15))
+        self.assertTrue(self.alice.queues[1].empty and self.bob.isEmpty())
+        self.assertFalse(scheduler.decide())
+
+    def test_decide_budget(self):
+        for scheduler_type in [FIFOScheduler, PriorityBasedScheduler, RandomScheduler]:
+            streamers = [Streamer(streamer=name, qnames=["Base"], priority=2, mean_frames=[1], arrival_rate=0)
+                         for name in ["alice", "bob"]]
+            streamers[0].update_batch([0, 2, 4], [0.0, 0.2, 0.4], [True, False, False], [[10, 3, 3]])
+            streamers[1].update_batch([1, 3, 5], [0.1, 0.3, 0.5], [True, False, False], [[8, 4, 4]])
+            scheduler = scheduler_type(streamers)
+
+            self.assertEqual(scheduler.decide(budget=5), [])
+            frames = scheduler.decide(budget=21.5)
+            self.assertLessEqual(sum(f.size for f in frames), 21.5)
+            if scheduler_type is not RandomScheduler:
+                self.assertEqual([f.order for f in frames], [0, 1, 2])
+            frames += scheduler.decide(budget=100)
+            self.assertEqual(sorted(f.order for f in frames), list(range(6)))
+            self.assertFalse(scheduler.decide(budget=100))
+
+    def test_active_index(self):
+        for queue_type in [Queue, ColumnarQueue]:
+            streamers = [Streamer(streamer=name, qnames=["Base", "Enhanced"], priority=2,
+                                  mean_frames=[1, 2], arrival_rate=0, queue_type=queue_type)
+                         for name in ["alice", "bob", "carol"]]
+            scheduler = RandomScheduler(streamers)
+            self.assertEqual(len(scheduler.active), 0)
+            # No source
+            self.assertEqual(scheduler.update(0, 1), [])
+
+            def check():
+                self.assertEqual(set(scheduler.active),
+                                 {i for i, s in enumerate(streamers) if not s.isEmpty()})
+                self.assertEqual(scheduler.pending_frames, sum(s.queues[-1].length for s in streamers))
+                self.assertAlmostEqual(scheduler.pending_kb, sum(s.queues[-1].load for s in streamers))
+
+            scheduler.ingest(1, [0.0, 0.1, 0.2], [True, False, False], [[1, 1, 1], [5, 2, 2]])
+            streamers[2].queues[0].add(Frame(1, 10, False, "carol", 1, 0.3))
+            check()
+            self.assertTrue(streamers[2].queues[1].empty and not streamers[2].isEmpty())
+            streamers[1].drop_expired(0.15)
+            check()
+            streamers[2].queues[0].flush()
+            check()
+            scheduler.decide(maxf=1)
+            check()
+            self.assertEqual(list(scheduler.active), [1])
+            while scheduler.decide(maxf=10):
+                check()
+            self.assertEqual((len(scheduler.active), scheduler.pending_frames), (0, 0))
+
+    def test_batchArrivalRate(self):
+        self.rs.rng = np.random.default_rng(0)
+        tkb = 0
+        orders = []
+        ttime = 2400
+        for t in range(0, ttime * 10):
+            updated_frames = self.rs.update(t / 10, (t + 1) / 10)
+            tkb += sum([f.size for f in updated_frames])
+            orders.extend(f.order for f in updated_frames)
+            for s in self.rs.streamers:
+                for q in s.queues:
+                    q.dequeue(q.length)
+
+        expected_total = sum([s.arrival_rate for s in self.rs.streamers])
+        self.assertAlmostEqual(tkb/ttime, expected_total, delta=expected_total/100)
+        # Every arrival order is given exactly once
+        self.assertEqual(sorted(orders), list(range(orders[0], orders[0] + len(orders))))
+
 
 class ReceiverTestCase(unittest.TestCase):
     def setUp(self):
@@ -188,5 +406,915 @@ class ReceiverTestCase(unittest.TestCase):
                              "total_frame": 2}}
 
         self.assertEqual(results, expected)
+
+    def assertMetricsAlmostEqual(self, r1, r2):
+        self.assertEqual(r1.keys(), r2.keys())
+        for name in r1:
+            if r1[name] == 0 or r2[name] == 0:
+                self.assertEqual(r1[name], r2[name])
+                continue
+            for m in r1[name]:
+                self.assertAlmostEqual(r1[name][m], r2[name][m], places=5)
+
+    def test_playback_vectorized(self):
+        rng = np.random.default_rng(0)
+        receivers = [Receiver(queues=[queue_type(s) for s in ["alice", "bob"]], fps=30)
+                     for queue_type in [Queue, Queue, ColumnarQueue]]
+        for r in receivers:
+            r.lastPlay = [1, 2]
+        for k in range(3):
+            timestamps = np.sort(rng.random(1000) * 30) + 30 * k
+            availability = timestamps + rng.exponential(0.2, 1000)
+            frames = [Frame(5, i, False, ["alice", "bob"][i % 2], bitrate=100 + i % 7,
+                            timestamp=t, availability=a)
+                      for i, (t, a) in enumerate(zip(timestamps.tolist(), availability.tolist()))]
+            for r in receivers:
+                r.receive(frames)
+
+            # Dry run, partial then full playback
+            for kwargs in [{"info": True}, {"N": 100}, {"N": 10_000}, {}]:
+                expected = receivers[0].playback(**kwargs)
+                self.assertMetricsAlmostEqual(expected, receivers[1].playback(vectorized=True, **kwargs))
+                self.assertMetricsAlmostEqual(expected, receivers[2].playback(vectorized=True, **kwargs))
+                self.assertAlmostEqual(receivers[0].lastPlay[0], receivers[1].lastPlay[0])
+                self.assertAlmostEqual(receivers[0].lastPlay[1], receivers[2].lastPlay[1])
+            self.assertTrue(receivers[2].queues[0].empty)
+
+    def test_bounded_playback(self):
+        rng = np.random.default_rng(1)
+        receiver = Receiver(queues=[Queue(s) for s in ["alice", "bob"]], fps=30)
+        bounded = Receiver(queues=[ColumnarQueue(s) for s in ["alice", "bob"]], fps=30, bounded=True)
+        timestamps = np.sort(rng.random(600) * 20)
+        availability = timestamps + rng.exponential(0.2, 600)
+        frames = [Frame(5, i, False, ["alice", "bob"][i % 2], bitrate=100 + i % 7,
+                        timestamp=t, availability=a)
+                  for i, (t, a) in enumerate(zip(timestamps.tolist(), availability.tolist()))]
+        receiver.receive(frames)
+        for k in range(20):
+            bounded.receive([f for f in frames if k <= f.timestamp < k + 1])
+            bounded.play_until(k + 1)
+            # Only the frames waiting to be played are kept
+            self.assertLess(bounded.queues[0].length, 60)
+
+        running = bounded.running_metrics()
+        self.assertLess(running["alice"]["total_frame"], 300)
+        self.assertEqual(running["alice"]["total_frame"] + bounded.queues[0].length, 300)
+        self.assertEqual(running["alice"]["buffer_kb"], bounded.queues[0].load)
+        self.assertGreater(running["alice"]["max_buffer_kb"], running["alice"]["mean_buffer_kb"])
+
+        expected = receiver.playback()
+        results = bounded.playback()
+        for name in expected:
+            for m in expected[name]:
+                self.assertAlmostEqual(expected[name][m], results[name][m], places=4)
+            self.assertEqual(results[name]["dropped_frames"], 0)
+            self.assertEqual(results[name]["buffer_kb"], 0)
+
+        # Frames received on a full buffer are dropped
+        engine = EventEngine()
+        small = Receiver(queues=[Queue("alice")], fps=30, clock=engine, bounded=True, max_buffer=12)
+        small.start()
+        small.receive(frames[0:6:2])
+        self.assertEqual(small.queues[0].length, 2)
+        self.assertEqual((small.dropped[0], small.dropped_kb[0]), (1, 5))
+        # unless the frames played by now make room
+        engine.now = frames[0].availability
+        small.receive(frames[6:8:2])
+        self.assertEqual(small.dropped[0], 1)
+        self.assertEqual(small.running_metrics()["alice"]["total_frame"], 1)
+        self.assertEqual(small.playback()["alice"]["total_frame"], 3)
+
+
+def make_simulation(seed, queue_type=Queue, **receiver_args):
+    "Simulation of two small synthetic streamers on a stable channel"
+    engine = EventEngine(seed=seed)
+    streamers = [Streamer(streamer="Alice", qnames=["Base", "Enhanced"], priority=2,
+                          arrival_rate=150, I_P_arrival_ratio=0.2, I_P_size_ratio=5,
+                          mean_frames=[8, 10], var_frames=[1, 1], queue_type=queue_type),
+                 Streamer(streamer="Bob", qnames=["Base", "Enhanced"], priority=2,
+                          arrival_rate=100, I_P_arrival_ratio=0.2, I_P_size_ratio=5,
+                          mean_frames=[5, 6], var_frames=[0.5, 0.5], queue_type=queue_type)]
+    scheduler = FIFOScheduler(streames=streamers, rng=engine.rng)
+    channel = StableChannelNoWindow(bandwidth=1000, clock=engine)
+    receiver = Receiver(queues=[queue_type(s.streamer) for s in streamers], fps=30, clock=engine,
+                        **receiver_args)
+    return Simulation(scheduler, channel, receiver, engine)
+
+
+class EngineTestCase(unittest.TestCase):
+
+    def test_event_order(self):
+        engine = EventEngine()
+        events = []
+        engine.schedule(2, ARRIVAL, events.append, "late")
+        engine.schedule(1, DECISION, events.append, "decision")
+        engine.schedule(1, ARRIVAL, events.append, "arrival")
+        engine.run(until=1.5)
+        self.assertEqual(events, ["arrival", "decision"])
+        self.assertEqual(engine.get_time(), 1.5)
+        with self.assertRaises(ValueError):
+            engine.schedule(1, ARRIVAL, events.append, "past")
+
+    def run_simulation(self, seed, duration=5, queue_type=Queue):
+        return make_simulation(seed, queue_type).run(duration)
+
+    def test_reproducible(self):
+        r1 = self.run_simulation(seed=1)
+        r2 = self.run_simulation(seed=1)
+        r3 = self.run_simulation(seed=2)
+        self.assertEqual(r1, r2)
+        self.assertNotEqual(r1, r3)
+        self.assertGreater(r1["Alice"]["total_frame"], 0)
+
+    def test_bounded_receiver(self):
+        expected = self.run_simulation(seed=3)
+        simulation = make_simulation(3, bounded=True)
+        monitored = []
+        simulation.monitor = lambda now, metrics: monitored.append((now, metrics["Alice"]["total_frame"]))
+        results = simulation.run(5)
+        self.assertEqual([t for t, _ in monitored], [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(monitored), monitored)
+        for name in expected:
+            for m in expected[name]:
+                self.assertAlmostEqual(expected[name][m], results[name][m], places=4)
+
+    def test_buffer_occupancy(self):
+        # Frames played fast: the buffer only holds a few frames at a time,
+        # the ones in flight or already played are not counted
+        simulation = make_simulation(3, bounded=True, max_buffer=60)
+        simulation.receiver.fps = 1000
+        simulation.channel.bandwidth = 200
+        results = simulation.run(5)
+        for metrics in results.values():
+            self.assertEqual(metrics["dropped_frames"], 0)
+            self.assertLessEqual(metrics["max_buffer_kb"], 60)
+        self.assertEqual(sum(m["total_frame"] for m in results.values()), simulation.total_sent)
+
+        # Frames played slower than they arrive: the buffer fills up
+        simulation = make_simulation(3, bounded=True, max_buffer=60)
+        simulation.receiver.fps = 5
+        results = simulation.run(5)
+        self.assertGreater(sum(m["dropped_frames"] for m in results.values()), 0)
+
+    def test_transmission_events(self):
+        simulation = make_simulation(3, bounded=True)
+        simulation.channel.bandwidth = 20
+        simulation.start()
+        simulation.engine.run(until=3)
+        # Frames in flight are delivered by TRANSMISSION events
+        in_flight = [e for e in simulation.engine.heap if e[1] == TRANSMISSION]
+        self.assertGreater(len(in_flight), 0)
+        self.assertTrue(all(e[0] > 3 for e in in_flight))
+        for q in simulation.receiver.queues:
+            self.assertTrue((q.column("availability") <= 3).all())
+            self.assertEqual(q.column("order").tolist(), sorted(q.column("order").tolist()))
+        # All the frames sent are played at the end of the run
+        results = simulation.run(2)
+        self.assertEqual(sum(m["total_frame"] for m in results.values()), simulation.total_sent)
+        self.assertFalse(any(e[1] == TRANSMISSION for e in simulation.engine.heap))
+
+    def test_drop_expired(self):
+        for scheduler_type in [FIFOScheduler, PriorityBasedScheduler]:
+            simulation = make_simulation(4)
+            streamers = simulation.scheduler.streamers
+            if scheduler_type is PriorityBasedScheduler:
+                simulation.scheduler = PriorityBasedScheduler(streamers, clock=simulation.engine)
+            # Frames arrive faster than decided: the queues keep growing without drops
+            simulation.decision_interval = 0.05
+            simulation.drop_delay = 0.5
+            results = simulation.run(5)
+            for s in streamers:
+                self.assertGreater(s.dropped_frames, 0)
+                self.assertEqual(results[s.streamer]["expired_frames"], s.dropped_frames)
+                # Only the I-frames are older than the deadline
+                now = simulation.engine.now
+                old = s.queues[0].column("timestamp") < now - 0.5 - simulation.decision_interval
+                self.assertTrue(s.queues[0].column("Iframe")[old].all())
+            # All the frames sent or waiting, but the dropped ones
+            arrived = Streamer.Frame_Arrival
+            waiting = sum(s.queues[0].length for s in streamers)
+            dropped = sum(s.dropped_frames for s in streamers)
+            self.assertEqual(simulation.total_sent + waiting + dropped, arrived)
+
+    def test_drop_all_expired(self):
+        # P-frames only: the drops empty the streamers between decisions
+        streamers = [dict(s, I_P_arrival_ratio=0.0) for s in DEFAULT_SCENARIO["streamers"]]
+        simulation = build_simulation(dict(DEFAULT_SCENARIO, streamers=streamers, scheduler="FIFO",
+                                           seed=1, drop_delay=0.005, decision_interval=0.05))
+        results = simulation.run(10)
+        for s in simulation.scheduler.streamers:
+            self.assertGreater(s.dropped_frames, 0)
+            self.assertGreater(results[s.streamer]["total_frame"], 0)
+        waiting = sum(s.queues[0].length for s in simulation.scheduler.streamers)
+        dropped = sum(s.dropped_frames for s in simulation.scheduler.streamers)
+        self.assertEqual(simulation.total_sent + waiting + dropped, Streamer.Frame_Arrival)
+        # At most one up to date entry per streamer in the heap
+        scheduler = simulation.scheduler
+        valid = [e for e in scheduler.heads if scheduler.in_heap.get(e[1]) == e[0]]
+        self.assertEqual(len(valid), len(set(valid)))
+
+    def test_batch_decisions(self):
+        per_frame = make_simulation(7)
+        per_frame_decisions = Instrumentation(per_frame, ["decide"]).phases["decide"]
+        per_frame.run(5)
+        batch = make_simulation(7)
+        batch.batch = True
+        batch.decision_interval = 0.1
+        batch_decisions = Instrumentation(batch, ["decide"]).phases["decide"]
+        results = batch.run(5)
+        # The same arrivals are sent in far less decisions
+        waiting = sum(s.queues[0].length for s in batch.scheduler.streamers)
+        self.assertEqual(batch.total_sent + waiting, Streamer.Frame_Arrival)
+        self.assertGreater(batch.total_sent, 0.95 * per_frame.total_sent)
+        self.assertLessEqual(batch_decisions.calls, 51)
+        self.assertGreater(per_frame_decisions.calls, 150)
+        self.assertEqual(sum(r["total_frame"] for r in results.values()), batch.total_sent)
+
+        # Not enough capacity: the frames wait and the KB left are kept for the next decision
+        slow = make_simulation(7)
+        slow.batch = True
+        slow.channel.bandwidth = 20
+        slow.run(5)
+        self.assertLess(slow.total_sent, per_frame.total_sent)
+        self.assertLess(slow.credit, 20 * 3)
+
+        # Random decisions stop at the first chosen frame that does not fit:
+        # the credit is at most one interval of capacity above it
+        simulation = make_simulation(7)
+        simulation.scheduler = RandomScheduler(simulation.scheduler.streamers)
+        simulation.batch = True
+        simulation.decision_interval = 0.1
+        simulation.start()
+        for k in range(1, 51):
+            simulation.engine.run(until=k / 10)
+            self.assertLessEqual(simulation.credit, 1000 * 0.1 + simulation.scheduler.blocked + 1e-9)
+        self.assertGreater(simulation.total_sent, 0)
+
+    def test_multicast(self):
+        expected = [make_simulation(6).run(5)]
+        slow = make_simulation(6)
+        slow.channel.bandwidth = 50
+        expected.append(slow.run(5))
+
+        simulation = make_simulation(6)
+        engine = simulation.engine
+        channels = [StableChannelNoWindow(bandwidth=1000, clock=engine),
+                    StableChannelNoWindow(bandwidth=50, clock=engine)]
+        path = "/traces/huabei/liveldResult_2019-05-12.txt"
+        # Three receivers on the trace computed at once, and one alone
+        channels += [NetworkTracesChannels(path, 0.5, [0, 100, 200], clock=engine),
+                     NetworkTracesChannel(path, 0.5, clock=engine, offset=100)]
+        group = MulticastGroup(channels, ["Alice", "Bob"], fps=30, clock=engine,
+                               names=["fast", "slow", "t0", "t1", "t2", "single"], allocated=16)
+        simulation.channel = simulation.receiver = group
+        results = simulation.run(5)
+
+        self.assertEqual(list(results), ["fast", "slow", "t0", "t1", "t2", "single"])
+        for name, metrics in zip(["fast", "slow"], expected):
+            for origin in metrics:
+                for m in metrics[origin]:
+                    self.assertAlmostEqual(results[name][origin][m], metrics[origin][m], places=5)
+        self.assertNotEqual(results["t0"]["Alice"], results["t1"]["Alice"])
+        self.assertEqual(results["t1"], results["single"])
+        total = sum(results["t2"][o]["total_frame"] for o in ["Alice", "Bob"])
+        self.assertEqual(total, simulation.total_sent)
+        # One payload row per frame, one delivery time per receiver and frame
+        self.assertEqual(group.nbytes, group.allocated * (8 * 3 + 2 + 8 * 6))
+        self.assertLess(group.allocated, 2 * simulation.total_sent)
+
+    def test_multicast_batch(self):
+        def run(bandwidths):
+            simulation = make_simulation(6)
+            engine = simulation.engine
+            channels = [StableChannelNoWindow(bandwidth=b, clock=engine) for b in bandwidths]
+            group = MulticastGroup(channels, ["Alice", "Bob"], fps=30, clock=engine, allocated=16)
+            simulation.channel = simulation.receiver = group
+            simulation.batch = True
+            simulation.decision_interval = 0.1
+            return simulation, simulation.run(5)
+
+        fast, _ = run([1000])
+        slow, results = run([1000, 50])
+        self.assertEqual(list(results), [0, 1])
+        total = sum(results[1][o]["total_frame"] for o in ["Alice", "Bob"])
+        self.assertEqual(total, slow.total_sent)
+        # The budget is the capacity of the slowest receiver
+        self.assertLess(slow.total_sent, fast.total_sent)
+
+    def test_columnar_queues(self):
+        self.assertEqual(self.run_simulation(seed=1),
+                         self.run_simulation(seed=1, queue_type=ColumnarQueue))
+
+
+class IndexedHeapTestCase(unittest.TestCase):
+    def test_random_operations(self):
+        rng = random.Random(0)
+        heap, keys = IndexedHeap(), {}
+        for _ in range(2000):
+            item = rng.randrange(50)
+            op = rng.random()
+            if op < 0.5:
+                keys[item] = rng.random()
+                heap.push(item, keys[item])
+            elif op < 0.7 and item in keys:
+                heap.remove(item)
+                del keys[item]
+            elif op < 1 and keys:
+                key, top = heap.pop()
+                self.assertEqual(key, min(keys.values()))
+                del keys[top]
+            self.assertEqual(len(heap), len(keys))
+
+    def test_indexed_set(self):
+        rng = random.Random(0)
+        indexed, items = IndexedSet(), set()
+        for _ in range(2000):
+            item = rng.randrange(50)
+            if rng.random() < 0.5:
+                indexed.add(item)
+                items.add(item)
+            else:
+                indexed.discard(item)
+                items.discard(item)
+            self.assertEqual(set(indexed), items)
+            self.assertEqual(len(indexed), len(items))
+            if items:
+                self.assertIn(indexed.choice(rng), items)
+
+
+class ChannelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = EventEngine()
+        # huabei bandwidths: 0, 1872, 1312, 1344, ...
+        self.channel = NetworkTracesChannel("/traces/huabei/liveldResult_2019-05-12.txt", 0.5,
+                                            clock=self.engine)
+
+    def test_trace_delivery(self):
+        f1, f2 = Frame(1497.6, 1, True), Frame(18.72, 2, False)
+        # Sent during an outage: 0.5 s at 0, then 936 kb at 1872, the rest at 1312
+        self.channel.send_frames([f1], 0)
+        self.assertAlmostEqual(f1.availability, 1 + (1497.6 - 936) / 1312)
+
+        self.engine.run(until=0.6)
+        self.channel.send_frames([f2], 0.6)
+        self.assertEqual(self.channel.current_bandwidth, 1872)
+        self.assertAlmostEqual(f2.availability, 0.6 + 0.01)
+        self.assertEqual(f2.sent, 0.6)
+
+        # The bandwidth steps do not change the frames in flight
+        self.engine.run(until=1.1)
+        self.channel.send_frames([], 0.5)
+        self.assertEqual(self.channel.current_bandwidth, 1312)
+        self.assertAlmostEqual(f1.availability, 1 + (1497.6 - 936) / 1312)
+
+    def test_serialize(self):
+        engine = EventEngine()
+        parallel = StableChannelNoWindow(bandwidth=100, clock=engine)
+        serial = StableChannelNoWindow(bandwidth=100, sending_delay=0.1, clock=engine, serialize=True)
+        self.assertEqual(parallel.delivery_times([10, 20, 30]).tolist(), [0.1, 0.2, 0.3])
+        self.assertAlmostEqual(parallel.delivery_times([10, 20, 30]).tolist()[-1], 0.3)
+        np.testing.assert_allclose(serial.delivery_times([10, 20, 30]), [0.2, 0.4, 0.7])
+        # The link is busy until 0.6: the next frames wait for it
+        engine.run(until=0.5)
+        frames = [Frame(10, 1, False), Frame(50, 2, False)]
+        serial.send_frames(frames)
+        np.testing.assert_allclose([f.availability for f in frames], [0.8, 1.3])
+        engine.run(until=2)
+        np.testing.assert_allclose(serial.delivery_times([10]), [2.2])
+
+        # Trace: 0 KBps until 0.5, then 1872 KBps, 1312 KBps from 1 s
+        path = "/traces/huabei/liveldResult_2019-05-12.txt"
+        engine = EventEngine()
+        channel = NetworkTracesChannel(path, 0.5, clock=engine, serialize=True)
+        np.testing.assert_allclose(channel.delivery_times([468, 468]), [0.75, 1.0])
+        engine.run(until=0.1)
+        np.testing.assert_allclose(channel.delivery_times([656], 0.1), [1.5])
+        engine.run(until=2)
+        np.testing.assert_allclose(channel.delivery_times([416], 1.9), [2.5])  # 832 KBps
+
+        # Several receivers at once
+        engine = EventEngine()
+        channels = NetworkTracesChannels(path, 0.5, [0, 0.5], clock=engine, serialize=True)
+        np.testing.assert_allclose(channels.delivery_times([468, 468]), [[0.75, 1.0], [0.25, 0.5]])
+        np.testing.assert_allclose(channels.delivery_times([656]), [[1.5], [1.0]])
+        # A frame is available once delivered to every receiver
+        channels = NetworkTracesChannels(path, 0.5, [0, 0.5], clock=engine, serialize=True)
+        frames = [Frame(468, 1, False), Frame(468, 2, False)]
+        channels.send_frames(frames)
+        np.testing.assert_allclose([f.availability for f in frames], [0.75, 1.0])
+        self.assertEqual([f.sent for f in frames], [0, 0])
+
+    def test_capacity_trace(self):
+        trace = CapacityTrace([0, 100, 0, 0, 50], 0.5)
+        self.assertEqual(trace.capacity(1.25), 50)
+        self.assertEqual(trace.delivery_time(0, 50), 1)
+        self.assertEqual(trace.delivery_time(0.75, 0), 0.75)
+        # Outage from 1 to 2 s
+        self.assertEqual(trace.delivery_time(0.75, 50), 2.5)
+        # Wrap around the trace: 75 kb per period of 2.5 s
+        self.assertEqual(trace.delivery_time(2, 75), 3.5)
+        self.assertEqual(trace.delivery_time(2, 100), 5.0)
+        self.assertEqual(trace.delivery_time(0, [25, 75, 150]).tolist(), [0.75, 2.5, 5.0])
+        self.assertEqual(CapacityTrace([0, 0], 0.5).delivery_time(1, 10), inf)
+
+
+class TraceCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "liveldResult.txt")
+        with open(self.path, "w") as f:
+            f.write("production/mlinkm/1\n0\n1872\n1312\nproduction/mlinkm/2\n0\n416\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache(self):
+        trace = cached_trace(self.path, parse_network_trace)
+        self.assertEqual(trace[:, 0].tolist(), [0, 1872, 1312, 0, 416])
+        self.assertTrue(os.path.exists(self.path + ".npy"))
+        self.assertIsInstance(cached_trace(self.path, parse_network_trace), np.memmap)
+
+        # The cache is rebuilt when the trace changes
+        with open(self.path, "a") as f:
+            f.write("824\n")
+        self.assertEqual(cached_trace(self.path, parse_network_trace)[:, 0].tolist(),
+                         [0, 1872, 1312, 0, 416, 824])
+
+    def test_frame_trace(self):
+        path = os.path.join(self.tmp.name, "publishResult.txt")
+        with open(path, "w") as f:
+            f.write("ID:\n10 2000 1 800\nFPS=24\nID:production/mlinkm/7\n50 26 0 810\n")
+        records = cached_trace(path, parse_frame_trace)
+        self.assertEqual(records.tolist(), [[-1, 10, 2000, 1, 800, 0], [7, 50, 26, 0, 810, 1]])
+        # A cache of another layout is rebuilt
+        self.assertEqual(cached_trace(path, parse_network_trace, columns=1).shape[1], 1)
+        self.assertEqual(cached_trace(path, parse_frame_trace, columns=6).shape[1], 6)
+
+    def test_frame_trace_sections(self):
+        # Back to back anonymous sections and a publisher recorded twice
+        with tempfile.TemporaryDirectory(dir=PATH) as tmp:
+            path = os.path.join(tmp, "publishResult.txt")
+            with open(path, "w") as f:
+                f.write("ID:\n5000 10 1 800\n5040 10 0 800\nID:\n1000 10 1 800\n"
+                        "ID:production/mlinkm/3\n3000 10 1 800\n3040 10 0 800\nID:\n"
+                        "ID:production/mlinkm/3\n2000 10 1 800\n")
+            trace = FrameTrace(path[len(PATH):])
+            self.assertEqual(trace.publishers, [-1, -1, 3, 3])
+            self.assertEqual(trace.sections, [(0, 2), (2, 3), (3, 5), (5, 6)])
+            self.assertEqual([trace.first_timestamp(i) for i in range(4)], [5000, 1000, 3000, 2000])
+            records = cached_trace(PATH + path[len(PATH):], parse_frame_trace)
+            for first, stop in trace.sections:
+                self.assertTrue((np.diff(records[first:stop, 1]) >= 0).all())
+
+    def test_trace_replay(self):
+        # Frame traces are given relatively to the simulator directory
+        with tempfile.TemporaryDirectory(dir=PATH) as tmp:
+            path = os.path.join(tmp, "publishResult.txt")
+            with open(path, "w") as f:
+                f.write("ID:production/mlinkm/1\n1000 8000 1 800\n1040 2000 0 800\n"
+                        "1100 3000 0 800\nID:production/mlinkm/2\n1020 4000 1 1600\n1060 1000 0 1600\n")
+            trace = FrameTrace(path[len(PATH):])
+            self.assertEqual(trace.publishers, [1, 2])
+            self.assertEqual(trace.sections, [(0, 3), (3, 5)])
+
+            # Both recordings are replayed in parallel from t=5
+            streamers = [Streamer(streamer=str(p), qnames=["Base", "Enhanced"], priority=2,
+                                  mean_frames=[1, 2], traces=replay)
+                         for p, replay in zip(trace.publishers, trace.replays(start=5))]
+            scheduler = FIFOScheduler(streames=streamers)
+            self.assertEqual(scheduler.update(0, 5), [])
+            frames = scheduler.update(5, 5.05)
+            self.assertEqual([(f.origin, f.size, f.Iframe) for f in frames],
+                             [("1", 8, True), ("1", 2, False), ("2", 4, True)])
+            self.assertEqual(sorted([f.order - frames[0].order for f in frames]), [0, 1, 2])
+            self.assertEqual(streamers[1].queues[0].getFrames(1)[0].order, frames[0].order + 1)
+            self.assertEqual(streamers[0].queues[0].load, 5)
+            self.assertAlmostEqual(streamers[1].queues[1].getFrames(1)[0].timestamp, 5.02)
+            self.assertEqual(streamers[1].queues[1].getFrames(1)[0].bitrate, 200)
+            self.assertEqual(len(scheduler.update(5.05, 10)), 2)
+            self.assertTrue(streamers[0].traces.finished)
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def test_sweep(self):
+        scenarios = expand_grid({"scheduler": ["FIFO", "Priority"], "arrival_scale": [0.5, 1]},
+                                base=dict(expand_grid({})[0], trace=None, duration=2))
+        self.assertEqual(len(scenarios), 4)
+        self.assertEqual([(s["scheduler"], s["arrival_scale"]) for s in scenarios],
+                         [("FIFO", 0.5), ("FIFO", 1), ("Priority", 0.5), ("Priority", 1)])
+
+        rows = run_sweep(scenarios, workers=2, seed=1)
+        self.assertEqual(len(rows), 8)
+        self.assertEqual([r["streamer"] for r in rows[:2]], ["Alice", "Bob"])
+        # Independent seeds, identical for the same sweep seed
+        self.assertEqual(len({r["seed"] for r in rows}), 4)
+        self.assertEqual(run_sweep(scenarios[:1], workers=1, seed=1), rows[:2])
+        self.assertTrue(all(r["total_frame"] > 0 for r in rows))
+        self.assertEqual(len(format_table(rows).splitlines()), 9)
+
+        # QoE distributions of the runs of each streamer with different seeds
+        rows = run_sweep([dict(scenarios[0], qoe=True)] * 2, workers=1, seed=2)
+        self.assertNotEqual(rows[0]["seed"], rows[2]["seed"])
+        merged = merge_qoe(rows)
+        self.assertEqual([(r["streamer"], r["runs"]) for r in merged], [("Alice", 2), ("Bob", 2)])
+        self.assertEqual(merged[0]["frames"], rows[0]["frames"] + rows[2]["frames"])
+
+    def test_priority_contended(self):
+        # The link cannot carry both streams: nearly every frame misses its deadline
+        streamers = [dict(s, priority=p) for s, p in zip(DEFAULT_SCENARIO["streamers"], [4, 0])]
+        scenario = dict(DEFAULT_SCENARIO, streamers=streamers, batch=True, serialize=True,
+                        decision_interval=0.01, duration=10, seed=3)
+        fifo, priority = [run_scenario(dict(scenario, scheduler=name)) for name in ["FIFO", "Priority"]]
+
+        def mean_delay(row):
+            return row["total_delay"] / row["total_frame"]
+
+        # The late frames of the high priority stream are dropped instead of
+        # delaying the next ones
+        self.assertLess(mean_delay(priority[0]), mean_delay(fifo[0]) / 2)
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def test_phase_timer(self):
+        timer = PhaseTimer("decide")
+        for elapsed in [1e-6, 3e-6, 3e-6, 100e-6]:
+            timer.add(elapsed, frames=2)
+        self.assertEqual((timer.calls, timer.frames, timer.max), (4, 8, 100e-6))
+        self.assertEqual(timer.buckets[1:3], [1, 2])
+        self.assertEqual(timer.quantile(0.5), 4e-6)
+        self.assertEqual(timer.quantile(1), 100e-6)
+
+    def test_instrumentation(self):
+        simulation = make_simulation(0)
+        instrumentation = Instrumentation(simulation)
+        metrics = simulation.run(2)
+        phases = instrumentation.phases
+        self.assertEqual(phases["playback"].calls, 1)
+        self.assertEqual(phases["send"].frames, simulation.total_sent)
+        self.assertEqual(phases["receive"].frames, simulation.total_sent)
+        self.assertEqual(phases["decide"].frames, simulation.total_sent)
+        self.assertAlmostEqual(phases["update"].calls, 200, delta=1)
+        self.assertEqual(len(instrumentation.summary().splitlines()), 8)
+
+        # Instrumentation changes nothing to the results
+        instrumentation.detach()
+        self.assertNotIn("decide", vars(simulation.scheduler))
+        self.assertEqual(make_simulation(0).run(2), metrics)
+
+        out = io.StringIO()
+        self.assertEqual(profile(make_simulation(0), 2, memory=True, out=out), metrics)
+        self.assertIn("peak", out.getvalue())
+
+    def test_instrument_multicast(self):
+        simulation = make_simulation(0)
+        engine = simulation.engine
+        group = MulticastGroup([StableChannelNoWindow(bandwidth=1000, clock=engine)],
+                               ["Alice", "Bob"], fps=30, clock=engine)
+        simulation.channel = simulation.receiver = group
+        instrumentation = Instrumentation(simulation)
+        simulation.run(2)
+        # A MulticastGroup has no play_until
+        self.assertNotIn("play", instrumentation.phases)
+        self.assertEqual(instrumentation.phases["send"].frames, simulation.total_sent)
+        instrumentation.detach()
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_log_histogram(self):
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(-2, 1, 100_000)
+        h1, h2 = LogHistogram(), LogHistogram()
+        h1.add(values[:30_000])
+        h2.add(values[30_000:])
+        h1.merge(h2)
+        self.assertEqual(h1.count, len(values))
+        self.assertAlmostEqual(h1.mean(), values.mean())
+        for q in [0.5, 0.95, 0.99]:
+            self.assertAlmostEqual(h1.quantile(q) / np.quantile(values, q), 1, delta=0.07)
+        self.assertEqual(h1.quantile(1), values.max())
+
+        # Underflow and overflow buckets
+        h = LogHistogram(low=1, high=100)
+        h.add([0, 0.5, 1e6])
+        self.assertEqual((h.counts[0], h.counts[-1]), (2, 1))
+        self.assertEqual(h.quantile(0), 0)
+        self.assertEqual(h.quantile(0.5), 1)  # upper bound of the underflow bucket
+        self.assertEqual(h.quantile(1), 1e6)
+        self.assertTrue(np.isnan(LogHistogram().quantile(0.5)))
+        with self.assertRaises(ValueError):
+            h.merge(LogHistogram())
+
+    def test_qoe_accumulator(self):
+        acc = QoEAccumulator(window=10)
+        start = np.arange(0, 30, 0.5)
+        acc.add(start[:25], start[:25] - 0.1, np.full(25, 100.0), np.array([0.5]))
+        acc.add(start[25:], start[25:] - 0.2, np.full(35, 200.0), np.array([]))
+        # Windows [0, 10[ and [10, 20[ are complete, [20, 30[ is being played
+        self.assertEqual(acc.bitrate.count, 2)
+        summary = acc.summary()
+        self.assertEqual(summary["frames"], 60)
+        self.assertEqual(summary["rebuffering_events"], 1)
+        self.assertAlmostEqual(summary["rebuffering_max"], 0.5)
+        self.assertAlmostEqual(summary["delay_p99"], 0.2, delta=0.02)
+        self.assertAlmostEqual(summary["window_bitrate_mean"], (100 + (5 * 100 + 15 * 200) / 20 + 200) / 3)
+
+        merged = QoEAccumulator(window=10).merge(acc).merge(acc)
+        self.assertEqual(merged.summary()["frames"], 120)
+        self.assertEqual(merged.bitrate.count, 6)
+        # Merging leaves the accumulator merged unchanged
+        self.assertEqual(acc.bitrate.count, 2)
+        self.assertEqual(acc.current, (2, 20 * 200.0, 20))
+
+    def test_receiver_qoe(self):
+        rng = np.random.default_rng(2)
+        timestamps = np.sort(rng.random(400) * 20)
+        availability = timestamps + rng.exponential(0.3, 400)
+        frames = [Frame(5, i, False, "alice", bitrate=100 + i % 7, timestamp=t, availability=a)
+                  for i, (t, a) in enumerate(zip(timestamps.tolist(), availability.tolist()))]
+        receivers = [Receiver(queues=[Queue("alice")], fps=30, qoe=True),
+                     Receiver(queues=[Queue("alice")], fps=30, qoe=True, bounded=True)]
+        for r in receivers:
+            r.receive(frames)
+        receivers[0].playback(info=True)
+        self.assertEqual(receivers[0].qoe[0].delay.count, 0)
+        results = receivers[0].playback()
+        for t in range(1, 25):
+            receivers[1].play_until(t)
+        receivers[1].playback()
+
+        s1, s2 = [r.qoe_summary()["alice"] for r in receivers]
+        for m in s1:
+            self.assertAlmostEqual(s1[m], s2[m])
+        self.assertEqual(s1["frames"], 400)
+        self.assertEqual(s1["rebuffering_events"], results["alice"]["total_rebuffering_event"])
+        self.assertLessEqual(s1["delay_p50"], s1["delay_p99"])
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_compare(self):
+        results = benchmark.run(["streamer", "end_to_end"], nb_streamers=2, nb_layers=3, duration=1)
+        self.assertEqual(results["streamer"]["frames"] % 3, 0)
+        self.assertTrue(results["end_to_end"]["frames"] > 0)
+
+        baseline = {"streamer": {"frames": 10, "seconds": 1.0, "frames_per_second": 10.0},
+                    "queue": {"Queue": {"bytes_per_frame": 100}}}
+        results = {"streamer": {"frames": 10, "seconds": 2.0, "frames_per_second": 5.0},
+                   "queue": {"Queue": {"bytes_per_frame": 90}}}
+        comparison = benchmark.compare(results, baseline, tolerance=0.2)
+        self.assertEqual([(c[0], c[3], c[4]) for c in comparison],
+                         [("streamer/seconds", 0.5, True), ("streamer/frames_per_second", 0.5, True),
+                          ("queue/Queue/bytes_per_frame", 100 / 90, False)])
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scenario = dict(DEFAULT_SCENARIO, scheduler="FIFO", seed=3)
+
+    def test_restore(self):
+        # Running from the snapshot gives the same results as running straight
+        expected = build_simulation(self.scenario).run(20)
+        data = snapshot(warm_up(build_simulation(self.scenario), 10))
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(restore(data).run(10), expected)
+        self.assertEqual(restore(data).run(10), expected)
+
+    def test_fork(self):
+        data = snapshot(warm_up(build_simulation(self.scenario), 5))
+        simulation = fork(data, "Priority")
+        self.assertIsInstance(simulation.scheduler, PriorityBasedScheduler)
+        self.assertIs(simulation.scheduler.get_time.__self__, simulation.engine)
+        self.assertTrue(sum(q.length for q in simulation.receiver.queues) > 0)
+
+        results = compare(data, ["FIFO", "Priority"], 5, workers=0)
+        self.assertEqual(results["FIFO"], restore(data).run(5))
+        # Same arrivals after the fork
+        self.assertEqual(compare(data, ["Priority"], 5)["Priority"], results["Priority"])
+
+    def test_restore_columnar_in_subprocess(self):
+        simulation = make_simulation(3, queue_type=ColumnarQueue)
+        data = snapshot(warm_up(simulation, 2))
+        queues = simulation.receiver.queues + [q for s in simulation.scheduler.streamers for q in s.queues]
+        expected = [[f.origin for f in q.getFrames(q.length)] for q in queues]
+        self.assertTrue(any(expected))
+        # A fresh process where another origin was registered first
+        code = ("import pickle, sys\n"
+                "from stream import origin_id\n"
+                "from snapshot import restore\n"
+                "origin_id('Carol')\n"
+                "simulation = restore(sys.stdin.buffer.read())\n"
+                "queues = simulation.receiver.queues + [q for s in simulation.scheduler.streamers\n"
+                "                                       for q in s.queues]\n"
+                "origins = [[f.origin for f in q.getFrames(q.length)] for q in queues]\n"
+                "sys.stdout.buffer.write(pickle.dumps((origins, simulation.run(2))))\n")
+        result = subprocess.run([sys.executable, "-c", code], input=data, cwd=PATH,
+                                stdout=subprocess.PIPE, check=True)
+        origins, metrics = pickle.loads(result.stdout)
+        self.assertEqual(origins, expected)
+        self.assertEqual(metrics, restore(data).run(2))
+
+    def test_trace_driven(self):
+        with tempfile.TemporaryDirectory(dir=PATH) as tmp:
+            path = os.path.join(tmp, "publishResult.txt")
+            with open(path, "w") as f:
+                for publisher in [1, 2]:
+                    f.write("ID:production/mlinkm/{}\n".format(publisher))
+                    for k in range(100):
+                        f.write("{} {} {} 800\n".format(1000 + 40 * k + publisher, 4000 + 100 * (k % 7),
+                                                        int(k % 10 == 0)))
+            trace = FrameTrace(path[len(PATH):])
+
+            def build():
+                engine = EventEngine(seed=1)
+                streamers = [Streamer(streamer=str(p), qnames=["Base", "Enhanced"], priority=2,
+                                      mean_frames=[1, 2], traces=replay)
+                             for p, replay in zip(trace.publishers, trace.replays())]
+                receiver = Receiver(queues=[Queue(s.streamer) for s in streamers], fps=30, clock=engine)
+                return Simulation(FIFOScheduler(streames=streamers, rng=engine.rng),
+                                  StableChannelNoWindow(bandwidth=1000, clock=engine), receiver, engine)
+
+            expected = build().run(4)
+            data = snapshot(warm_up(build(), 2))
+            self.assertEqual(restore(data).run(2), expected)
+            self.assertEqual(restore(data).run(2), expected)
+
+
+class ArrivalsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scenario = dict(DEFAULT_SCENARIO, scheduler="FIFO", seed=5, duration=10)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "arrivals.bin")
+
+    def test_record_replay(self):
+        simulation = build_simulation(self.scenario)
+        with ArrivalRecorder(self.path, simulation.scheduler.streamers, buffer=100) as recorder:
+            simulation.scheduler.recorder = recorder
+            expected = simulation.run(10)
+        header, records = read_arrivals(self.path)
+        self.assertEqual(header, {"streamers": ["Alice", "Bob"], "layers": 2})
+        self.assertEqual(len(records), recorder.recorded)
+        self.assertEqual(records["order"].min(), 0)
+        self.assertTrue(np.all(np.diff(records["timestamp"]) >= 0))
+        self.assertEqual(os.path.getsize(self.path), 8 + 4 + 44 + 35 * len(records))
+
+        # Same seed for the decisions, other seed for the arrivals
+        simulation = build_simulation(self.scenario)
+        simulation.scheduler.rng = np.random.default_rng(1)
+        simulation.scheduler.source = ArrivalReplay(self.path)
+        self.assertEqual(simulation.run(10), expected)
+        self.assertTrue(simulation.scheduler.source.finished)
+
+    def test_replay_other_scheduler(self):
+        simulation = build_simulation(self.scenario)
+        simulation.scheduler.recorder = ArrivalRecorder(self.path, simulation.scheduler.streamers)
+        simulation.run(5)
+        simulation.scheduler.recorder.close()
+        _, records = read_arrivals(self.path)
+
+        streamers = [Streamer(queue_type=ColumnarQueue, **kwargs) for kwargs in self.scenario["streamers"]]
+        scheduler = PriorityBasedScheduler(streamers)
+        scheduler.source = ArrivalReplay(self.path)
+        frames = scheduler.update(0, 2.5) + scheduler.update(2.5, 5)
+        self.assertEqual(len(frames), len(records))
+        bob = records[records["origin"] == 1]
+        self.assertEqual(streamers[1].queues[0].column("size").tolist(), bob["sizes"][:, 0].tolist())
+        self.assertEqual(streamers[1].queues[1].column("order").tolist(), bob["order"].tolist())
+        self.assertEqual(Streamer.Frame_Arrival, records["order"].max() + 1)
+
+
+class EnvTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scenario = dict(DEFAULT_SCENARIO, duration=0.5, decision_interval=0.01)
+
+    def test_step(self):
+        env = SchedulingEnv(self.scenario)
+        obs = env.reset(seed=1)
+        self.assertEqual(obs["queues"].shape, (2, 3))
+        self.assertEqual(obs["queues"].sum(), 0)
+        for _ in range(10):
+            obs, reward, terminated, truncated, info = env.step((0, -1, 0))
+        # Nothing sent: frames wait, nothing is played
+        self.assertTrue(obs["queues"][:, 0].sum() > 0)
+        self.assertTrue(np.all(obs["queues"][:, 2] > 0))
+        self.assertEqual(reward, 0)
+        obs, reward, terminated, truncated, info = env.step((0, -1, 2))
+        self.assertEqual(info["sent"], 2)
+        self.assertEqual(env.simulation.total_sent, 2)
+        self.assertFalse(terminated or truncated)
+
+    def test_vector_env(self):
+        envs = VectorEnv(self.scenario, 3)
+        obs = envs.reset(seed=2)
+        self.assertEqual(obs["queues"].shape, (3, 2, 3))
+        self.assertEqual(obs["bandwidth"].shape, (3,))
+        rewards = []
+        for step in range(50):
+            obs, reward, terminated, truncated, infos = envs.step(greedy_actions(obs))
+            rewards.append(reward)
+        self.assertTrue(np.all(truncated))
+        self.assertFalse(np.any(terminated))
+        self.assertTrue(all("final_metrics" in info for info in infos))
+        self.assertTrue(infos[0]["final_metrics"]["Alice"]["total_frame"] > 0)
+
+        # Same episodes on worker processes
+        workers = VectorEnv(self.scenario, 3, workers=2)
+        obs = workers.reset(seed=2)
+        for step in range(50):
+            obs, reward, _, _, _ = workers.step(greedy_actions(obs))
+            np.testing.assert_allclose(reward, rewards[step])
+        workers.close()
+
+
+class EventLogTestCase(unittest.TestCase):
+
+    def run_logged(self, chunk=100, **scenario):
+        simulation = build_simulation(dict(DEFAULT_SCENARIO, seed=4, **scenario))
+        # The tables are memory-mapped: the directory is removed after the test
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "run.log")
+        with EventLog(simulation, path, chunk=chunk):
+            metrics = simulation.run(10)
+        return simulation, metrics, load(path)
+
+    def test_lifecycle(self):
+        simulation, metrics, tables = self.run_logged(scheduler="FIFO", fps=60)
+        self.assertEqual(tables["streamers"], ["Alice", "Bob"])
+        self.assertEqual(len(tables["decided"]["order"]), simulation.total_sent)
+        self.assertIsInstance(tables["sent"]["sent"], np.memmap)
+        np.testing.assert_array_equal(tables["sent"]["order"], tables["decided"]["order"])
+        self.assertEqual(len(tables["played"]["order"]), sum(m["total_frame"] for m in metrics.values()))
+        self.assertEqual(len(tables["dropped"]["order"]), 0)
+
+        frames = lifecycle(tables)
+        self.assertTrue(np.all(frames["time"] >= frames["timestamp"]))
+        self.assertTrue(np.all(frames["availability"] >= frames["sent"]))
+        self.assertTrue(np.all(frames["start"] >= frames["availability"] - 1e-9))
+        self.assertEqual(set(frames["layer"].tolist()), {0, 1})
+        alice = frames["origin"] == 0
+        self.assertAlmostEqual(np.sum(frames["start"][alice] - frames["timestamp"][alice]),
+                               metrics["Alice"]["total_delay"], places=3)
+        # The methods of the simulation are restored
+        self.assertNotIn("send_frames", vars(simulation.channel))
+        self.assertIsNone(simulation.receiver.events)
+
+    def test_dropped(self):
+        simulation, metrics, tables = self.run_logged(drop_delay=0.5, bounded=True, max_buffer=50, decision_interval=0.01)
+        dropped = tables["dropped"]
+        expired = dropped["reason"] == EXPIRED
+        self.assertEqual(expired.sum(), sum(s.dropped_frames for s in simulation.scheduler.streamers))
+        self.assertEqual((dropped["reason"] == BUFFER).sum(), sum(simulation.receiver.dropped))
+        self.assertTrue(np.all(dropped["time"][expired] - dropped["timestamp"][expired] > 0.5))
+        frames = lifecycle(tables)
+        self.assertEqual(frames["dropped"].sum(), sum(simulation.receiver.dropped))
+        self.assertTrue(np.all(np.isnan(frames["start"][frames["dropped"]])))
+        self.assertEqual(len(tables["played"]["order"]), sum(m["total_frame"] for m in metrics.values()))
+
+
+class LiveTestCase(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = WallClock()
+        bucket = TokenBucket(CapacityTrace([1000], 1), clock, burst=10)
+
+        async def consume():
+            await bucket.consume(10)
+            start = clock.get_time()
+            await bucket.consume(50)
+            return clock.get_time() - start
+
+        # The burst is free, 50 KB at 1000 KBps take 0.05 s
+        self.assertAlmostEqual(asyncio.run(consume()), 0.05, delta=0.03)
+
+    def test_run_live(self):
+        alice = Streamer("Alice", ["Base", "Enhanced"], 1, 300, 0.2, 5, [6, 10], [1, 2])
+        bob = Streamer("Bob", ["Base"], 0, 200, 0.2, 5, [6], [1])
+        scheduler = FIFOScheduler([alice, bob])
+        results, stats = run_live(scheduler, 1, receivers=2, bandwidth=10000, seed=1)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(stats["ingested_frames"] > 0)
+        self.assertEqual(stats["sent_frames"], [stats["decided_frames"]] * 2)
+        for metrics in results:
+            self.assertEqual(set(metrics), {"Alice", "Bob"})
+            self.assertEqual(sum(m["total_frame"] for m in metrics.values() if m),
+                             stats["decided_frames"])
+
+    def test_receive_refused(self):
+        # A port nobody listens on
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        with mock.patch("asyncio.sleep", mock.AsyncMock()):
+            with self.assertRaises(ConnectionRefusedError):
+                asyncio.run(receive(port, ["Alice"], 30))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
 import io
+import random
 import sys
 import os
+import numpy as np
 from time import time
 
 PATH = os.path.dirname(os.path.abspath(__file__))
@@ -13,26 +15,95 @@ def get_scaled_time(scale):
     return get_time
 
 
+def cached_trace(full_path, parse, columns=None):
+    """Return the 2-D array `parse(full_path)` memory-mapped from a binary cache.
+
+    The cache `<full_path>.npy` is written next to the text trace the first
+    time and rebuilt when the size or the modification time of the trace
+    changes, or when it does not have `columns` columns (if given). It is a flat int64 array: (size, mtime, rows, columns) of the
+    source followed by the data.
+    The array returned is read-only and its pages are shared between processes.
+    """
+    cache = full_path + ".npy"
+    stat = os.stat(full_path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    try:
+        data = np.load(cache, mmap_mode="r")
+        if data[:2].tolist() == key and columns in (None, data[3]):
+            return data[4:].reshape(data[2], data[3])
+    except (OSError, ValueError, IndexError):
+        pass
+
+    values = np.asarray(parse(full_path), dtype=np.int64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    # Write then rename so that concurrent processes never read half a file
+    tmp = "{}.{}.tmp".format(cache, os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, np.concatenate([key, values.shape, values.ravel()]).astype(np.int64))
+    os.replace(tmp, cache)
+    data = np.load(cache, mmap_mode="r")
+    return data[4:].reshape(data[2], data[3])
+
+
+def parse_network_trace(full_path):
+    "Bandwidth samples of a liveldResult trace (the digit lines)"
+    with open(full_path) as nt:
+        lines = [line.strip() for line in nt]
+    return [int(line) for line in lines if str.isdigit(line)]
+
+
+def load_network_trace(path):
+    "Return the bandwidth samples of a network trace as a memory-mapped array"
+    return cached_trace(PATH + path, parse_network_trace)[:, 0]
+
+
 def read_network_trace(path):
     "Return a generator that outputs the trace"
-    full_path = PATH + path
     def read_nt():
-        with open(full_path) as nt:
-            for line in nt:
-                line = line.strip()
-                if str.isdigit(line):
-                    yield int(line)
+        yield from load_network_trace(path).tolist()
     return read_nt
 
 
-def read_frame_trace(path):
-    "Return a generator that outputs the trace"
+def parse_frame_trace(full_path):
+    """Frame records of a publishResult trace, one row per frame:
+    (publisher, timestamp in ms, size in bytes, I frame flag, bitrate in kbps,
+    section)
+
+    The publisher is the number ending the `ID:production/...` line preceding
+    the records, -1 for an anonymous `ID:` line. The section is the index of
+    that `ID:` line (-1 before the first one). `FPS=` lines are skipped.
+    """
+    records = []
+    publisher = -1
+    section = -1
+    with open(full_path) as ft:
+        for line in ft:
+            if line.startswith("ID:"):
+                name = line.strip().rsplit("/", 1)[-1]
+                publisher = int(name) if name.isdigit() else -1
+                section += 1
+                continue
+            fields = line.split()
+            if len(fields) == 4:
+                records.append([publisher] + [int(v) for v in fields] + [section])
+    return records
+
+
+def load_frame_trace(path):
+    "Return the frame records of a frame trace as a memory-mapped array"
+    return cached_trace(PATH + path, parse_frame_trace, columns=6)
+
+
+def read_frame_trace(path, start=0, stop=None, chunk=4096):
+    """Return a generator that outputs the frame records of the rows
+    start, ..., stop - 1 of a frame trace (c.f. `load_frame_trace`).
+    Rows are read from the memory-mapped cache `chunk` at a time."""
     def read_nt():
-        with open(path) as nt:
-            for line in nt:
-                line = line.strip()
-                if str.isdigit(line):
-                    yield int(line)
+        records = load_frame_trace(path)
+        end = len(records) if stop is None else stop
+        for i in range(start, end, chunk):
+            yield from map(tuple, records[i: min(i + chunk, end)].tolist())
     return read_nt
 
 def print_metrics(d):
@@ -40,3 +111,122 @@ def print_metrics(d):
         print(streamer, ": ")
         for m in d[streamer]:
             print(" ", m, ": ", d[streamer][m])
+
+
+class IndexedSet:
+    """Set of hashable items in a list with the position of each item: add,
+    discard and uniform random choice in O(1)."""
+
+    def __init__(self, items=()):
+        self.items = []
+        self.position = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item):
+        if item not in self.position:
+            self.position[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        "Remove item if present: the last item takes its place"
+        i = self.position.pop(item, None)
+        if i is None:
+            return
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.position[last] = i
+
+    def choice(self, rand=random):
+        "Random item (the set must not be empty)"
+        return rand.choice(self.items)
+
+
+class IndexedHeap:
+    """Binary min-heap of (key, item) with the position of each item, so that
+    the key of an item can be changed or the item removed in O(log n).
+    Items must be hashable and are unique in the heap."""
+
+    def __init__(self):
+        self.heap = []
+        self.position = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def key(self, item):
+        return self.heap[self.position[item]][0]
+
+    def push(self, item, key):
+        "Insert item or change its key"
+        i = self.position.get(item)
+        if i is None:
+            self.heap.append((key, item))
+            self.position[item] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+        else:
+            old = self.heap[i][0]
+            self.heap[i] = (key, item)
+            if key < old:
+                self._sift_up(i)
+            else:
+                self._sift_down(i)
+
+    def peek(self):
+        "Return (key, item) with the smallest key"
+        return self.heap[0]
+
+    def pop(self):
+        "Remove and return (key, item) with the smallest key"
+        top = self.heap[0]
+        self.remove(top[1])
+        return top
+
+    def remove(self, item):
+        i = self.position.pop(item)
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.position[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self.position[last[1]])
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.position[heap[i][1]] = i
+        self.position[heap[j][1]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.heap[i][0] < self.heap[parent][0]:
+                self._swap(i, parent)
+                i = parent
+            else:
+                break
+
+    def _sift_down(self, i):
+        n = len(self.heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self.heap[child][0] < self.heap[smallest][0]:
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest